@@ -0,0 +1,103 @@
+"""
+Measure the memory used by 10,000 instances of each of the core `MidiBoxes`, how long it
+takes to read their attributes, and how long each one takes to handle a note.
+
+    python3 benchmarks/bench_box_instances.py            # print the results
+    python3 benchmarks/bench_box_instances.py --save     # ...and save them as the baseline
+    python3 benchmarks/bench_box_instances.py --compare  # ...and compare them with the baseline
+"""
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+from morp import Event, MidiBox, Sequencer
+from morp.effects import Autotune, Freeze, Harmonizer, Shadow
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'box_instances.json')
+
+BOXES = {
+    'MidiBox': MidiBox,
+    'Autotune': lambda: Autotune(scale={0, 3, 7, 10}),
+    'Harmonizer': lambda: Harmonizer(voices={-12, 7}),
+    'Shadow': Shadow,
+    'Freeze': Freeze,
+    'Sequencer': Sequencer,
+}
+
+
+def memory(make_box, count: int) -> float:
+    """Return the bytes needed to keep each of `count` boxes alive."""
+    gc.collect()
+    tracemalloc.start()
+    boxes = [make_box() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del boxes
+    return size / count
+
+
+def attribute_access(boxes: list, repeat: int = 20) -> float:
+    """Return the nanoseconds needed to read the attributes used by the default handlers."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for box in boxes:
+            box._notes_on  # pylint: disable=pointless-statement
+            box._capture  # pylint: disable=pointless-statement
+            box._fx_loop  # pylint: disable=pointless-statement
+            box.outputs  # pylint: disable=pointless-statement
+    return (time.perf_counter() - start) / (repeat * len(boxes) * 4) * 1e9
+
+
+def handle_note(boxes: list) -> float:
+    """Return the nanoseconds needed for each box to handle a `note_on` and a `note_off`."""
+    note_on, note_off = Event('note_on', note=60, velocity=100), Event('note_off', note=60)
+    start = time.perf_counter()
+    for box in boxes:
+        box.on_message(note_on)
+        box.on_message(note_off)
+    return (time.perf_counter() - start) / len(boxes) * 1e9
+
+
+def run(count: int) -> dict:
+    """Measure every box, and return `{box: {metric: value}}`."""
+    results = {}
+    for name, make_box in BOXES.items():
+        boxes = [make_box() for _ in range(count)]
+        results[name] = {
+            'bytes': memory(make_box, count),
+            'attribute_ns': min(attribute_access(boxes) for _ in range(3)),
+            'note_ns': min(handle_note(boxes) for _ in range(3)),
+        }
+    return results
+
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0].strip())
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare with the baseline')
+    args = parser.parse_args()
+
+    results = run(args.count)
+    baseline = {}
+    if args.compare:
+        with open(BASELINE, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print(f"{'box':>12} {'bytes/box':>10} {'attribute (ns)':>15} {'note (ns)':>10}")
+    for name, result in results.items():
+        print(f"{name:>12} {result['bytes']:>10.0f} {result['attribute_ns']:>15.1f} "
+              f"{result['note_ns']:>10.0f}")
+        previous = baseline.get(name)
+        if previous:
+            print(f"{'baseline':>12} {previous['bytes']:>10.0f} "
+                  f"{previous['attribute_ns']:>15.1f} {previous['note_ns']:>10.0f}")
+    if args.save:
+        with open(BASELINE, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
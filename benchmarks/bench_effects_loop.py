@@ -0,0 +1,57 @@
+"""
+Measure the per-message overhead of an `EffectsLoop` for chains of 1-20 `MidiBoxes`,
+using the recursive and the compiled dispatch paths, one message at a time and in batches.
+
+    python3 benchmarks/bench_effects_loop.py
+"""
+import timeit
+import mido
+from morp import MidiBox, EffectsLoop
+
+
+class Sink(MidiBox):
+    """A `MidiBox` that counts the messages it receives instead of routing them."""
+
+    def __init__(self):
+        self.count = 0
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.count += 1
+
+
+def build(length: int, compiled: bool) -> MidiBox:
+    """Build a `MidiBox` with an FX loop of `length` boxes, returning into a `Sink`."""
+    source = MidiBox(outputs=[Sink()])
+    source.assign_fx_loop(EffectsLoop([MidiBox() for _ in range(length)]), compiled=compiled)
+    return source
+
+
+def main(repeat: int = 5, number: int = 2000, batch_size: int = 64):
+    """main"""
+    note_on = mido.Message('note_on', note=60, velocity=100)
+    note_off = mido.Message('note_off', note=60)
+    batch = [note_on, note_off] * (batch_size // 2)
+    print(f"{'boxes':>5} {'recursive (us)':>15} {'compiled (us)':>14} {'speedup':>8} "
+          f"{'batched (us)':>13}")
+    for length in (1, 2, 5, 10, 20):
+        results = []
+        for compiled in (False, True):
+            source = build(length, compiled)
+
+            def run(source=source):
+                source.on_message(note_on)
+                source.on_message(note_off)
+            best = min(timeit.repeat(run, repeat=repeat, number=number))
+            results.append(best / (number * 2) * 1e6)
+
+        source = build(length, compiled=True)
+        best = min(timeit.repeat(lambda: source.on_messages(batch),
+                                 repeat=repeat, number=number // batch_size * 2))
+        results.append(best / (number // batch_size * 2 * len(batch)) * 1e6)
+        print(f'{length:>5} {results[0]:>15.2f} {results[1]:>14.2f} '
+              f'{results[0] / results[1]:>7.2f}x {results[2]:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
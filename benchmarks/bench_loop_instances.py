@@ -0,0 +1,48 @@
+"""
+Measure the time and memory needed to make 1,000 instances of one `EffectsLoop`,
+using `deepcopy` and `EffectsLoop.instance`.
+
+    python3 benchmarks/bench_loop_instances.py
+"""
+from copy import deepcopy
+import time
+import tracemalloc
+from morp import EffectsLoop, Sequencer
+from morp.effects import Autotune, Freeze, Harmonizer, Shadow
+
+
+def build() -> EffectsLoop:
+    """Build the loop template used for every instance."""
+    return EffectsLoop([Autotune(scale={0, 3, 7, 10}), Harmonizer(voices={-12, 7}),
+                        Shadow(period=16, repeat=8), Freeze(), Sequencer()])
+
+
+def measure(make_instance, count: int) -> tuple:
+    """Return the seconds and bytes needed to keep `count` instances alive."""
+    start = time.perf_counter()
+    instances = [make_instance() for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    del instances
+
+    # Tracing allocations slows everything down, so memory is measured separately
+    tracemalloc.start()
+    instances = [make_instance() for _ in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return elapsed, size
+
+
+def main(count: int = 1000):
+    """main"""
+    template = build()
+    print(f"{'method':>10} {'total (ms)':>11} {'per loop (us)':>14} {'memory (KiB)':>13}")
+    for name, make_instance in (('deepcopy', lambda: deepcopy(template)),
+                                ('instance', template.instance)):
+        elapsed, size = measure(make_instance, count)
+        print(f'{name:>10} {elapsed * 1e3:>11.1f} {elapsed / count * 1e6:>14.1f} '
+              f'{size / 1024:>13.0f}')
+
+
+if __name__ == '__main__':
+    main()
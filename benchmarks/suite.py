@@ -0,0 +1,218 @@
+"""
+Benchmark suite: drives streams of `mido.Message` objects through graphs of
+`MidiIn` -> `EffectsLoop` -> `MidiOut`, using the in-process `morp.loopback` backend.
+
+For each scenario and dispatch mode, reports:
+    - messages per second sent into the graph
+    - p50/p99 latency from a message arriving at the `MidiIn` to the `MidiOut` sending
+      everything it produced (the whole graph runs synchronously in the port callback)
+    - bytes allocated per message: the peak memory traced by `tracemalloc` while each
+      message is handled, over what was allocated before it, so objects that are created
+      and freed again along the way (copies, batches, events) are counted too
+
+    python3 benchmarks/suite.py              # run everything and print the results
+    python3 benchmarks/suite.py --save       # ...and save them as the new baseline
+    python3 benchmarks/suite.py --compare    # ...and compare them with the saved baseline
+    python3 benchmarks/suite.py --scenario note_flood --mode compiled --messages 5000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from time import perf_counter
+import mido
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+mido.set_backend('morp.loopback')
+
+# pylint: disable=wrong-import-position
+from morp import EffectsLoop, MidiService, Sequencer
+from morp.effects import Autotune, Freeze, Harmonizer, Shadow
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MODES = ('recursive', 'compiled', 'compact')
+# How much slower than the baseline a result can be before it counts as a regression
+TOLERANCE = 0.25
+# How many messages to trace allocations for, since tracing is slow
+ALLOCATION_SAMPLE = 2000
+
+
+def note_flood(count: int):
+    """Alternating note_on/note_off messages through every pitch effect."""
+    loop = EffectsLoop([Autotune(scale={0, 2, 3, 5, 7, 8, 10}), Harmonizer(voices={-12}),
+                        Shadow(period=4, repeat=2), Freeze()])
+    messages = []
+    for i in range(count // 2):
+        note = 36 + (i * 7) % 60
+        messages.append(mido.Message('note_on', note=note, velocity=100))
+        messages.append(mido.Message('note_off', note=note))
+    return loop, messages
+
+
+def clock_300bpm(count: int):
+    """24 ppqn clock driving a playing `Sequencer`, with a sixteenth note on every step."""
+    sequencer = Sequencer()
+    sequencer.pattern = {
+        tick: [mido.Message('note_on', note=48 + tick // 6, velocity=100),
+               mido.Message('note_off', note=48 + (tick // 6 + 15) % 16)]
+        for tick in range(0, 96, 6)}
+    loop = EffectsLoop([sequencer, Harmonizer(voices={7})])
+    return loop, [mido.Message('clock')] * count
+
+
+def harmonizer_fanout(count: int):
+    """Every note fanned out into a nine note chord, each of which is shadowed."""
+    loop = EffectsLoop([Harmonizer(voices={-24, -12, -5, 3, 7, 12, 19, 24}),
+                        Shadow(period=9, repeat=3)])
+    messages = []
+    for i in range(count // 2):
+        note = 40 + (i * 5) % 40
+        messages.append(mido.Message('note_on', note=note, velocity=100))
+        messages.append(mido.Message('note_off', note=note))
+    return loop, messages
+
+
+def cc_stream(count: int):
+    """A stream of control changes (e.g. a mod wheel) through every pitch effect."""
+    loop, _ = note_flood(0)
+    return loop, [mido.Message('control_change', control=1, value=i % 128) for i in range(count)]
+
+
+SCENARIOS = {
+    'note_flood': note_flood,
+    'clock_300bpm': clock_300bpm,
+    'harmonizer_fanout': harmonizer_fanout,
+    'cc_stream': cc_stream,
+}
+
+
+def build(scenario: str, mode: str, count: int):
+    """Open a loopback graph for `scenario`, and return its device, sink and messages."""
+    loop, messages = SCENARIOS[scenario](count)
+    midi_service = MidiService()
+    midi_in = midi_service.open_input(f'{scenario} in', compact=mode == 'compact')
+    midi_out = midi_service.open_output(f'{scenario} out')
+    midi_in.set_outputs([midi_out])
+    midi_in.assign_fx_loop(loop, compiled=mode != 'recursive')
+    for box in midi_in._fx_loop.boxes:  # pylint: disable=protected-access
+        if isinstance(box, Sequencer):
+            box.play()
+    device = mido.open_output(f'{scenario} in')
+    received = []
+    sink = mido.open_input(f'{scenario} out', callback=received.append)
+    return midi_service, device, sink, received, messages
+
+
+def run(scenario: str, mode: str, count: int) -> dict:
+    """Run one scenario in one mode, and return its measurements."""
+    midi_service, device, sink, received, messages = build(scenario, mode, count)
+    # Deliver straight to the port, skipping the copy that `send` makes of each message
+    send = device._send  # pylint: disable=protected-access
+
+    for message in messages[:len(messages) // 10]:
+        send(message)
+
+    received.clear()
+    latencies = []
+    start = perf_counter()
+    for message in messages:
+        sent = perf_counter()
+        send(message)
+        latencies.append(perf_counter() - sent)
+    elapsed = perf_counter() - start
+    latencies.sort()
+    output = len(received) / len(messages)
+
+    sample = messages[:ALLOCATION_SAMPLE]
+    allocated = 0
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    for message in sample:
+        received.clear()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        send(message)
+        allocated += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    gc.enable()
+
+    result = {
+        'messages_per_second': len(messages) / elapsed,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+        'allocated_bytes_per_message': allocated / len(sample),
+        'output_per_message': output,
+    }
+    device.close()
+    sink.close()
+    for midi_in in list(midi_service.open_inputs):
+        midi_service.close_input(midi_in.name)
+    for midi_out in list(midi_service.open_outputs):
+        midi_service.close_output(midi_out.name)
+    return result
+
+
+def compare(results: dict, baseline: dict) -> bool:
+    """Print how `results` compare to `baseline`, and return whether anything regressed."""
+    regressed = False
+    for scenario, modes in results.items():
+        for mode, result in modes.items():
+            previous = baseline.get(scenario, {}).get(mode)
+            if not previous:
+                continue
+            slower = result['messages_per_second'] < \
+                previous['messages_per_second'] * (1 - TOLERANCE)
+            more_allocations = result['allocated_bytes_per_message'] > \
+                previous['allocated_bytes_per_message'] * (1 + TOLERANCE) + 64
+            if slower or more_allocations:
+                regressed = True
+            print(f"{scenario:>18} {mode:>10} "
+                  f"{result['messages_per_second'] / previous['messages_per_second']:>7.2f}x "
+                  f"throughput, {result['allocated_bytes_per_message']:.0f} bytes allocated "
+                  f"(was {previous['allocated_bytes_per_message']:.0f})"
+                  f"{'  REGRESSION' if slower or more_allocations else ''}")
+    return regressed
+
+
+def main():
+    """main"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n', maxsplit=1)[0])
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append')
+    parser.add_argument('--mode', choices=MODES, action='append')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare with the baseline')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'scenario':>18} {'mode':>10} {'msg/s':>10} {'p50 (us)':>9} {'p99 (us)':>9} "
+          f"{'alloc B/msg':>11} {'out/msg':>8}")
+    for scenario in args.scenario or SCENARIOS:
+        for mode in args.mode or MODES:
+            result = results.setdefault(scenario, {})[mode] = run(scenario, mode, args.messages)
+            print(f"{scenario:>18} {mode:>10} {result['messages_per_second']:>10.0f} "
+                  f"{result['p50_us']:>9.1f} {result['p99_us']:>9.1f} "
+                  f"{result['allocated_bytes_per_message']:>11.0f} "
+                  f"{result['output_per_message']:>8.2f}")
+    if 'clock_300bpm' in results:
+        # 300 BPM at 24 ppqn is 120 clock messages per second
+        for mode, result in results['clock_300bpm'].items():
+            print(f"clock_300bpm ({mode}) runs at "
+                  f"{result['messages_per_second'] / 120:.0f}x real time")
+
+    regressed = False
+    if args.compare:
+        with open(BASELINE, encoding='utf-8') as baseline:
+            regressed = compare(results, json.load(baseline))
+    if args.save:
+        with open(BASELINE, 'w', encoding='utf-8') as baseline:
+            json.dump(results, baseline, indent=2, sort_keys=True)
+            baseline.write('\n')
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,41 @@
-"""morp main exports"""
-from .midi_box import MidiBox, MidiIn, MidiOut, EffectsLoop
-from .midi_service import MidiService
-from .sequencer import Sequencer
+"""
+morp main exports
 
-__all__ = ['MidiBox', 'MidiIn', 'MidiOut',
-           'MidiService', 'EffectsLoop', 'Sequencer']
+Each export is imported the first time it is used, so `import morp` stays cheap, and MIDI
+backends (and NumPy) are only loaded once something actually needs them.
+"""
+from importlib import import_module
+
+__version__ = '0.0.1'
+
+_EXPORTS = {
+    'Clock': 'clock',
+    'ClockDivider': 'clock',
+    'ClockMultiplier': 'clock',
+    'Event': 'events',
+    'MidiBox': 'midi_box',
+    'MidiIn': 'midi_box',
+    'MidiOut': 'midi_box',
+    'EffectsLoop': 'midi_box',
+    'MidiService': 'midi_service',
+    'PatchBay': 'patch_bay',
+    'PatchError': 'patch',
+    'Scheduler': 'scheduler',
+    'load_patch': 'patch',
+    'Sequencer': 'sequencer',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_EXPORTS])
@@ -0,0 +1,45 @@
+"""
+aio.py
+"""
+import asyncio
+from collections import deque
+from typing import Any, List
+
+
+class Bridge:
+    """
+    A `Bridge` moves items from any number of backend threads onto an asyncio event loop.
+    Producers call `push` from their own threads, and a single consumer on the event loop
+    awaits `get_batch`. The event loop is only woken by the first item pushed after the
+    consumer last caught up, and everything that arrived by then is handed over as one batch.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._pending = deque()
+        self._scheduled = False
+        self._ready = asyncio.Event()
+
+    def push(self, item: Any):
+        """Add an item from any thread."""
+        self._pending.append(item)
+        if not self._scheduled:
+            self._scheduled = True
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # The event loop has been closed, so nobody is waiting for this item
+                pass
+
+    def _wake(self):
+        self._scheduled = False
+        self._ready.set()
+
+    async def get_batch(self) -> List[Any]:
+        """Wait for at least one item, and return every item pushed so far, in order."""
+        while not self._pending:
+            self._ready.clear()
+            await self._ready.wait()
+        # Items pushed while draining are left for the next batch
+        popleft = self._pending.popleft
+        return [popleft() for _ in range(len(self._pending))]
@@ -0,0 +1,274 @@
+"""
+clock.py
+"""
+import threading
+from functools import partial
+from time import perf_counter, sleep
+from typing import Dict, Iterable
+from weakref import WeakSet
+import mido
+from .dispatcher import active_dispatcher
+from .events import Event
+from .midi_box import MidiBox
+from .scheduler import default_scheduler
+
+CLOCK = Event('clock')
+START = Event('start')
+STOP = Event('stop')
+TRANSPORT_TYPES = frozenset(('start', 'continue', 'stop'))
+
+
+class Clock:
+    """
+    A `Clock` is an internal MIDI clock source. It sends 24 `clock` messages per quarter note
+    at the given `bpm` from a dedicated thread, to any number of targets (e.g. `Sequencers`,
+    or `MidiOuts` that should follow this clock).
+
+    Every tick is scheduled against an absolute deadline (`start + n * interval`), rather than
+    relative to the previous tick, so timing errors don't accumulate. The thread sleeps until
+    shortly before each deadline, and then waits for the rest of the time by polling the
+    high-resolution timer. While a `MidiService` runs a `Dispatcher`, the ticks are handed to
+    its thread instead of being sent from the clock's own.
+    """
+    PPQN = 24
+
+    def __init__(self, bpm: float = 120.0, targets: Iterable = None, spin: float = 0.0005):
+        """
+        Arguments:
+            - `bpm`: the tempo, in quarter notes per minute
+            - `targets`: the `MidiBoxes` that should receive clock messages
+            - `spin`: how long before each deadline to stop sleeping, in seconds
+        """
+        self._bpm = bpm
+        self._interval = 60 / (bpm * self.PPQN)
+        # Targets are held weakly, so that discarded loop instances stop receiving ticks,
+        # which means something else (e.g. a MidiIn or an EffectsLoop) has to keep them alive
+        self._targets = WeakSet(targets or ())
+        self._spin = spin
+        self._thread = None
+        self._running = False
+        self._anchor = 0.0
+        self._ticks_since_anchor = 0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._ticks = 0
+        self._lateness_total = 0.0
+        self._lateness_max = 0.0
+        self._last_lateness = 0.0
+
+    def __deepcopy__(self, _memo):
+        # Copies of the boxes that follow this clock should keep following it
+        return self
+
+    @property
+    def bpm(self) -> float:
+        """Get the tempo, in quarter notes per minute"""
+        return self._bpm
+
+    @bpm.setter
+    def bpm(self, bpm: float):
+        # Schedule the following ticks from the most recent deadline at the new tempo
+        self._anchor += self._ticks_since_anchor * self._interval
+        self._ticks_since_anchor = 0
+        self._bpm = bpm
+        self._interval = 60 / (bpm * self.PPQN)
+
+    @property
+    def running(self) -> bool:
+        """Get whether the clock is currently sending ticks"""
+        return self._running
+
+    def add_target(self, target):
+        """Start sending clock messages to `target`."""
+        self._targets.add(target)
+
+    def remove_target(self, target):
+        """Stop sending clock messages to `target`."""
+        self._targets.discard(target)
+
+    def _send(self, message: mido.Message):
+        dispatcher = active_dispatcher()
+        if dispatcher is not None:
+            # The graph runs on the dispatcher's thread, so the ticks have to as well
+            dispatcher.call(partial(self._deliver, message))
+        else:
+            self._deliver(message)
+
+    def _deliver(self, message: mido.Message):
+        for target in list(self._targets):
+            target.on_message(message)
+
+    def tick(self):
+        """Send a single clock message to every target right away."""
+        self._send(CLOCK)
+
+    def start(self):
+        """Send a `start` message to every target, and start ticking from a dedicated thread."""
+        if self._running:
+            return
+        self._reset_stats()
+        self._send(START)
+        self._running = True
+        self._anchor = perf_counter()
+        self._ticks_since_anchor = 0
+        self._thread = threading.Thread(target=self._run, name='morp clock', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop ticking, and send a `stop` message to every target."""
+        if not self._running:
+            return
+        self._running = False
+        # A target that stops the clock from its own thread can't wait for that thread to end,
+        # but it ends after the current tick anyway
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._thread = None
+        self._send(STOP)
+
+    def _run(self):
+        while self._running:
+            deadline = self._anchor + self._ticks_since_anchor * self._interval
+            remaining = deadline - perf_counter()
+            if remaining > self._spin:
+                sleep(remaining - self._spin)
+            while perf_counter() < deadline:
+                pass
+            lateness = perf_counter() - deadline
+            self.tick()
+            self._ticks_since_anchor += 1
+            self._ticks += 1
+            self._lateness_total += lateness
+            self._lateness_max = max(self._lateness_max, lateness)
+            self._last_lateness = lateness
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return how many ticks have been sent since `start`, their mean and maximum jitter
+        (how late each tick was sent relative to its deadline), and the drift (how far the
+        most recent tick was from where an ideal clock would have put it), in microseconds.
+        """
+        return {
+            'ticks': self._ticks,
+            'jitter_mean_us': self._lateness_total / self._ticks * 1e6 if self._ticks else 0.0,
+            'jitter_max_us': self._lateness_max * 1e6,
+            'drift_us': self._last_lateness * 1e6,
+        }
+
+
+class ClockDivider(MidiBox):
+    """
+    A `ClockDivider` passes one of every `division` clock messages along (e.g. 24 for one
+    pulse per quarter note), and everything else as-is. Pulses are counted from the most
+    recent `start` (or song position), so they stay on the beat; `continue` carries on
+    counting from where the clock stopped.
+    """
+    __slots__ = ('division', '_count')
+    handles = frozenset(('clock', 'songpos')) | TRANSPORT_TYPES
+
+    def __init__(self, division: int = 2):
+        self.division = division
+        super().__init__()
+
+    def _init_state(self):
+        super()._init_state()
+        self._count = 0
+
+    def on_clock(self, message: mido.Message):
+        if self._count % self.division == 0:
+            self.route_message(message)
+        self._count += 1
+
+    def on_note(self, message: mido.Message):
+        if message.type == 'start':
+            self._count = 0
+        elif message.type == 'songpos':
+            # Song position is counted in sixteenth notes, which are 6 clocks each
+            self._count = message.pos * 6
+        super().on_note(message)
+
+
+class ClockMultiplier(MidiBox):
+    """
+    A `ClockMultiplier` sends `factor` clock messages for each one it receives: the incoming
+    one right away, and the rest evenly spaced over the time until the next one is expected
+    (measured from the previous two), on the shared `Scheduler`. Each incoming clock realigns
+    the pulses, sending any that are still due straight away, so the count of pulses per beat
+    is always exact. `stop` drops the pulses that are still due, and the spacing is kept for
+    the next `start` or `continue`.
+    """
+    __slots__ = ('factor', '_last_clock', '_period', '_generation', '_owed', '_timers', '_lock')
+    handles = frozenset(('clock',)) | TRANSPORT_TYPES
+    realtime = True
+
+    def __init__(self, factor: int = 2):
+        self.factor = factor
+        super().__init__()
+
+    def _init_state(self):
+        super()._init_state()
+        self._last_clock = None
+        self._period = None
+        self._generation = 0
+        self._owed = 0
+        self._timers = []
+        # Guards the pulse counters, which the `Scheduler` thread changes as well
+        self._lock = threading.Lock()
+
+    def __reduce_ex__(self, protocol):
+        # Locks can't be copied, so copies are made without this one, and `clone` gives them
+        # their own from `_init_state`
+        reduced = list(super().__reduce_ex__(protocol))
+        state, slots = reduced[2]
+        reduced[2] = (state, {name: value for name, value in slots.items() if name != '_lock'})
+        return tuple(reduced)
+
+    def _drop_pulses(self) -> int:
+        """Cancel the pulses that are still due, and return how many there were."""
+        for timer in self._timers:
+            self.cancel(timer)
+        self._timers = []
+        self._generation += 1
+        owed, self._owed = self._owed, 0
+        return owed
+
+    def on_clock(self, message: mido.Message):
+        now = perf_counter()
+        # Only the counters are guarded: messages are routed without holding the lock
+        with self._lock:
+            owed = self._drop_pulses()
+            if self._last_clock is not None:
+                self._period = now - self._last_clock
+            self._last_clock = now
+            period, generation = self._period, self._generation
+            if period and self.factor > 1:
+                self._owed = self.factor - 1
+        # Whatever was still due from the previous clock goes out before this one
+        for _ in range(owed):
+            self.route_message(CLOCK)
+        self.route_message(message)
+        if period and self.factor > 1:
+            scheduler = default_scheduler()
+            timers = [scheduler.schedule(period * pulse / self.factor, self._pulse, generation)
+                      for pulse in range(1, self.factor)]
+            with self._lock:
+                if generation == self._generation:
+                    self._timers = timers
+                else:
+                    for timer in timers:
+                        scheduler.cancel(timer)
+
+    def on_note(self, message: mido.Message):
+        if message.type in TRANSPORT_TYPES:
+            with self._lock:
+                self._drop_pulses()
+                self._last_clock = None
+        super().on_note(message)
+
+    def _pulse(self, generation: int):
+        with self._lock:
+            if generation != self._generation or not self._owed:
+                return
+            self._owed -= 1
+        self.route_message(CLOCK)
@@ -0,0 +1,134 @@
+"""
+dispatcher.py
+"""
+import threading
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Union
+
+
+class Dispatcher:
+    """
+    A `Dispatcher` runs the whole effects graph on a single thread. Any number of backend
+    threads `push` messages onto a shared queue, with the time they arrived, and the
+    dispatcher thread hands them to their `MidiIns` in batches, in the order they arrived.
+    Since only one thread ever runs the `MidiBoxes`, their state needs no locks, however many
+    inputs feed them.
+
+    Pushing only appends to a `deque`, and the dispatcher thread is only woken by the first
+    message pushed after it ran out of messages, so producers hardly ever contend.
+    """
+
+    def __init__(self):
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._sleeping = False
+        self._running = False
+        self._thread = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._messages = 0
+        self._batches = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        """Get whether the dispatcher thread is running"""
+        return self._running
+
+    def push(self, target: Any, message: Any):
+        """Queue `message` for `target` (usually a `MidiIn`), from any thread."""
+        self._pending.append((perf_counter(), target, message))
+        if self._sleeping:
+            self._sleeping = False
+            self._wake.set()
+
+    def call(self, function: Callable[[], None]):
+        """Run `function` on the dispatcher thread, after everything queued before it."""
+        self.push(None, function)
+
+    def start(self):
+        """Start the dispatcher thread."""
+        if self._running:
+            return
+        self._reset_stats()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='morp dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Process whatever is still queued, and stop the dispatcher thread."""
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while self._running or self._pending:
+            if not self._pending:
+                self._sleeping = True
+                # Anything pushed before `_sleeping` was set has to be picked up here
+                if not self._pending and self._running:
+                    self._wake.wait()
+                self._wake.clear()
+                self._sleeping = False
+                continue
+            try:
+                self._dispatch(self._drain())
+            except Exception as error:  # pylint: disable=broad-except
+                print(error)
+
+    def _drain(self) -> List[tuple]:
+        # Messages pushed while draining are left for the next batch
+        popleft = self._pending.popleft
+        return [popleft() for _ in range(len(self._pending))]
+
+    def _dispatch(self, batch: List[tuple]):
+        now = perf_counter()
+        self._batches += 1
+        self._messages += len(batch)
+        # The first message in the batch is the one that waited the longest
+        self._wait_total += now * len(batch) - sum(item[0] for item in batch)
+        self._wait_max = max(self._wait_max, now - batch[0][0])
+        # Hand each run of messages for the same target over at once
+        for target, items in groupby(batch, key=itemgetter(1)):
+            if target is None:
+                for _, _, function in items:
+                    function()
+            else:
+                target.receive([message for _, _, message in items])
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return how many messages and batches have been dispatched since `start`, and the
+        mean and maximum time that messages waited in the queue, in microseconds.
+        """
+        return {
+            'messages': self._messages,
+            'batches': self._batches,
+            'wait_mean_us': self._wait_total / self._messages * 1e6 if self._messages else 0.0,
+            'wait_max_us': self._wait_max * 1e6,
+        }
+
+
+_active = None
+
+
+def active_dispatcher() -> Union[Dispatcher, None]:
+    """Return the `Dispatcher` that the graph is currently running on, if there is one."""
+    return _active
+
+
+def set_active_dispatcher(dispatcher: Union[Dispatcher, None]):
+    """
+    Make `dispatcher` the one that threads outside the graph (e.g. a `Clock`) hand their
+    messages to, or go back to running the graph on those threads with `None`.
+    """
+    global _active  # pylint: disable=global-statement
+    _active = dispatcher
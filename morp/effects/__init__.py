@@ -1,6 +1,8 @@
 """effects.__init__.py"""
+from .delay import Delay
 from .harmonizer import Autotune, Harmonizer
 from .freeze import Freeze
+from .note_limit import NoteLengthLimit
 from .shadow import Shadow
 
-__all__ = ['Autotune', 'Freeze', 'Harmonizer', 'Shadow']
+__all__ = ['Autotune', 'Delay', 'Freeze', 'Harmonizer', 'NoteLengthLimit', 'Shadow']
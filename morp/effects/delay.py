@@ -0,0 +1,118 @@
+"""delay.py"""
+from collections import deque
+from typing import Callable, List, Tuple
+import mido
+from ..events import Event
+from ..midi_box import MidiBox
+
+
+class Delay(MidiBox):
+    """
+    `Delay` echoes each note back `repeats` times, `time` seconds apart, each echo quieter than
+    the one before it by `decay`. Echoes are scheduled on the shared `Scheduler` as soon as a
+    note is received, and the `note_off` of each note is echoed the same way, so every echo
+    is as long as the note it echoes. Echoes that are still pending are dropped on `panic`.
+
+    When a note is longer than `time`, its echoes overlap it (and each other). Each echo is
+    then sent as a `note_off` followed by a new `note_on`, and the pitch is only released by
+    the `note_off` of the last voice still sounding it, so no echo is cut short.
+    """
+    __slots__ = ('time', '_repeats', '_decay', '_velocities', '_timers', '_voices')
+
+    _shares_config = True
+    realtime = True
+
+    def __init__(self, time: float = 0.25, repeats: int = 3, decay: float = 0.5):
+        self.time = time
+        self._repeats = repeats
+        self._decay = decay
+        self._velocities = self._compile()
+        super().__init__()
+
+    def _init_state(self):
+        super()._init_state()
+        # Scheduled echoes, roughly in the order they are due
+        self._timers = deque()
+        # How many voices (the note itself, and its echoes) are sounding each (channel, note)
+        self._voices = {}
+
+    def _compile(self) -> Tuple[Tuple[int]]:
+        """Map each velocity to its decayed value, for each repeat."""
+        levels = []
+        velocities = range(128)
+        for _ in range(self._repeats):
+            # An echo never decays into silence, so that it always has a note_off to match
+            velocities = tuple(min(127, max(1, round(velocity * (1 - self._decay))))
+                               for velocity in velocities)
+            levels.append(velocities)
+        return tuple(levels)
+
+    @property
+    def decay(self) -> float:
+        """Get how much each echo should have its velocity reduced by"""
+        return self._decay
+
+    @decay.setter
+    def decay(self, decay: float):
+        self._decay = decay
+        self._velocities = self._compile()
+
+    @property
+    def repeats(self) -> int:
+        """Get how many times each note is echoed back"""
+        return self._repeats
+
+    @repeats.setter
+    def repeats(self, repeats: int):
+        self._repeats = repeats
+        self._velocities = self._compile()
+
+    def on_note_on(self, message: mido.Message):
+        if self._notes_on.add(message.channel, message.note):
+            self._sound(message)
+            for repeat, velocities in enumerate(self._velocities, 1):
+                self._echo(repeat, message.copy(velocity=velocities[message.velocity]),
+                           self._sound)
+
+    def on_note_off(self, message: mido.Message):
+        if not self._notes_on.is_held(message.channel, message.note):
+            self.route_message(message)
+            return
+        self._notes_on.discard(message.channel, message.note)
+        self._release(message)
+        for repeat in range(1, self._repeats + 1):
+            self._echo(repeat, message, self._release)
+
+    def _sound(self, message: mido.Message):
+        """Start a voice, re-triggering the pitch if another voice is already sounding it."""
+        key = (message.channel, message.note)
+        voices = self._voices.get(key, 0)
+        if voices:
+            self.route_message(Event('note_off', message.channel, message.note))
+        self._voices[key] = voices + 1
+        self.route_message(message)
+
+    def _release(self, message: mido.Message):
+        """End a voice, releasing the pitch once no other voice is sounding it."""
+        key = (message.channel, message.note)
+        voices = self._voices.pop(key, 0) - 1
+        if voices > 0:
+            self._voices[key] = voices
+        else:
+            self.route_message(message)
+
+    def _echo(self, repeat: int, message: mido.Message,
+              handler: Callable[[mido.Message], None]):
+        timers = self._timers
+        while timers and not timers[0].pending:
+            timers.popleft()
+        timers.append(self.schedule(self.time * repeat, message, handler))
+
+    def release_notes(self) -> List[Event]:
+        """Drop the pending echoes, and release the echoes that are sounding as well."""
+        for timer in self._timers:
+            self.cancel(timer)
+        self._timers.clear()
+        super().release_notes()
+        voices, self._voices = self._voices, {}
+        return [Event('note_off', channel, note) for channel, note in sorted(voices)]
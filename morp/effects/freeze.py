@@ -1,5 +1,6 @@
 """Freeze effect"""
-from mido import Message
+from typing import List
+from ..events import Event
 from ..midi_box import MidiBox
 
 
@@ -10,15 +11,17 @@ class Freeze(MidiBox):
     all previously received `note_on` events. All deferred calls to `note_off` are sent
     on a subsequent `note_on` event.
     """
+    __slots__ = ('_frozen', '_frozen_notes')
 
-    def __init__(self):
+    def _init_state(self):
+        super()._init_state()
         self._frozen = False
-        self._frozen_notes = set()
-        super().__init__()
+        # Deferred note_off messages, keyed by channel and note
+        self._frozen_notes = {}
 
     def _cancel_freeze(self) -> None:
-        for note in self._frozen_notes:
-            super().on_note_off(Message('note_off', note=note))
+        for message in self._frozen_notes.values():
+            super().on_note_off(message)
         self._frozen = False
         self._notes_on.clear()
         self._frozen_notes.clear()
@@ -35,10 +38,17 @@ class Freeze(MidiBox):
         Suppress a call to `super().on_note_off`.
         If this was the last note in a group to be released, begin the freeze.
         """
-        self._frozen_notes.add(message.note)
+        self._frozen_notes[message.channel << 7 | message.note] = message
 
         # If turning this note off will result in 0 remaining, turn the freeze on.
         if len(self._notes_on) == 1:
             self._frozen = True
 
-        self._notes_on.discard(message.note)
+        self._notes_on.discard(message.channel, message.note)
+
+    def release_notes(self) -> List[Event]:
+        """Forget the frozen notes as well as the held ones."""
+        note_offs = [*self._frozen_notes.values(), *super().release_notes()]
+        self._frozen = False
+        self._frozen_notes.clear()
+        return note_offs
@@ -1,7 +1,7 @@
 """Harmonizer effects"""
-from typing import List, Set
+from typing import List, Set, Tuple
 from mido import Message
-from ..midi_box import MidiBox
+from ..midi_box import NOTE_TYPES, MidiBox
 
 
 class Autotune(MidiBox):
@@ -14,13 +14,44 @@ class Autotune(MidiBox):
     to their nearest neighbor within the scale.
 
     When `autocorrect=False` is used, notes that do not fall within the scale are ignored entirely.
+
+    The corrected pitch of every note is precompiled into a lookup table whenever `scale`
+    or `autocorrect` changes, so that handling a note doesn't require searching the scale.
     """
+    __slots__ = ('_scale', '_autocorrect', '_corrections')
+
+    _shares_config = True
 
     def __init__(self, scale: Set[int] = None, autocorrect: bool = True):
         self._scale = scale or set()
         self._autocorrect = autocorrect
+        self._corrections = self._compile()
         super().__init__()
 
+    def _compile(self) -> Tuple[int]:
+        """
+        Map each of the 128 MIDI notes to the note it should be played as,
+        or to `None` if it should be ignored.
+        """
+        scale = sorted(self._scale)
+        corrections = []
+        for note in range(128):
+            tone = note % 12
+            if tone in self._scale:
+                corrections.append(note)
+                continue
+            # Find the scale note that is closest to this note in either direction,
+            # moving to a neighboring octave only when it would fall outside of 0-127
+            candidates = [note + scale_note - tone for scale_note in scale
+                          if 0 <= note + scale_note - tone <= 127] or \
+                [note + scale_note - tone + octave for scale_note in scale for octave in (-12, 12)
+                 if 0 <= note + scale_note - tone + octave <= 127]
+            if self._autocorrect and candidates:
+                corrections.append(min(candidates, key=lambda candidate: abs(candidate - note)))
+            else:
+                corrections.append(None)
+        return tuple(corrections)
+
     @property
     def scale(self) -> set:
         """Return the set of allowable scale tones."""
@@ -29,6 +60,7 @@ class Autotune(MidiBox):
     @scale.setter
     def scale(self, scale: Set[int]) -> None:
         self._scale = set(scale)
+        self._corrections = self._compile()
 
     @property
     def autocorrect(self) -> bool:
@@ -38,29 +70,46 @@ class Autotune(MidiBox):
     @autocorrect.setter
     def autocorrect(self, autocorrect: bool) -> None:
         self._autocorrect = autocorrect
+        self._corrections = self._compile()
 
     def on_note(self, message: Message) -> None:
         """Restrict the note to the provided scale, and proceed as normal."""
-        note = message.note % 12
-        if note in self.scale:
+        corrected = self._corrections[message.note]
+        if corrected == message.note:
             super().on_note(message)
-        elif self.autocorrect:
-            # Find the scale note that is closest to this note in either direction
-            new_note = message.note + \
-                min([scale_note - note for scale_note in self.scale], key=abs)
-            super().on_note(message.copy(note=new_note))
+        elif corrected is not None:
+            super().on_note(message.copy(note=corrected))
 
 
 class Harmonizer(MidiBox):
     """
     `Harmonizer is a MIDI effect that overlays additional notes upon receiving
     `note_on` messages.
+
+    The chord for every note is precompiled into a lookup table whenever `voices` changes.
+    Voices that fall outside of 0-127, or that duplicate another note in the chord, are dropped.
     """
+    __slots__ = ('_voices', '_chords')
+
+    _shares_config = True
 
     def __init__(self, voices: Set[int]):
         self._voices = voices or set()
+        self._chords = self._compile()
         super().__init__()
 
+    def _compile(self) -> Tuple[Tuple[int]]:
+        """Map each of the 128 MIDI notes to the additional notes that harmonize it."""
+        chords = []
+        for note in range(128):
+            chord = []
+            for voice in self._voices:
+                harmony = note + voice
+                if 0 <= harmony <= 127 and harmony != note and harmony not in chord:
+                    chord.append(harmony)
+            chords.append(tuple(chord))
+        return tuple(chords)
+
     @property
     def voices(self) -> Set[int]:
         """Return the current voices to overlay on incoming messages"""
@@ -69,6 +118,9 @@ class Harmonizer(MidiBox):
     @voices.setter
     def voices(self, voices: Set[int]):
         self._voices = voices
+        self._chords = self._compile()
 
     def modifier(self, message: Message) -> List[Message]:
-        return [message, *[message.copy(note=message.note + voice) for voice in self.voices]]
+        if message.type not in NOTE_TYPES:
+            return message
+        return [message, *[message.copy(note=note) for note in self._chords[message.note]]]
@@ -0,0 +1,52 @@
+"""note_limit.py"""
+from typing import List
+import mido
+from ..events import Event
+from ..midi_box import MidiBox
+
+
+class NoteLengthLimit(MidiBox):
+    """
+    `NoteLengthLimit` guards against stuck notes: any note that is held for longer than
+    `max_length` seconds is sent a `note_off` by the limit itself. The `note_off` is scheduled
+    on the shared `Scheduler` when the note starts, and cancelled when the note ends in time.
+    """
+    __slots__ = ('max_length', '_timers')
+    realtime = True
+
+    def __init__(self, max_length: float = 4.0):
+        self.max_length = max_length
+        super().__init__()
+
+    def _init_state(self):
+        super()._init_state()
+        # The scheduled note_off of each held note, by channel and note
+        self._timers = [None] * 2048
+
+    def on_note_on(self, message: mido.Message):
+        if self._notes_on.add(message.channel, message.note):
+            self.route_message(message)
+            self._timers[message.channel << 7 | message.note] = self.schedule(
+                self.max_length, Event('note_off', message.channel, message.note), self._expire)
+
+    def on_note_off(self, message: mido.Message):
+        index = message.channel << 7 | message.note
+        timer = self._timers[index]
+        if timer is not None:
+            self.cancel(timer)
+            self._timers[index] = None
+        super().on_note_off(message)
+
+    def _expire(self, message: Event):
+        """Release a note that has been held for too long."""
+        self._timers[message.channel << 7 | message.note] = None
+        if self._notes_on.is_held(message.channel, message.note):
+            super().on_note_off(message)
+
+    def release_notes(self) -> List[Event]:
+        """Cancel the scheduled note_offs as well as forgetting the held notes."""
+        for index, timer in enumerate(self._timers):
+            if timer is not None:
+                self.cancel(timer)
+                self._timers[index] = None
+        return super().release_notes()
@@ -1,7 +1,7 @@
 """shadow.py"""
-from typing import List
+from typing import List, Tuple
 import mido
-from ..midi_box import MidiBox
+from ..midi_box import NOTE_TYPES, MidiBox
 
 
 class Shadow(MidiBox):
@@ -10,16 +10,52 @@ class Shadow(MidiBox):
     is that unlike a delay, `Shadow` does not have an interval of time that defines when
     a note will be echoed back. Instead, `Shadow` can serve requests like "echo this note
     back to me after 3 additional notes have passed".
+
+    Received notes are kept in a ring buffer of `period * repeat` messages. Echoes are new
+    copies of the cached messages, with velocities taken from a table precomputed for each
+    repeat level, so messages that were already sent are never modified.
     """
+    __slots__ = ('_period', '_decay', '_repeat', '_length', '_velocities', '_message_cache',
+                 '_head', '_cached')
+
+    _shares_config = True
 
     def __init__(self, period: int = 4, decay: float = 0.5, repeat: int = 2):
         self._period = period
         self._decay = decay
         self._repeat = repeat
         self._length = period * repeat
-        self._message_cache = []
+        self._velocities = self._compile()
         super().__init__()
 
+    def _init_state(self):
+        super()._init_state()
+        self._message_cache = [None] * self._length
+        # The index where the next message will be cached, and how many are cached
+        self._head = 0
+        self._cached = 0
+
+    def _compile(self) -> Tuple[Tuple[int]]:
+        """Map each velocity to its decayed value, for each repeat level."""
+        levels = []
+        velocities = range(128)
+        for _ in range(self._repeat):
+            velocities = tuple(min(127, max(0, round(velocity * (1 - self._decay))))
+                               for velocity in velocities)
+            levels.append(velocities)
+        return tuple(levels)
+
+    def _resize(self):
+        """Resize the message cache to `period * repeat`, keeping the most recent messages."""
+        recent = [self._message_cache[(self._head - age) % self._length]
+                  for age in range(min(self._cached, self._length), 0, -1)] \
+            if self._length else []
+        self._length = self._period * self._repeat
+        recent = recent[len(recent) - self._length:] if self._length else []
+        self._message_cache = [*recent, *[None] * (self._length - len(recent))]
+        self._cached = len(recent)
+        self._head = self._cached % self._length if self._length else 0
+
     @property
     def decay(self):
         """Get how much each successive appearance of a note should have its velocity reduced by"""
@@ -28,6 +64,7 @@ class Shadow(MidiBox):
     @decay.setter
     def decay(self, decay: float):
         self._decay = decay
+        self._velocities = self._compile()
 
     @property
     def period(self) -> int:
@@ -37,7 +74,7 @@ class Shadow(MidiBox):
     @period.setter
     def period(self, period: int):
         self._period = period
-        self._length = period * self.repeat
+        self._resize()
 
     @property
     def repeat(self) -> int:
@@ -47,15 +84,23 @@ class Shadow(MidiBox):
     @repeat.setter
     def repeat(self, repeat: int):
         self._repeat = repeat
-        self._length = self.period * repeat
+        self._resize()
+        self._velocities = self._compile()
 
     def modifier(self, message: mido.Message) -> List[mido.Message]:
+        if message.type not in NOTE_TYPES or not self._length:
+            return message
         messages = [message]
-        for i in range(self.period - 1, len(self._message_cache), self.period):
-            self._message_cache[i].velocity = round(
-                self._message_cache[i].velocity * (1 - self.decay))
-            messages.append(self._message_cache[i])
-        self._message_cache.insert(0, message)
-        if len(self._message_cache) > self._length:
-            self._message_cache.pop()
+        cache, head, period, length = self._message_cache, self._head, self._period, self._length
+        age = period
+        for velocities in self._velocities:
+            if age > self._cached:
+                break
+            echo = cache[(head - age) % length]
+            messages.append(echo.copy(velocity=velocities[echo.velocity]))
+            age += period
+        cache[head] = message
+        self._head = (head + 1) % length
+        if self._cached < length:
+            self._cached += 1
         return messages
@@ -0,0 +1,196 @@
+"""
+events.py
+"""
+from typing import List, Union
+import mido
+
+# Status bytes for the channel messages that `Event` can represent
+CHANNEL_STATUS = {
+    'note_off': 0x80,
+    'note_on': 0x90,
+    'polytouch': 0xA0,
+    'control_change': 0xB0,
+    'program_change': 0xC0,
+    'aftertouch': 0xD0,
+    'pitchwheel': 0xE0,
+}
+
+# Status bytes for the system real-time messages that `Event` can represent
+SYSTEM_STATUS = {
+    'clock': 0xF8,
+    'start': 0xFA,
+    'continue': 0xFB,
+    'stop': 0xFC,
+    'active_sensing': 0xFE,
+    'reset': 0xFF,
+}
+
+STATUS = {**CHANNEL_STATUS, **SYSTEM_STATUS}
+# The messages that effects copy, and so the only ones worth converting into `Events`
+NOTE_TYPES = frozenset(('note_on', 'note_off'))
+TYPES = {status: message_type for message_type, status in STATUS.items()}
+# The attributes of the `mido.Message` for each type, besides `type` and `time`
+MESSAGE_ATTRIBUTES = {
+    'note_off': ('channel', 'note', 'velocity'),
+    'note_on': ('channel', 'note', 'velocity'),
+    'polytouch': ('channel', 'note', 'value'),
+    'control_change': ('channel', 'control', 'value'),
+    'program_change': ('channel', 'program'),
+    'aftertouch': ('channel', 'value'),
+    'pitchwheel': ('channel', 'pitch'),
+    **{message_type: () for message_type in SYSTEM_STATUS},
+}
+# Creates a `mido.Message` without running its constructor, as `mido.Message.copy` does
+_new_message = mido.Message.__new__
+
+
+class Event:
+    """
+    An `Event` is a compact, unvalidated stand-in for a `mido.Message`, meant to be passed
+    between `MidiBoxes` inside the effects graph. It exposes the same attributes that the
+    effects use (`type`, `channel`, `note`, `velocity` and `copy`), so any effect written
+    against `mido.Message` works with it unchanged.
+
+    The two data bytes of every message are stored in `note` and `velocity`, and the other
+    mido attribute names (`control`, `value`, `program`, `pitch`) are aliases for them.
+    """
+    __slots__ = ('type', 'channel', 'note', 'velocity', 'time')
+
+    def __init__(self, type: str, channel: int = 0,  # pylint: disable=redefined-builtin
+                 note: int = 0, velocity: int = 0, time: float = 0):
+        self.type = type
+        self.channel = channel
+        self.note = note
+        self.velocity = velocity
+        self.time = time
+
+    @classmethod
+    def from_bytes(cls, data: List[int], time: float = 0) -> 'Event':
+        """Create an `Event` from the raw bytes of a MIDI message."""
+        status = data[0]
+        if status >= 0xF0:
+            return cls(TYPES[status], time=time)
+        message_type = TYPES[status & 0xF0]
+        if len(data) == 2:
+            # program_change stores its data byte in `note`, aftertouch in `velocity`
+            if message_type == 'program_change':
+                return cls(message_type, status & 0x0F, data[1], 0, time)
+            return cls(message_type, status & 0x0F, 0, data[1], time)
+        return cls(message_type, status & 0x0F, data[1], data[2], time)
+
+    @classmethod
+    def from_message(cls, message: mido.Message) -> 'Event':
+        """Create an `Event` from a `mido.Message`."""
+        return cls.from_bytes(message.bytes(), message.time)
+
+    def bytes(self) -> List[int]:
+        """Return the raw bytes of this MIDI message."""
+        status = STATUS[self.type]
+        if status >= 0xF0:
+            return [status]
+        status |= self.channel
+        if status < 0xC0 or status >= 0xE0:
+            return [status, self.note, self.velocity]
+        return [status, self.note if status < 0xD0 else self.velocity]
+
+    def to_message(self) -> mido.Message:
+        """
+        Convert this `Event` back into a `mido.Message`. Its attributes are set directly,
+        without being validated again, the same way `mido.Message.copy` makes its copies.
+        """
+        message = _new_message(mido.Message)
+        if self.type in NOTE_TYPES:
+            vars(message).update(type=self.type, time=self.time, channel=self.channel,
+                                 note=self.note, velocity=self.velocity)
+        else:
+            attributes = vars(message)
+            attributes['type'] = self.type
+            attributes['time'] = self.time
+            for name in MESSAGE_ATTRIBUTES[self.type]:
+                attributes[name] = getattr(self, name)
+        return message
+
+    def copy(self, **overrides) -> 'Event':
+        """Return a copy of this `Event`, with any provided attributes replaced."""
+        event = Event(self.type, self.channel, self.note, self.velocity, self.time)
+        for name, value in overrides.items():
+            setattr(event, name, value)
+        return event
+
+    @property
+    def control(self) -> int:
+        """The controller number of a `control_change`."""
+        return self.note
+
+    @control.setter
+    def control(self, control: int):
+        self.note = control
+
+    @property
+    def value(self) -> int:
+        """The value of a `control_change`, `polytouch` or `aftertouch`."""
+        return self.velocity
+
+    @value.setter
+    def value(self, value: int):
+        self.velocity = value
+
+    @property
+    def program(self) -> int:
+        """The program number of a `program_change`."""
+        return self.note
+
+    @program.setter
+    def program(self, program: int):
+        self.note = program
+
+    @property
+    def pitch(self) -> int:
+        """The signed pitch of a `pitchwheel`, between -8192 and 8191."""
+        return ((self.velocity << 7) | self.note) - 8192
+
+    @pitch.setter
+    def pitch(self, pitch: int):
+        pitch += 8192
+        self.note = pitch & 0x7F
+        self.velocity = pitch >> 7
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Event):
+            return NotImplemented
+        return self.bytes() == other.bytes() and self.time == other.time
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'Event({self.type!r}, channel={self.channel}, note={self.note}, ' \
+            f'velocity={self.velocity}, time={self.time})'
+
+
+def to_event(message: mido.Message) -> Union[Event, mido.Message]:
+    """
+    Convert a note message into an `Event`. Every other message is returned as-is, since
+    converting it (and converting it back at the outputs) would cost more than it saves.
+    """
+    if message.type in NOTE_TYPES:
+        return Event(message.type, message.channel, message.note, message.velocity,
+                     message.time)
+    return message
+
+
+# Real-time messages carry no data, so every output can send the same `mido.Message` for them
+_SYSTEM_MESSAGES = {message_type: mido.Message(message_type) for message_type in SYSTEM_STATUS}
+
+
+def to_message(message: Union[Event, mido.Message]) -> mido.Message:
+    """
+    Convert an `Event` back into a `mido.Message`, leaving anything else as-is.
+    Real-time `Events` (`clock`, `start`, etc.) are converted into shared messages,
+    which must not be modified.
+    """
+    if type(message) is Event:  # pylint: disable=unidiomatic-typecheck
+        system_message = _SYSTEM_MESSAGES.get(message.type)
+        if system_message is not None and not message.time:
+            return system_message
+        return message.to_message()
+    return message
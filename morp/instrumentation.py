@@ -0,0 +1,207 @@
+"""
+instrumentation.py
+"""
+import threading
+from time import perf_counter
+from typing import Dict, List, Union
+from .midi_box import EffectsLoop, MidiBox, MidiIn, MidiOut
+
+
+class Histogram:
+    """
+    A `Histogram` counts durations in power-of-two buckets of microseconds,
+    where bucket `n` holds durations of less than `2 ** n` microseconds.
+    """
+
+    def __init__(self):
+        self._buckets = [0] * 32
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, seconds: float):
+        """Add one duration."""
+        self._buckets[min(int(seconds * 1e6).bit_length(), 31)] += 1
+        self._count += 1
+        self._total += seconds
+        self._max = max(self._max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """Return the upper bound, in microseconds, of the bucket holding this percentile."""
+        target = self._count * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self._buckets):
+            seen += count
+            if count and seen >= target:
+                return float(2 ** bucket)
+        return 0.0
+
+    def snapshot(self) -> dict:
+        """Return a summary of the recorded durations, in microseconds."""
+        return {
+            'count': self._count,
+            'mean_us': self._total / self._count * 1e6 if self._count else 0.0,
+            'p50_us': self.percentile(50),
+            'p99_us': self.percentile(99),
+            'max_us': self._max * 1e6,
+            'buckets': {f'<{2 ** bucket}us': count
+                        for bucket, count in enumerate(self._buckets) if count},
+        }
+
+
+class Instrumentation:
+    """
+    `Instrumentation` records how many messages each `MidiBox` and `EffectsLoop` handles,
+    how much time is spent in each of them (excluding the time spent in the boxes that they
+    send to), and the latency from a `MidiIn` receiving a message to a `MidiOut` sending it.
+
+    Boxes are instrumented by switching them over to a subclass with timed handlers, and
+    switched back by `detach`, so uninstrumented boxes pay nothing for this.
+    """
+
+    def __init__(self):
+        self._classes = {}
+        self._attached = {}
+        self._labels = {}
+        self._stats = {}
+        self._latency = Histogram()
+        self._local = threading.local()
+
+    def attach(self, box: Union[MidiBox, EffectsLoop], label: str = None):
+        """Start recording the messages handled by `box`."""
+        if id(box) in self._attached:
+            return
+        original = type(box)
+        box.__class__ = self._instrumented_class(original)
+        self._attached[id(box)] = (box, original)
+        self._labels[id(box)] = label or f'{original.__name__}@{id(box):x}'
+        if isinstance(box, MidiIn):
+            # The backend holds on to the handler that was bound before the switch
+            box._install_callback()
+        # Compiled stages would skip the timed handlers
+        parent_loop = box if isinstance(box, EffectsLoop) else getattr(box, '_parent_loop', None)
+        if parent_loop:
+            parent_loop.invalidate()
+
+    def detach(self):
+        """Stop recording, and restore every instrumented box to its original class."""
+        for box, original in self._attached.values():
+            box.__class__ = original
+            if isinstance(box, MidiIn):
+                box._install_callback()
+            if isinstance(box, EffectsLoop):
+                box.invalidate()
+            elif box._parent_loop:
+                box._parent_loop.invalidate()
+        self._attached.clear()
+
+    def snapshot(self) -> dict:
+        """Return the counts and timings recorded so far."""
+        boxes = {}
+        for key, (count, seconds) in list(self._stats.items()):
+            label = self._labels.get(key, f'{key:x}')
+            boxes[label] = {
+                'messages': count,
+                'seconds': seconds,
+                'mean_us': seconds / count * 1e6 if count else 0.0,
+            }
+        return {'boxes': boxes, 'latency': self._latency.snapshot()}
+
+    def _stack(self) -> List[float]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _timed(self, handler):
+        """Wrap `handler`, so that its calls are counted and timed."""
+        stats, stack = self._stats, self._stack
+
+        def timed(box, message):
+            children = stack()
+            children.append(0.0)
+            start = perf_counter()
+            try:
+                return handler(box, message)
+            finally:
+                elapsed = perf_counter() - start
+                own = elapsed - children.pop()
+                if children:
+                    children[-1] += elapsed
+                counters = stats.get(id(box))
+                if counters is None:
+                    counters = stats[id(box)] = [0, 0.0]
+                counters[0] += len(message) if isinstance(message, list) else 1
+                counters[1] += own
+        return timed
+
+    def _arrival(self, handler):
+        """Wrap a `MidiIn` handler, so that it marks when messages arrived."""
+        local = self._local
+
+        def arrival(box, message):
+            if getattr(local, 'arrived', None) is not None:
+                return handler(box, message)
+            local.arrived = perf_counter()
+            try:
+                return handler(box, message)
+            finally:
+                local.arrived = None
+        return arrival
+
+    def _departure(self, handler):
+        """Wrap a `MidiOut` handler, so that it records the latency of messages it sends."""
+        local, latency = self._local, self._latency
+
+        def departure(box, message, through=False):
+            result = handler(box, message, through)
+            arrived = getattr(local, 'arrived', None)
+            if arrived is not None and box._capture is None:
+                elapsed = perf_counter() - arrived
+                for _ in message if isinstance(message, list) else (message,):
+                    latency.record(elapsed)
+            return result
+        return departure
+
+    def _instrumented_class(self, original: type) -> type:
+        instrumented = self._classes.get(original)
+        if instrumented is None:
+            namespace = {'__slots__': (), '__module__': original.__module__}
+            namespace['on_message'] = self._timed(original.on_message)
+            if issubclass(original, EffectsLoop):
+                namespace['on_messages'] = self._timed(original.on_messages)
+            if issubclass(original, MidiIn):
+                namespace['on_message'] = self._arrival(namespace['on_message'])
+                namespace['receive'] = self._arrival(original.receive)
+            if issubclass(original, MidiOut):
+                namespace['route_message'] = self._departure(original.route_message)
+                namespace['route_messages'] = self._departure(original.route_messages)
+            instrumented = self._classes[original] = type(
+                original.__name__, (original,), namespace)
+        return instrumented
+
+
+def walk(midi_ins: List[MidiIn]) -> Dict[str, Union[MidiBox, EffectsLoop]]:
+    """
+    Find every `MidiBox` and `EffectsLoop` reachable from `midi_ins`,
+    labelled by the path used to reach it.
+    """
+    found, seen = {}, set()
+    pending = [(midi_in.name, midi_in) for midi_in in midi_ins]
+    while pending:
+        label, box = pending.pop()
+        if id(box) in seen:
+            continue
+        seen.add(id(box))
+        found[label] = box
+        if isinstance(box, EffectsLoop):
+            pending.extend((f'{label}[{i}] {type(inner).__name__}', inner)
+                           for i, inner in enumerate(box.boxes))
+            continue
+        if box._fx_loop:
+            pending.append((f'{label}.fx', box._fx_loop))
+        for output in box.outputs:
+            name = getattr(output, 'name', None) if isinstance(output, (MidiIn, MidiOut)) \
+                else None
+            pending.append((name or f'{label} > {type(output).__name__}', output))
+    return found
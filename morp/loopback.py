@@ -0,0 +1,58 @@
+"""
+loopback.py
+
+An in-process mido backend of virtual ports, for testing and benchmarking without hardware.
+Every message sent to an output named `name` is delivered to each open input named `name`:
+
+    mido.set_backend('morp.loopback')
+    midi_service = MidiService()
+    midi_input = midi_service.open_input('loop')
+    with mido.open_output('loop') as device:
+        device.send(mido.Message('note_on', note=60))
+
+Names listed in `DEVICES` are reported by `get_input_names`/`get_output_names`,
+but ports with any name can be opened.
+"""
+import threading
+from typing import Dict, List
+import mido
+from mido.ports import BaseInput, BaseOutput
+
+DEVICES = ['loopback 1', 'loopback 2']
+
+_inputs: Dict[str, List['Input']] = {}
+_inputs_lock = threading.Lock()
+
+
+def get_devices(**_) -> List[dict]:
+    """Return the virtual devices, in the format mido expects from a backend."""
+    return [{'name': name, 'is_input': True, 'is_output': True} for name in DEVICES]
+
+
+class Input(BaseInput):
+    """An input port that receives everything sent to the output with the same name."""
+
+    def _open(self, callback=None, **_):
+        self.callback = callback
+        with _inputs_lock:
+            _inputs.setdefault(self.name, []).append(self)
+
+    def _close(self):
+        with _inputs_lock:
+            _inputs[self.name].remove(self)
+
+    def _deliver(self, message: mido.Message):
+        callback = self.callback
+        if callback:
+            callback(message)
+        else:
+            with self._lock:
+                self._messages.append(message)
+
+
+class Output(BaseOutput):
+    """An output port that delivers messages to every input with the same name."""
+
+    def _send(self, message: mido.Message):
+        for port in _inputs.get(self.name, ()):
+            port._deliver(message)  # pylint: disable=protected-access
@@ -2,16 +2,53 @@
 """
 midi_boxes.py
 """
-from copy import deepcopy
-from typing import List, Union
+import threading
+from copy import copy, deepcopy
+from typing import Callable, List, Union
 import mido
+from .events import NOTE_TYPES, Event, to_event, to_message
+from .notes import NoteState
+from .port_writer import BLOCK, PortWriter
+from .scheduler import Timer, default_scheduler
+
+# The handlers that `MidiBox.compile_stage` is able to inline
+_HANDLERS = ('on_message', 'on_note', 'on_note_on', 'on_note_off', 'on_clock',
+             'route_message', 'process')
+
+# What a `MidiOut` does with the clock it is sent
+CLOCK_PASS = 'pass'
+CLOCK_DIVIDE = 'divide'
+CLOCK_BLOCK = 'block'
+CLOCK_POLICIES = (CLOCK_PASS, CLOCK_DIVIDE, CLOCK_BLOCK)
+# The messages that a clock policy looks at
+_CLOCK_TYPES = frozenset(('clock', 'start', 'songpos'))
 
 
 class MidiBox:
     """
     A `MidiBox` is the generic parent for all MIDI FX boxes. It handles incoming messages,
     and manages connections to MIDI FX loops, other `MidiBoxes`, and external MIDI devices.
+
+    `handles` is the set of message types that a `MidiBox` subclass wants its handlers
+    (`modifier`, `on_note`, `on_clock`, etc.) to see. Messages of any other type are routed
+    straight through to the outputs. A subclass that overrides `on_clock` handles `clock`
+    as well, unless it declares `handles` itself.
+
+    The boxes in morp declare `__slots__`, which keeps instances small and attribute access
+    fast. A subclass without `__slots__` of its own gets a regular `__dict__`, so it can
+    keep its state in any attribute it likes.
     """
+    __slots__ = ('outputs', '_fx_loop', '_fx_loop_template', '_fx_return', '_parent_loop',
+                 '_notes_on', '_capture', '__weakref__')
+    handles = NOTE_TYPES
+    # Whether this box sends messages later on from the `Scheduler` (see `schedule`), so that
+    # it only works when messages arrive in real time
+    realtime = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'handles' not in vars(cls) and 'on_clock' in vars(cls):
+            cls.handles = cls.handles | {'clock'}
 
     def __init__(self,
                  outputs: List['MidiBox'] = None,
@@ -24,15 +61,54 @@ class MidiBox:
             - `fx_return`: a boolean representing whether or not this `MidiBox` outputs
                            to an FX loop return
         """
-        self._notes_on = set()
         self._fx_loop = None
+        self._fx_loop_template = None
         self._fx_return = fx_return
+        self._parent_loop = None
+        self._init_state()
         self.set_outputs(outputs or [])
 
+    def _init_state(self):
+        """
+        Create the mutable state that each instance of this `MidiBox` needs for itself.
+        Subclasses with state of their own should extend this, since `clone` calls it to give
+        every copy of an `EffectsLoop` fresh state.
+        """
+        self._notes_on = NoteState()
+        self._capture = None
+
+    def clone(self) -> 'MidiBox':
+        """
+        Make a new, unconnected instance of this `MidiBox` with a deep copy of its configuration,
+        and fresh state from `_init_state`.
+
+        A class whose configuration is never changed in place (e.g. precompiled lookup tables)
+        can declare `_shares_config = True` to have its clones share it instead of copying it.
+        This only applies to the class that declares it, not to its subclasses, which may keep
+        mutable attributes of their own.
+        """
+        if vars(type(self)).get('_shares_config'):
+            box = copy(self)
+        else:
+            memo = {id(self.outputs): [], id(self._parent_loop): None, id(self._fx_loop): None,
+                    id(self._fx_loop_template): self._fx_loop_template}
+            box = deepcopy(self, memo)
+        box._init_state()
+        box.outputs = []
+        box._parent_loop = None
+        if self._fx_loop_template:
+            box._fx_loop = self._fx_loop_template.instance()
+            if self._fx_loop is not None:
+                box._fx_loop.compiled = self._fx_loop.compiled
+        return box
+
     def set_outputs(self, outputs: List['MidiBox']):
         """Send the output of this `MidiBox` to a list of other `MidiBoxes`."""
         self.outputs = outputs
-        self.assign_fx_loop(self._fx_loop)
+        if self._fx_loop:
+            self._fx_loop.set_return(self)
+        if self._parent_loop:
+            self._parent_loop.invalidate()
 
     def modifier(self, message: mido.Message) -> Union[mido.Message, List[mido.Message]]:
         """
@@ -41,12 +117,16 @@ class MidiBox:
         """
         return message
 
-    def assign_fx_loop(self, loop: 'EffectsLoop'):
+    def assign_fx_loop(self, loop: 'EffectsLoop', compiled: bool = None):
         """
-        Make a copy of an existing `EffectsLoop`, and hook it up to the effect send/return.
+        Make a new instance of an existing `EffectsLoop`, and hook it up to the effect
+        send/return. When `compiled` is provided, it overrides the `compiled` setting of the copy.
         """
         if loop:
-            new_loop = deepcopy(loop)
+            self._fx_loop_template = loop
+            new_loop = loop.instance()
+            if compiled is not None:
+                new_loop.compiled = compiled
             new_loop.set_return(self)
             self._fx_loop = new_loop
 
@@ -65,39 +145,44 @@ class MidiBox:
         """
         Accept incoming MIDI `Messages`, and dispatch event handlers.
         """
-        if message.type != 'clock':
+        message_type = message.type
+        if message_type not in self.handles:
+            self.route_message(message)
+        elif message_type == 'clock':
+            self.on_clock(message)
+        else:
             modified = self.modifier(message)
             if isinstance(modified, list):
                 for note in modified:
                     self.on_note(note)
             else:
                 self.on_note(message)
-        else:
-            self.on_clock(message)
 
     def on_note(self, message: mido.Message):
         """
         Handle MIDI `Messages` that where `type` is `note_on` or `note_off`.
+        Other types that this box `handles` are passed along as they are.
         """
         if message.type == 'note_on' and message.velocity > 0:
             self.on_note_on(message)
         elif message.type == 'note_off':
             self.on_note_off(message)
+        elif message.type not in NOTE_TYPES:
+            self.route_message(message)
 
     def on_note_on(self, message: mido.Message):
         """
         Handle MIDI `Messages` that where `type` is `note_on`.
         """
-        if message.note not in self._notes_on:
+        if self._notes_on.add(message.channel, message.note):
             self.route_message(message)
-            self._notes_on.add(message.note)
 
     def on_note_off(self, message: mido.Message):
         """
         Handle MIDI `Messages` that where `type` is `note_off`.
         """
         self.route_message(message)
-        self._notes_on.discard(message.note)
+        self._notes_on.discard(message.channel, message.note)
 
     def on_clock(self, message: mido.Message):
         """
@@ -105,27 +190,241 @@ class MidiBox:
         """
         self.route_message(message)
 
+    def release_notes(self) -> List[Event]:
+        """
+        Forget every note this `MidiBox` is holding, without sending anything,
+        and return a `note_off` for each of them.
+        """
+        return [Event('note_off', channel, note) for channel, note in self._notes_on.release()]
+
+    def panic(self):
+        """
+        Release every note held by this `MidiBox` (and its FX loop), sending a `note_off` for
+        each of them to the outputs in a single batch.
+        """
+        note_offs = self.release_notes()
+        if self._fx_loop and not self.fx_return:
+            # The notes that reached the outputs are the ones held at the end of the loop
+            self._fx_loop.panic()
+        else:
+            self.route_messages(note_offs, through=True)
+
+    def process(self, messages: List[mido.Message]) -> List[mido.Message]:
+        """
+        Run `messages` through this `MidiBox`, and return the messages it would have routed
+        (in order) instead of dispatching them to the FX loop or the output(s).
+        """
+        previous, captured = self._capture, []
+        self._capture = captured
+        try:
+            on_message = self.on_message
+            for message in messages:
+                on_message(message)
+        finally:
+            self._capture = previous
+        return captured
+
+    def compile_stage(self) -> Callable[[List[mido.Message]], List[mido.Message]]:
+        """
+        Return a callable with the same behavior as `process`, for use in a compiled
+        `EffectsLoop`. When a subclass only overrides `modifier`, the default handlers are
+        inlined into a single function so that each message costs one call instead of several.
+        """
+        cls = type(self)
+        if any(getattr(cls, name) is not getattr(MidiBox, name) for name in _HANDLERS):
+            return self.process
+
+        modifier = self.modifier if cls.modifier is not MidiBox.modifier else None
+        held = self._notes_on.held
+        handles = cls.handles
+
+        def stage(messages):
+            if len(messages) == 1:
+                # A single message is routed as it is, or not at all, so the batch it came in
+                # can be passed along instead of building a new one
+                message = messages[0]
+                if message.type not in handles or message.type == 'clock':
+                    return messages
+                if modifier is None:
+                    if message.type == 'note_on' and message.velocity > 0:
+                        index = message.channel << 7 | message.note
+                        if held[index]:
+                            return ()
+                        held[index] = 1
+                        return messages
+                    if message.type == 'note_off':
+                        held[message.channel << 7 | message.note] = 0
+                        return messages
+                    return messages if message.type not in NOTE_TYPES else ()
+            routed = []
+            for message in messages:
+                if message.type not in handles or message.type == 'clock':
+                    routed.append(message)
+                    continue
+                modified = modifier(message) if modifier else message
+                for note in modified if isinstance(modified, list) else (message,):
+                    if note.type == 'note_on' and note.velocity > 0:
+                        index = note.channel << 7 | note.note
+                        if not held[index]:
+                            routed.append(note)
+                            held[index] = 1
+                    elif note.type == 'note_off':
+                        routed.append(note)
+                        held[note.channel << 7 | note.note] = 0
+                    elif note.type not in NOTE_TYPES:
+                        routed.append(note)
+            return routed
+        return stage
+
+    def compile_push(self, forward: Callable[[mido.Message], None]
+                     ) -> Callable[[mido.Message], None]:
+        """
+        Return a callable with the same behavior as `on_message`, for use in a compiled
+        `EffectsLoop`, that hands each message this box routes to `forward` instead of its
+        outputs. As with `compile_stage`, the default handlers are inlined.
+        """
+        cls = type(self)
+        if cls.modifier is not MidiBox.modifier or \
+                any(getattr(cls, name) is not getattr(MidiBox, name) for name in _HANDLERS):
+            box, sink, on_message = self, _Sink(forward), self.on_message
+
+            def push(message):
+                previous = box._capture
+                box._capture = sink
+                try:
+                    on_message(message)
+                finally:
+                    box._capture = previous
+            return push
+
+        held = self._notes_on.held
+        handles = cls.handles
+
+        def push_inline(message):
+            if message.type not in handles or message.type == 'clock':
+                forward(message)
+            elif message.type == 'note_on' and message.velocity > 0:
+                index = message.channel << 7 | message.note
+                if not held[index]:
+                    held[index] = 1
+                    forward(message)
+            elif message.type == 'note_off':
+                held[message.channel << 7 | message.note] = 0
+                forward(message)
+            elif message.type not in NOTE_TYPES:
+                forward(message)
+        return push_inline
+
     def route_message(self, message: mido.Message, through: bool = False):
         """
         Dispatch this message to either the FX loop or the output(s) as appropriate.
         """
-        if self._fx_loop and not (self.fx_return or through):
+        if self._capture is not None and \
+                not (through and self._fx_loop and not self.fx_return):
+            self._capture.append(message)
+        elif self._fx_loop and not (self.fx_return or through):
             self._fx_loop.on_message(message)
         elif len(self.outputs) > 0:
             for output in self.outputs:
                 output.on_message(message)
 
+    def on_messages(self, messages: List[mido.Message]):
+        """
+        Accept a batch of incoming MIDI `Messages`, and pass the resulting batch along.
+        Subclasses only need to override the single-message handlers.
+        """
+        if len(messages) == 1:
+            # Nothing to batch, so skip collecting the result
+            self.on_message(messages[0])
+        else:
+            self.route_messages(self.process(messages))
+
+    def route_messages(self, messages: List[mido.Message], through: bool = False):
+        """
+        Dispatch a batch of messages to either the FX loop or the output(s) as appropriate.
+        """
+        if not messages:
+            return
+        if self._capture is not None and \
+                not (through and self._fx_loop and not self.fx_return):
+            self._capture.extend(messages)
+        elif self._fx_loop and not (self.fx_return or through):
+            self._fx_loop.on_messages(messages)
+        else:
+            for output in self.outputs:
+                output.on_messages(messages)
+
+    def schedule(self, delay: float, message: mido.Message,
+                 handler: Callable[[mido.Message], None] = None) -> Timer:
+        """
+        Pass `message` to `handler` (`route_message` by default) after `delay` seconds, from the
+        shared `Scheduler`, and return a `Timer` that can be passed to `cancel`.
+        """
+        return default_scheduler().schedule(delay, handler or self.route_message, message)
+
+    def cancel(self, timer: Timer):
+        """Stop a message passed to `schedule` from being handled, if it hasn't been already."""
+        default_scheduler().cancel(timer)
+
 
 class MidiOut(MidiBox):
     """
     A `MidiOut is a `MidiBox` that maintains a connection to an external MIDI device.
+
+    When `queue_size` is provided, messages are written to the device from a dedicated
+    thread through a queue of that size, so that a slow device doesn't hold up the
+    `MidiBoxes` sending to it. `overflow` decides what happens when that queue is full;
+    see `PortWriter` for the available policies.
+
+    `clock_policy` decides which clock messages are sent to the device:
+        - `pass`: all of them
+        - `divide`: one of every `clock_division` (e.g. 24 for quarter notes), counted from
+          the most recent `start` or song position
+        - `block`: none of them
     """
+    __slots__ = ('name', '_output', '_writer', 'clock_division', '_clock_count', '_clock_policy',
+                 '_clock_filter', '_send_lock')
 
-    def __init__(self, output_name: str):
+    def __init__(self, output_name: str, queue_size: int = 0, overflow: str = BLOCK,
+                 clock_policy: str = CLOCK_PASS, clock_division: int = 24):
         self.name = output_name
         self.output = output_name
+        # Keeps each batch together when several threads send to this output
+        self._send_lock = threading.Lock()
+        self._writer = PortWriter(self._write, queue_size, overflow, output_name) \
+            if queue_size else None
+        self.clock_division = clock_division
+        self._clock_count = 0
+        self.clock_policy = clock_policy
         super().__init__()
 
+    @property
+    def clock_policy(self) -> str:
+        """Get which clock messages are sent to the device"""
+        return self._clock_policy
+
+    @clock_policy.setter
+    def clock_policy(self, clock_policy: str):
+        if clock_policy not in CLOCK_POLICIES:
+            raise ValueError(f'clock_policy must be one of {", ".join(CLOCK_POLICIES)}')
+        self._clock_policy = clock_policy
+        self._clock_filter = None if clock_policy == CLOCK_PASS else self._clock_passes
+
+    def _clock_passes(self, message) -> bool:
+        """Return whether the clock policy lets `message` through, counting the clocks."""
+        if message.type == 'clock':
+            if self._clock_policy == CLOCK_BLOCK:
+                return False
+            passes = self._clock_count % self.clock_division == 0
+            self._clock_count += 1
+            return passes
+        if message.type == 'start':
+            self._clock_count = 0
+        elif message.type == 'songpos':
+            # Song position is counted in sixteenth notes, which are 6 clocks each
+            self._clock_count = message.pos * 6
+        return True
+
     @property
     def output(self):
         """Return the underlying mido `output` object."""
@@ -140,12 +439,64 @@ class MidiOut(MidiBox):
         else:
             self._output = None
 
+    @property
+    def queued(self) -> bool:
+        """Get whether messages are written to the device from a dedicated thread"""
+        return self._writer is not None
+
+    def queue_stats(self) -> Union[dict, None]:
+        """Return the queue depth and drop counters of a queued `MidiOut`."""
+        return self._writer.stats() if self._writer else None
+
     def route_message(self, message, through=False):
         """Forward this message to the external MIDI device."""
-        self.output.send(message)
+        if self._capture is not None:
+            self._capture.append(message)
+        elif self._clock_filter is not None and message.type in _CLOCK_TYPES \
+                and not self._clock_filter(message):
+            return
+        elif self._writer:
+            self._writer.put((message,))
+        else:
+            with self._send_lock:
+                self.output.send(to_message(message))
+
+    def route_messages(self, messages, through=False):
+        """Flush a batch of messages to the external MIDI device in one go."""
+        if self._capture is not None:
+            self._capture.extend(messages)
+            return
+        if self._clock_filter is not None:
+            clock_passes = self._clock_filter
+            messages = [message for message in messages if clock_passes(message)]
+        if not messages:
+            return
+        if self._writer:
+            self._writer.put(messages)
+        else:
+            self._write(messages)
+
+    def _write(self, messages):
+        send = self.output.send
+        with self._send_lock:
+            for message in messages:
+                send(to_message(message))
+
+    def reopen(self):
+        """
+        Reconnect to the external MIDI device, e.g. after it was unplugged,
+        keeping this `MidiOut`'s queue and everything that sends to it.
+        """
+        try:
+            self.output.close()
+        except OSError:
+            pass
+        self.output = self.name
 
     def close(self):
         """Close the connection to this external MIDI device."""
+        if self._writer:
+            self._writer.close()
         self.output.close()
 
     def __hash__(self):
@@ -156,13 +507,51 @@ class MidiIn(MidiBox):
     """
     A `MidiIn` is a `MidiBox` that maintains a connection to an external
     MIDI device used for generating input.
+
+    When `compact=True` is used, incoming note messages are converted into `Events`
+    before they enter the effects graph. Other messages enter it unchanged.
     """
+    __slots__ = ('name', '_input', '_compact', '_callback')
 
-    def __init__(self, input_name: str):
+    def __init__(self, input_name: str, compact: bool = False):
+        self._compact = compact
+        self._callback = None
         self.name = input_name
         self.input = input_name
         super().__init__()
 
+    @property
+    def compact(self) -> bool:
+        """Get whether incoming messages are converted into `Events`"""
+        return self._compact
+
+    @compact.setter
+    def compact(self, compact: bool):
+        self._compact = compact
+        self._install_callback()
+
+    def _receive(self, message: mido.Message):
+        self.on_message(to_event(message))
+
+    def receive(self, messages: List[mido.Message]):
+        """Handle a batch of messages from the underlying mido `input`."""
+        self.on_messages([to_event(message) for message in messages]
+                         if self._compact else messages)
+
+    def set_callback(self, callback: Callable[[mido.Message], None] = None):
+        """
+        Replace the function that the mido `input` calls with each incoming message, e.g. to
+        hand messages over to another thread. `None` restores the default, which sends them
+        into this `MidiIn`.
+        """
+        self._callback = callback
+        self._install_callback()
+
+    def _install_callback(self):
+        if self._input:
+            self._input.callback = self._callback or \
+                (self._receive if self._compact else self.on_message)
+
     @property
     def input(self):
         """Get the underlying mido `input` object."""
@@ -174,10 +563,21 @@ class MidiIn(MidiBox):
         self.name = input_name
         if input_name:
             self._input = mido.open_input(input_name)
-            self._input.callback = self.on_message
+            self._install_callback()
         else:
             self._input = None
 
+    def reopen(self):
+        """
+        Reconnect to the external MIDI device, e.g. after it was unplugged,
+        keeping this `MidiIn`'s callback, outputs and FX loop.
+        """
+        try:
+            self.input.close()
+        except OSError:
+            pass
+        self.input = self.name
+
     def close(self):
         """Close the connection to this MIDI device."""
         self.input.close()
@@ -191,24 +591,250 @@ class EffectsLoop:
     A `EffectsLoop` is an ordered sequence of `MidiBoxes`.
     The output of one `MidiBox` is sent to the next.
     Each instance of a `EffectsLoop` may connect to its own output.
+
+    A "compiled" `EffectsLoop` resolves its chain once into a flat pipeline of stages,
+    instead of recursing from one `MidiBox` into the next for every message. The pipeline
+    is rebuilt only after the topology changes via `set_outputs` or `set_return`.
+
+    A message that none of the `MidiBoxes` in the loop handle (e.g. `clock`, through a loop of
+    note effects) is sent straight to wherever the loop would have sent it, without visiting
+    each box along the way.
     """
 
-    def __init__(self, boxes: List[MidiBox]):
+    def __init__(self, boxes: List[MidiBox], compiled: bool = False):
         self._boxes = boxes or []
+        self._compiled = compiled
+        self._pipeline = None
+        self._passthrough = None
         # Connect the interior MidiBoxes to each other
         # The final one is left unconnected so that the Loop may be reused by many MidiBoxes
         for i in range(0, len(boxes) - 1):
             boxes[i].set_outputs([*boxes[i].outputs, boxes[i + 1]])
+        for box in self._boxes:
+            box._parent_loop = self
 
     @property
     def boxes(self) -> List[MidiBox]:
         """Get a list of the MidiBoxes in this loop"""
         return self._boxes
 
+    @property
+    def compiled(self) -> bool:
+        """Get whether messages are dispatched through a compiled pipeline"""
+        return self._compiled
+
+    @compiled.setter
+    def compiled(self, compiled: bool):
+        self._compiled = compiled
+        self.invalidate()
+
+    def invalidate(self):
+        """Discard the compiled pipeline, so that it is rebuilt on the next message."""
+        self._pipeline = None
+        self._passthrough = None
+
+    def instance(self) -> 'EffectsLoop':
+        """
+        Make a new instance of this `EffectsLoop`, to be connected to its own return.
+        The configuration of every `MidiBox` is shared with this loop (which acts as a template),
+        and only their per-instance state is created anew.
+        """
+        loop = copy(self)
+        clones = {id(box): box.clone() for box in self._boxes}
+        for box in self._boxes:
+            clone = clones[id(box)]
+            clone.outputs = [clones.get(id(output), output) for output in box.outputs]
+            clone._parent_loop = loop
+            if clone._fx_loop:
+                clone._fx_loop.set_return(clone)
+        loop._boxes = [clones[id(box)] for box in self._boxes]
+        loop.invalidate()
+        return loop
+
+    def compile(self) -> tuple:
+        """
+        Resolve the chain of `MidiBoxes` into a pipeline of `(process, side_outputs, handles)`
+        stages for batches, followed by the fan-out table for the final stage, a
+        `(handles, outputs, single_outputs)` passthrough for the types that no stage handles
+        (or `None`), and a `push` function for single messages. A single message whose type
+        isn't in a stage's `handles` skips that stage's `process` entirely.
+
+        `push` runs a single message through the same boxes, each of which hands what it routes
+        straight to the next one, so that no batch is collected for a single message.
+
+        A `MidiBox` with its own nested FX loop ends the flat section of the pipeline,
+        and everything after it is dispatched recursively as usual.
+        """
+        stages = []
+        fan_out = ()
+        # The boxes outside the loop that each stage sends to, in order
+        reached = []
+        for i, box in enumerate(self._boxes):
+            following = self._boxes[i + 1] if i + 1 < len(self._boxes) else None
+            # Boxes that route messages themselves must see every message
+            handles = box.handles if type(box).route_message is MidiBox.route_message else None
+            if box._fx_loop and not box.fx_return:
+                stages.append((box.compile_stage(), (), None))
+                fan_out = (box.route_messages,)
+                break
+            outputs = [output for output in box.outputs if output is not following]
+            reached.extend(outputs)
+            if following is None:
+                stages.append((box.compile_stage(), (), handles))
+                fan_out = tuple(output.on_messages for output in outputs)
+                break
+            stages.append((box.compile_stage(), tuple(output.on_messages for output in outputs),
+                           handles))
+        passthrough = None
+        if all(handles is not None for _, _, handles in stages):
+            passthrough = (frozenset().union(*(handles for _, _, handles in stages)),
+                           tuple(output.on_messages for output in reached),
+                           tuple(output.on_message for output in reached))
+        self._pipeline = (tuple(stages), fan_out, passthrough, self._compile_push(len(stages)))
+        return self._pipeline
+
+    def _compile_push(self, count: int) -> Callable[[mido.Message], None]:
+        """Chain the first `count` boxes (the ones with stages) into a single `push` function."""
+        if not count:
+            return _fan_out(())
+        last = self._boxes[count - 1]
+        if last._fx_loop and not last.fx_return:
+            push = last.on_message
+        else:
+            push = last.compile_push(_fan_out(tuple(output.on_message for output in last.outputs)))
+        for i in range(count - 2, -1, -1):
+            box, following = self._boxes[i], self._boxes[i + 1]
+            push = box.compile_push(_fan_out((
+                *(output.on_message for output in box.outputs if output is not following),
+                push)))
+        return push
+
+    def _find_passthrough(self) -> tuple:
+        """
+        Return the `(handles, outputs)` passthrough of an uncompiled loop, where `outputs` are
+        the `on_message` handlers that a message nobody handles would reach, in the order it
+        would reach them, or `()` if some box has to see every message.
+        """
+        inside = {id(box) for box in self._boxes}
+        handled, outputs = set(), []
+
+        def visit(box: MidiBox) -> bool:
+            cls = type(box)
+            if (box._fx_loop and not box.fx_return) or \
+                    cls.on_message is not MidiBox.on_message or \
+                    cls.route_message is not MidiBox.route_message:
+                return False
+            handled.update(box.handles)
+            for output in box.outputs:
+                if id(output) in inside:
+                    if not visit(output):
+                        return False
+                else:
+                    outputs.append(output.on_message)
+            return True
+
+        if not visit(self._boxes[0]):
+            return ()
+        return frozenset(handled), tuple(outputs)
+
+    def __getstate__(self):
+        # Compiled stages close over the state of specific boxes, so copies recompile
+        state = self.__dict__.copy()
+        state['_pipeline'] = None
+        return state
+
+    def _run(self, messages: List[mido.Message]):
+        stages, fan_out, _, _ = self._pipeline or self.compile()
+        for process, side_outputs, handles in stages:
+            if handles is None or len(messages) != 1 or messages[0].type in handles:
+                messages = process(messages)
+                if not messages:
+                    return
+            for output in side_outputs:
+                output(messages)
+        for output in fan_out:
+            output(messages)
+
     def on_message(self, message: mido.Message):
         """Simply forward the message to the first MidiBox in the loop. """
-        if len(self.boxes) > 0:
-            self.boxes[0].on_message(message)
+        if self._compiled:
+            _, _, passthrough, push = self._pipeline or self.compile()
+            if passthrough and message.type not in passthrough[0]:
+                for output in passthrough[2]:
+                    output(message)
+            else:
+                push(message)
+        elif len(self.boxes) > 0:
+            passthrough = self._passthrough
+            if passthrough is None:
+                passthrough = self._passthrough = self._find_passthrough()
+            if passthrough and message.type not in passthrough[0]:
+                for output in passthrough[1]:
+                    output(message)
+            else:
+                self.boxes[0].on_message(message)
+
+    def on_messages(self, messages: List[mido.Message]):
+        """Forward a batch of messages to the first MidiBox in the loop."""
+        if len(messages) == 1:
+            self.on_message(messages[0])
+        elif self._compiled:
+            self._run(messages)
+        elif len(self.boxes) > 0:
+            self.boxes[0].on_messages(messages)
+
+    def process(self, messages: List[mido.Message]) -> List[mido.Message]:
+        """
+        Run `messages` through this loop, and return what comes out of the final `MidiBox`
+        instead of dispatching it to the return's output(s).
+        """
+        if not self._boxes:
+            return list(messages)
+        terminus = self._boxes[-1]
+        previous, captured = terminus._capture, []
+        terminus._capture = captured
+        try:
+            if not self._compiled:
+                self._boxes[0].on_messages(messages)
+                return captured
+            stages, fan_out, _, _ = self._pipeline or self.compile()
+            for process, side_outputs, handles in stages:
+                if handles is None or len(messages) != 1 or messages[0].type in handles:
+                    messages = process(messages)
+                    if not messages:
+                        return captured
+                for output in side_outputs:
+                    output(messages)
+            if len(stages) == len(self._boxes):
+                captured.extend(messages)
+            else:
+                # The rest of the chain runs recursively, and is captured by the terminus
+                for output in fan_out:
+                    output(messages)
+        finally:
+            terminus._capture = previous
+        return captured
+
+    def release_notes(self):
+        """Forget every note held by the `MidiBoxes` in this loop, without sending anything."""
+        for box in self._boxes:
+            box.release_notes()
+            if box._fx_loop and not box.fx_return:
+                box._fx_loop.release_notes()
+
+    def panic(self):
+        """
+        Release every note held in this loop. Only the final `MidiBox` sends `note_offs`
+        (in a single batch), since it holds every note that came out of the loop.
+        """
+        if not self._boxes:
+            return
+        *interior, terminus = self._boxes
+        for box in interior:
+            box.release_notes()
+            if box._fx_loop and not box.fx_return:
+                box._fx_loop.release_notes()
+        terminus.panic()
 
     def set_return(self, return_to: MidiBox):
         """Specify where this instance of a `EffectsLoop` should return its output."""
@@ -217,3 +843,31 @@ class EffectsLoop:
             terminus = self._boxes[box_count - 1]
             terminus.fx_return = True
             terminus.set_outputs([*return_to.outputs])
+        self.invalidate()
+
+
+class _Sink:
+    """
+    Stands in for the batch that a `MidiBox` routes messages into (see `MidiBox.process`),
+    handing each message straight on instead of collecting it.
+    """
+    __slots__ = ('append',)
+
+    def __init__(self, forward: Callable[[mido.Message], None]):
+        self.append = forward
+
+    def extend(self, messages: List[mido.Message]):
+        """Hand on each of `messages` in turn."""
+        for message in messages:
+            self.append(message)
+
+
+def _fan_out(handlers: tuple) -> Callable[[mido.Message], None]:
+    """Return a function that passes a message to each of `handlers` in turn."""
+    if len(handlers) == 1:
+        return handlers[0]
+
+    def fan_out(message: mido.Message):
+        for handler in handlers:
+            handler(message)
+    return fan_out
@@ -2,19 +2,63 @@
 """
 midi.py
 """
-from typing import Set, Union
+import asyncio
+import threading
+from itertools import groupby
+from operator import itemgetter
+from time import monotonic
+from typing import AsyncIterator, Callable, List, NamedTuple, Set, Union
 import mido
-from .midi_box import MidiIn, MidiOut
+from .aio import Bridge
+from .dispatcher import Dispatcher, active_dispatcher, set_active_dispatcher
+from .instrumentation import Instrumentation, walk
+from .midi_box import CLOCK_PASS, MidiIn, MidiOut
+from .port_writer import BLOCK
+from .scheduler import default_scheduler
+
+CONNECTED = 'connected'
+DISCONNECTED = 'disconnected'
+REOPENED = 'reopened'
+
+
+class DeviceEvent(NamedTuple):
+    """A device appearing or disappearing, or a dropped port being opened again."""
+    kind: str
+    direction: str
+    name: str
 
 
 class MidiService:
-    """MidiService"""
+    """
+    MidiService
+
+    Device names are cached while the service is watching for hot-plugged devices (see
+    `watch`). When an open device disappears, its `MidiIn` or `MidiOut` is reopened once the
+    device is back, keeping its routing and FX loop. Attempts that fail are retried after
+    a delay that doubles each time, from `backoff[0]` up to `backoff[1]` seconds.
+
+    By default, each input runs the effects graph on its backend's thread. After
+    `start_dispatcher`, every input hands its messages to a single `Dispatcher` thread
+    instead, so that effects shared by several inputs only ever run on one thread.
+    """
 
     def __init__(self):
         self._open_inputs = set()
         self._open_outputs = set()
         self._error_inputs = set()
         self._error_outputs = set()
+        self._instrumentation = None
+        self._devices = None
+        self._subscribers = []
+        self._dropped = {}
+        # Guards the device cache, `_dropped` and the open and failed ports, which the
+        # watcher thread changes as well
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._watching = False
+        self._wake = threading.Event()
+        self._dispatcher = None
+        self.backoff = (0.5, 30.0)
 
     @property
     def open_inputs(self) -> Set[MidiIn]:
@@ -38,45 +82,340 @@ class MidiService:
 
     def get_inputs(self) -> Set[str]:
         """Return a set of names available as input devices"""
-        return set(mido.get_input_names())
+        return set(self._cached_devices()[0])
 
     def get_outputs(self) -> Set[str]:
         """Return a set of names available as output devices"""
-        return set(mido.get_output_names())
+        return set(self._cached_devices()[1])
+
+    def _cached_devices(self):
+        if self._watcher is None:
+            return self._enumerate()[1]
+        with self._lock:
+            return self._devices
+
+    def _enumerate(self):
+        """Enumerate the devices, and return the previously cached names and the new ones."""
+        devices = (frozenset(mido.get_input_names()), frozenset(mido.get_output_names()))
+        with self._lock:
+            previous, self._devices = self._devices, devices
+        return previous, devices
+
+    def subscribe(self, callback: Callable[[DeviceEvent], None]) -> None:
+        """
+        Call `callback` with a `DeviceEvent` whenever a device is connected or disconnected,
+        or a dropped port is reopened. Callbacks are made from the watcher thread.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[DeviceEvent], None]) -> None:
+        """Stop sending `DeviceEvents` to `callback`."""
+        self._subscribers.remove(callback)
+
+    def watch(self, interval: float = 1.0) -> None:
+        """
+        Start a background thread that looks for connected and disconnected devices every
+        `interval` seconds, or right away when `devices_changed` is called.
+        """
+        if self._watcher:
+            return
+        self._enumerate()
+        self._watching = True
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name='morp device watcher', daemon=True)
+        self._watcher.start()
 
-    def open_input(self, input_name: str) -> Union[MidiIn, None]:
-        """Open the requested input device by name, and return a `MidiIn` on success"""
+    def unwatch(self) -> None:
+        """Stop the background thread started by `watch`."""
+        if not self._watcher:
+            return
+        self._watching = False
+        self._wake.set()
+        self._watcher.join()
+        self._watcher = None
+
+    def devices_changed(self) -> None:
+        """
+        Have the watcher look for new devices right away, e.g. from a backend or operating
+        system notification, instead of waiting for the next poll.
+        """
+        self._wake.set()
+
+    def _watch(self, interval: float):
+        while self._watching:
+            try:
+                self._poll_once(monotonic())
+            except Exception as error:
+                print(error)
+            timeout = interval
+            with self._lock:
+                dues = [due for _, due in self._dropped.values()]
+            if dues:
+                timeout = max(0.0, min(interval, min(dues) - monotonic()))
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _poll_once(self, now: float) -> List[DeviceEvent]:
+        """Enumerate the devices once, reopen whatever can be, and publish the changes."""
+        previous, (inputs, outputs) = self._enumerate()
+        events = []
+        if previous is not None:
+            for direction, before, after in (('input', previous[0], inputs),
+                                             ('output', previous[1], outputs)):
+                events += [DeviceEvent(DISCONNECTED, direction, name)
+                           for name in sorted(before - after)]
+                events += [DeviceEvent(CONNECTED, direction, name)
+                           for name in sorted(after - before)]
+
+        with self._lock:
+            for event in events:
+                if event.kind == DISCONNECTED:
+                    boxes = self._open_inputs if event.direction == 'input' \
+                        else self._open_outputs
+                    for box in boxes:
+                        if box.name == event.name:
+                            self._dropped.setdefault(box, (0, now))
+                elif event.name in (self._error_inputs if event.direction == 'input'
+                                    else self._error_outputs):
+                    # A device that failed to open in the first place
+                    self._dropped.setdefault((event.direction, event.name), (0, now))
+            dropped = list(self._dropped.items())
+
+        # Ports are opened without holding the lock, since opening them takes it as well
+        for box, (attempts, due) in dropped:
+            if isinstance(box, tuple):
+                direction, name = box
+            else:
+                direction, name = 'output' if isinstance(box, MidiOut) else 'input', box.name
+            if due > now or name not in (inputs if direction == 'input' else outputs):
+                continue
+            try:
+                if isinstance(box, tuple):
+                    opened = self.open_input(name) if direction == 'input' \
+                        else self.open_output(name)
+                    if not opened:
+                        raise OSError(f'Unable to open {direction} {name}')
+                else:
+                    box.reopen()
+            except Exception:
+                delay = min(self.backoff[0] * 2 ** attempts, self.backoff[1])
+                with self._lock:
+                    self._dropped[box] = (attempts + 1, now + delay)
+                continue
+            with self._lock:
+                del self._dropped[box]
+            events.append(DeviceEvent(REOPENED, direction, name))
+
+        for event in events:
+            for callback in list(self._subscribers):
+                try:
+                    callback(event)
+                except Exception as error:
+                    print(error)
+        return events
+
+    def open_input(self, input_name: str, compact: bool = False) -> Union[MidiIn, None]:
+        """
+        Open the requested input device by name, and return a `MidiIn` on success.
+        When `compact=True` is used, notes enter the effects graph as `Events`.
+        """
         try:
-            new_input = MidiIn(input_name)
-            self.error_inputs.discard(input_name)
-            self.open_inputs.add(new_input)
+            new_input = MidiIn(input_name, compact=compact)
+            with self._lock:
+                self._error_inputs.discard(input_name)
+                self._open_inputs.add(new_input)
+            if self._dispatcher:
+                self._dispatch_from(new_input)
             return new_input
         except OSError as error:
             print(error)
-            self.error_inputs.add(input_name)
+            with self._lock:
+                self._error_inputs.add(input_name)
             return None
 
     def close_input(self, input_name: str) -> None:
         """Close the specified input device by name"""
-        for open_input in list(self.open_inputs):
-            if open_input.name == input_name:
-                open_input.close()
-                self.open_inputs.discard(open_input)
+        with self._lock:
+            closing = [box for box in self._open_inputs if box.name == input_name]
+            self._open_inputs.difference_update(closing)
+        for open_input in closing:
+            open_input.close()
 
-    def open_output(self, output_name: str) -> Union[MidiOut, None]:
-        """Open the requested output device by name, and return a `MidiOut` on success"""
+    def open_output(self, output_name: str, queue_size: int = 0, overflow: str = BLOCK,
+                    clock_policy: str = CLOCK_PASS,
+                    clock_division: int = 24) -> Union[MidiOut, None]:
+        """
+        Open the requested output device by name, and return a `MidiOut` on success.
+        When `queue_size` is provided, the device is written to from its own thread.
+        `clock_policy` and `clock_division` decide which clock messages reach the device.
+        """
         try:
-            new_output = MidiOut(output_name)
-            self.error_outputs.discard(output_name)
-            self.open_outputs.add(new_output)
+            new_output = MidiOut(output_name, queue_size=queue_size, overflow=overflow,
+                                 clock_policy=clock_policy, clock_division=clock_division)
+            with self._lock:
+                self._error_outputs.discard(output_name)
+                self._open_outputs.add(new_output)
             return new_output
         except Exception:
-            self.error_outputs.add(output_name)
+            with self._lock:
+                self._error_outputs.add(output_name)
             return None
 
     def close_output(self, output_name: str) -> None:
         """Close the specified output device by name"""
-        for open_output in list(self.open_outputs):
+        with self._lock:
+            closing = [box for box in self._open_outputs if box.name == output_name]
+            self._open_outputs.difference_update(closing)
+        for open_output in closing:
+            open_output.close()
+
+    @property
+    def dispatcher(self) -> Union[Dispatcher, None]:
+        """Get the `Dispatcher` that runs the graph, or `None` when inputs run it themselves"""
+        return self._dispatcher
+
+    def start_dispatcher(self) -> Dispatcher:
+        """
+        Start running the whole graph on a single `Dispatcher` thread, which receives the
+        messages of every open input (and of inputs opened later) in the order they arrived,
+        as well as the messages that `MidiBoxes` scheduled for later and the ticks of every
+        `Clock`. Only one `MidiService` can run a dispatcher at a time.
+        """
+        if self._dispatcher is None:
+            if active_dispatcher() is not None:
+                raise RuntimeError('Another MidiService is already running a dispatcher')
+            self._dispatcher = Dispatcher()
+            self._dispatcher.start()
+            set_active_dispatcher(self._dispatcher)
+            default_scheduler().run_on = self._dispatcher.call
+            for open_input in self.open_inputs:
+                self._dispatch_from(open_input)
+        return self._dispatcher
+
+    def stop_dispatcher(self) -> None:
+        """Go back to running the graph on each input's own thread."""
+        if self._dispatcher is None:
+            return
+        for open_input in self.open_inputs:
+            open_input.set_callback(None)
+        default_scheduler().run_on = None
+        set_active_dispatcher(None)
+        self._dispatcher.stop()
+        self._dispatcher = None
+
+    def _dispatch_from(self, midi_in: MidiIn):
+        push = self._dispatcher.push
+        midi_in.set_callback(lambda message: push(midi_in, message))
+
+    def panic(self) -> None:
+        """
+        Release every note held anywhere in the graph. Every input and effect forgets its notes
+        without sending anything, and then each output sends a `note_off` for each note that it
+        is actually holding, in a single batch per port. With a dispatcher, this happens on
+        its thread, after the messages that are already queued.
+        """
+        if self._dispatcher:
+            self._dispatcher.call(self._panic)
+        else:
+            self._panic()
+
+    def _panic(self):
+        for box in walk(list(self.open_inputs)).values():
+            if not isinstance(box, MidiOut):
+                box.release_notes()
+        for open_output in self.open_outputs:
+            open_output.panic()
+
+    def enable_instrumentation(self) -> None:
+        """
+        Start recording message counts and timings for every `MidiBox` reachable from
+        the open inputs, and the latency from each input to each output.
+        Call this again after changing the routing to instrument new boxes as well.
+        """
+        if self._instrumentation is None:
+            self._instrumentation = Instrumentation()
+        for label, box in walk(list(self.open_inputs)).items():
+            self._instrumentation.attach(box, label)
+        for open_output in self.open_outputs:
+            self._instrumentation.attach(open_output, open_output.name)
+
+    def disable_instrumentation(self) -> None:
+        """Stop recording, and remove all instrumentation from the `MidiBoxes`."""
+        if self._instrumentation:
+            self._instrumentation.detach()
+        self._instrumentation = None
+
+    def snapshot(self) -> Union[dict, None]:
+        """
+        Return per-box message counts and timings, and a latency histogram,
+        or `None` when instrumentation is disabled.
+        """
+        return self._instrumentation.snapshot() if self._instrumentation else None
+
+    def _find_input(self, input_name: str) -> Union[MidiIn, None]:
+        for open_input in self.open_inputs:
+            if open_input.name == input_name:
+                return open_input
+        return None
+
+    def _find_output(self, output_name: str) -> Union[MidiOut, None]:
+        for open_output in self.open_outputs:
             if open_output.name == output_name:
-                open_output.close()
-                self.open_outputs.discard(open_output)
+                return open_output
+        return None
+
+    async def stream(self, input_name: str) -> AsyncIterator[mido.Message]:
+        """
+        Iterate over the messages received by an input device, opening it if needed:
+
+            async for message in midi_service.stream('My Hardware Device Input'):
+                ...
+
+        While streaming, messages are delivered here instead of to the `MidiIn`'s outputs.
+        """
+        midi_in = self._find_input(input_name) or self.open_input(input_name)
+        if midi_in is None:
+            raise OSError(f'Unable to open input {input_name}')
+        bridge = Bridge()
+        midi_in.set_callback(bridge.push)
+        try:
+            while True:
+                for message in await bridge.get_batch():
+                    yield message
+        finally:
+            midi_in.set_callback(None)
+
+    async def send(self, output_name: str,
+                   messages: Union[mido.Message, List[mido.Message]]) -> None:
+        """
+        Send one or more messages to an open output device. The port is written to from
+        a worker thread, so that a slow device doesn't hold up the event loop.
+        """
+        midi_out = self._find_output(output_name)
+        if midi_out is None:
+            raise KeyError(f'Output {output_name} is not open')
+        if not isinstance(messages, list):
+            messages = [messages]
+        await asyncio.get_running_loop().run_in_executor(
+            None, midi_out.route_messages, messages)
+
+    async def run(self) -> None:
+        """
+        Drive the whole graph from the event loop until cancelled. Messages from every open
+        input are handed over from the backend threads in batches, and processed in the
+        order they arrived.
+        """
+        bridge = Bridge()
+        midi_ins = list(self.open_inputs)
+        for midi_in in midi_ins:
+            midi_in.set_callback(
+                lambda message, midi_in=midi_in: bridge.push((midi_in, message)))
+        try:
+            while True:
+                batch = await bridge.get_batch()
+                # Hand each run of messages from the same input over at once
+                for midi_in, items in groupby(batch, key=itemgetter(0)):
+                    midi_in.receive([message for _, message in items])
+        finally:
+            for midi_in in midi_ins:
+                midi_in.set_callback(None)
@@ -0,0 +1,63 @@
+"""
+notes.py
+"""
+from typing import Iterator, List, Tuple
+
+CHANNELS = 16
+NOTES = 128
+_EMPTY = bytes(CHANNELS * NOTES)
+
+
+class NoteState:
+    """
+    `NoteState` tracks which notes are held on each of the 16 MIDI channels, as one byte per
+    channel and note in a flat 16 x 128 `bytearray`, so checking or changing a note is a single
+    index (`channel << 7 | note`), and clearing every note is a single copy.
+    """
+    __slots__ = ('held',)
+
+    def __init__(self):
+        self.held = bytearray(_EMPTY)
+
+    def add(self, channel: int, note: int) -> bool:
+        """Mark a note as held, and return whether it wasn't held already."""
+        index = channel << 7 | note
+        if self.held[index]:
+            return False
+        self.held[index] = 1
+        return True
+
+    def discard(self, channel: int, note: int):
+        """Mark a note as released."""
+        self.held[channel << 7 | note] = 0
+
+    def is_held(self, channel: int, note: int) -> bool:
+        """Return whether a note is held."""
+        return bool(self.held[channel << 7 | note])
+
+    def clear(self):
+        """Release every note."""
+        self.held[:] = _EMPTY
+
+    def release(self) -> List[Tuple[int, int]]:
+        """Release every note, and return the `(channel, note)` of each one that was held."""
+        held = list(self)
+        if held:
+            self.clear()
+        return held
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        held = self.held
+        index = held.find(1)
+        while index >= 0:
+            yield index >> 7, index & 0x7F
+            index = held.find(1, index + 1)
+
+    def __len__(self) -> int:
+        return self.held.count(1)
+
+    def __bool__(self) -> bool:
+        return 1 in self.held
+
+    def __repr__(self) -> str:
+        return f'NoteState({list(self)})'
@@ -0,0 +1,333 @@
+"""
+patch.py
+
+Declarative patch files, which describe a whole rig (inputs, outputs, effects and how they
+are connected) in JSON or TOML:
+
+    inputs = ["Keyboard"]
+    outputs = [{ name = "Synth", queue_size = 64 }]
+    connections = [["Keyboard", "fifths"], ["fifths", "Synth"], ["Keyboard", "Synth"]]
+
+    [effects.fifths]
+    compiled = true
+    chain = [{ type = "Harmonizer", voices = [7] }]
+
+An effect `type` is the name of one of morp's effects, or the dotted path of any other
+`MidiBox` subclass (e.g. `"my_rig.effects.Arpeggiator"`), and the rest of its keys are passed
+to its constructor.
+"""
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from inspect import signature
+from typing import Dict, Iterable, List, Tuple, Union, get_origin, get_type_hints
+from . import __version__
+from .midi_box import CLOCK_POLICIES, EffectsLoop, MidiBox
+from .midi_service import MidiService
+from .patch_bay import PatchBay
+from .port_writer import OVERFLOW_POLICIES
+
+# Bumped whenever the format of cached graphs changes
+CACHE_VERSION = 2
+
+EFFECTS = {
+    'MidiBox': 'morp.midi_box',
+    'Autotune': 'morp.effects',
+    'Delay': 'morp.effects',
+    'Freeze': 'morp.effects',
+    'Harmonizer': 'morp.effects',
+    'NoteLengthLimit': 'morp.effects',
+    'Shadow': 'morp.effects',
+    'ClockDivider': 'morp.clock',
+    'ClockMultiplier': 'morp.clock',
+    'Sequencer': 'morp.sequencer',
+}
+
+_INPUT_OPTIONS = {'name', 'compact'}
+_OUTPUT_OPTIONS = {'name', 'queue_size', 'overflow', 'clock_policy', 'clock_division'}
+_EFFECT_OPTIONS = {'chain', 'compiled'}
+_SECTIONS = {'inputs', 'outputs', 'effects', 'connections'}
+
+
+class PatchError(ValueError):
+    """A patch file that can't be loaded, with where in the file the problem is."""
+
+
+def load_patch(path: str, midi_service: MidiService = None, cache_dir: str = None,
+               cache: bool = True) -> PatchBay:
+    """
+    Load the patch file at `path` (`.json` or `.toml`), open all of its ports at once, and
+    return a `PatchBay` that is already routing messages through it.
+
+    The effects loops that are built from the file are cached on disk, keyed by a hash of
+    the file and the version of morp, so that restarting an unchanged rig skips parsing the
+    file and building the graph. A cached graph is also rebuilt when any module that its
+    effects are defined in has changed since it was cached. Cached graphs are pickles, so
+    `cache_dir` (a `.morp_cache` directory next to the patch file by default) should only be
+    writable by whoever owns the patch.
+
+    Arguments:
+        - `path`: the patch file
+        - `midi_service`: the `MidiService` to open the ports with (a new one by default)
+        - `cache_dir`: where to cache built graphs
+        - `cache`: whether to read and write the cache at all
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    cache_path = None
+    if cache:
+        key = hashlib.sha256(data + __version__.encode('utf-8')).hexdigest()
+        cache_path = os.path.join(
+            cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), '.morp_cache'),
+            f'{key}.{CACHE_VERSION}.pickle')
+
+    built = _read_cache(cache_path) if cache_path else None
+    if built is None:
+        spec = validate(_parse(path, data))
+        built = (spec, {name: _build(name, effect) for name, effect in spec['effects'].items()})
+        if cache_path:
+            _write_cache(cache_path, built)
+    spec, effects = built
+
+    midi_service = midi_service or MidiService()
+    _open_ports(midi_service, spec)
+    patch_bay = PatchBay(midi_service)
+    for options in spec['inputs']:
+        patch_bay.add_input(options['name'])
+    for options in spec['outputs']:
+        patch_bay.add_output(options['name'])
+    for name, fx_loop in effects.items():
+        patch_bay.add_effect(name, fx_loop, instanced=True)
+    for source, destination in spec['connections']:
+        patch_bay.connect(source, destination)
+    patch_bay.apply()
+    return patch_bay
+
+
+def _parse(path: str, data: bytes) -> dict:
+    try:
+        if path.lower().endswith('.toml'):
+            import tomllib  # pylint: disable=import-outside-toplevel
+            return tomllib.loads(data.decode('utf-8'))
+        return json.loads(data)
+    except ImportError as error:
+        raise PatchError(f'{path}: TOML patches need Python 3.11 or newer') from error
+    except ValueError as error:
+        raise PatchError(f'{path}: {error}') from error
+
+
+def validate(spec: dict) -> dict:
+    """
+    Check a parsed patch, and return it with every input and output as a dict of options,
+    and every effect as `{'chain': [...], 'compiled': bool}`. Raises `PatchError` on the
+    first problem found.
+    """
+    if not isinstance(spec, dict):
+        raise PatchError('a patch must be a table of inputs, outputs, effects and connections')
+    _check_keys('patch', spec, _SECTIONS)
+    inputs = [_port(f'inputs[{i}]', port, _INPUT_OPTIONS)
+              for i, port in enumerate(_list('inputs', spec.get('inputs', [])))]
+    outputs = [_port(f'outputs[{i}]', port, _OUTPUT_OPTIONS)
+               for i, port in enumerate(_list('outputs', spec.get('outputs', [])))]
+    policies = (('overflow', OVERFLOW_POLICIES), ('clock_policy', CLOCK_POLICIES))
+    for i, port in enumerate(outputs):
+        for option, allowed in policies:
+            if option in port and port[option] not in allowed:
+                raise PatchError(f'outputs[{i}].{option}: must be one of {", ".join(allowed)}')
+    effects = spec.get('effects', {})
+    if not isinstance(effects, dict):
+        raise PatchError('effects: must be a table of named effects loops')
+    effects = {name: _effect(f'effects.{name}', effect) for name, effect in effects.items()}
+
+    names = {}
+    for kind, nodes in (('input', [port['name'] for port in inputs]),
+                        ('output', [port['name'] for port in outputs]),
+                        ('effect', list(effects))):
+        for name in nodes:
+            if name in names:
+                raise PatchError(f'{name}: used for both an {names[name]} and an {kind}')
+            names[name] = kind
+
+    connections = []
+    for i, connection in enumerate(_list('connections', spec.get('connections', []))):
+        where = f'connections[{i}]'
+        if not isinstance(connection, list) or len(connection) != 2 or \
+                not all(isinstance(name, str) for name in connection):
+            raise PatchError(f'{where}: must be a [source, destination] pair')
+        source, destination = connection
+        if names.get(source) not in ('input', 'effect'):
+            raise PatchError(f'{where}: {source!r} is not an input or effect')
+        if names.get(destination) not in ('effect', 'output'):
+            raise PatchError(f'{where}: {destination!r} is not an effect or output')
+        connections.append((source, destination))
+    _check_cycles(connections)
+    return {'inputs': inputs, 'outputs': outputs, 'effects': effects,
+            'connections': connections}
+
+
+def _check_keys(where: str, table: dict, allowed: set):
+    unknown = sorted(set(table) - allowed)
+    if unknown:
+        raise PatchError(f'{where}: unknown key {unknown[0]!r}')
+
+
+def _list(where: str, value) -> list:
+    if not isinstance(value, list):
+        raise PatchError(f'{where}: must be a list')
+    return value
+
+
+def _port(where: str, port: Union[str, dict], allowed: set) -> dict:
+    if isinstance(port, str):
+        return {'name': port}
+    if not isinstance(port, dict) or not isinstance(port.get('name'), str):
+        raise PatchError(f'{where}: must be a device name, or a table with a name')
+    _check_keys(where, port, allowed)
+    return dict(port)
+
+
+def _effect(where: str, effect: dict) -> dict:
+    if not isinstance(effect, dict):
+        raise PatchError(f'{where}: must be a table with a chain of effects')
+    _check_keys(where, effect, _EFFECT_OPTIONS)
+    chain = _list(f'{where}.chain', effect.get('chain'))
+    if not isinstance(effect.get('compiled', False), bool):
+        raise PatchError(f'{where}.compiled: must be true or false')
+    for i, box in enumerate(chain):
+        _effect_class(f'{where}.chain[{i}]', box)
+    return {'chain': chain, 'compiled': effect.get('compiled', False)}
+
+
+def _effect_class(where: str, box: dict) -> type:
+    """Find the `MidiBox` subclass for one entry of a chain, and check its parameters."""
+    if not isinstance(box, dict) or not isinstance(box.get('type'), str):
+        raise PatchError(f'{where}: must be a table with an effect type')
+    name = box['type']
+    module_name, _, class_name = (f'{EFFECTS[name]}.{name}' if name in EFFECTS
+                                  else name).rpartition('.')
+    try:
+        cls = getattr(import_module(module_name), class_name) if module_name else None
+    except (ImportError, AttributeError):
+        cls = None
+    if not (isinstance(cls, type) and issubclass(cls, MidiBox)):
+        raise PatchError(f'{where}: unknown effect type {name!r}')
+    try:
+        signature(cls).bind(**_parameters(cls, box))
+    except TypeError as error:
+        raise PatchError(f'{where}: {error}') from error
+    return cls
+
+
+def _parameters(cls: type, box: dict) -> dict:
+    """Return the constructor arguments of an effect, with lists turned into sets as needed."""
+    try:
+        hints = get_type_hints(cls.__init__)
+    except (NameError, TypeError):
+        hints = {}
+    parameters = {}
+    for name, value in box.items():
+        if name == 'type':
+            continue
+        if isinstance(value, list) and get_origin(hints.get(name)) in (set, frozenset):
+            value = set(value)
+        parameters[name] = value
+    return parameters
+
+
+def _check_cycles(connections: List[Tuple[str, str]]):
+    edges = {}
+    for source, destination in connections:
+        edges.setdefault(source, []).append(destination)
+    done, visiting = set(), []
+
+    def visit(name: str):
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise PatchError(f'connections: cycle {" -> ".join(cycle)}')
+        if name in done:
+            return
+        visiting.append(name)
+        for destination in edges.get(name, ()):
+            visit(destination)
+        visiting.pop()
+        done.add(name)
+
+    for name in list(edges):
+        visit(name)
+
+
+def _build(name: str, effect: dict) -> EffectsLoop:
+    boxes = []
+    for i, box in enumerate(effect['chain']):
+        cls = _effect_class(f'effects.{name}.chain[{i}]', box)
+        boxes.append(cls(**_parameters(cls, box)))
+    return EffectsLoop(boxes, compiled=effect['compiled'])
+
+
+def _open_ports(midi_service: MidiService, spec: dict):
+    """Open every input and output of a patch at once, since each open can take a while."""
+    jobs = [(midi_service.open_input, port) for port in spec['inputs']
+            if not midi_service._find_input(port['name'])]
+    jobs += [(midi_service.open_output, port) for port in spec['outputs']
+             if not midi_service._find_output(port['name'])]
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        opened = list(executor.map(lambda job: job[0](job[1]['name'], **{
+            option: value for option, value in job[1].items() if option != 'name'}), jobs))
+    failed = [port['name'] for (_, port), port_box in zip(jobs, opened) if port_box is None]
+    if failed:
+        # Don't leave the ports that did open behind
+        for (open_port, port), port_box in zip(jobs, opened):
+            if port_box is not None:
+                close = midi_service.close_input if open_port == midi_service.open_input \
+                    else midi_service.close_output
+                close(port['name'])
+        raise OSError(f'Unable to open {", ".join(failed)}')
+
+
+def _fingerprint(modules: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+    """Return the modification time and size of the source of each module."""
+    fingerprint = {}
+    for name in sorted(modules):
+        path = getattr(import_module(name), '__file__', None)
+        if path:
+            stat = os.stat(path)
+            fingerprint[name] = (stat.st_mtime_ns, stat.st_size)
+    return fingerprint
+
+
+def _effect_modules(effects: Dict[str, EffectsLoop]) -> set:
+    """Return the modules that the classes of every box (and their bases) are defined in."""
+    return {klass.__module__ for fx_loop in effects.values() for box in fx_loop.boxes
+            for klass in type(box).__mro__ if klass.__module__ != 'builtins'}
+
+
+def _read_cache(cache_path: str) -> Union[Tuple[dict, Dict[str, EffectsLoop]], None]:
+    try:
+        with open(cache_path, 'rb') as file:
+            # The fingerprint is checked before the graph itself is unpickled
+            fingerprint = pickle.load(file)
+            if _fingerprint(fingerprint) != fingerprint:
+                return None
+            return pickle.load(file)
+    except Exception:  # pylint: disable=broad-except
+        # Missing, or written by a different version of the effects; it is simply rebuilt
+        return None
+
+
+def _write_cache(cache_path: str, built: Tuple[dict, Dict[str, EffectsLoop]]):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary = f'{cache_path}.{os.getpid()}'
+        with open(temporary, 'wb') as file:
+            pickle.dump(_fingerprint(_effect_modules(built[1])), file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(built, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, cache_path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # Caching is only an optimization
+        pass
@@ -0,0 +1,262 @@
+"""
+patch_bay.py
+"""
+from typing import Dict, List, Tuple
+import mido
+from .midi_box import EffectsLoop, MidiBox, MidiIn, MidiOut
+from .midi_service import MidiService
+
+
+class _Router(MidiBox):
+    """
+    The only output of a `MidiIn` (or of the last box of an effect) in a `PatchBay`,
+    which hands its messages to the graph.
+    """
+    __slots__ = ('patch_bay', 'source')
+
+    def __init__(self, patch_bay: 'PatchBay', source: str):
+        self.patch_bay = patch_bay
+        self.source = source
+        super().__init__()
+
+    def on_message(self, message: mido.Message):
+        self.patch_bay.route(self.source, [message])
+
+    def on_messages(self, messages: List[mido.Message]):
+        self.patch_bay.route(self.source, messages)
+
+
+class PatchBay:
+    """
+    A `PatchBay` holds the whole routing graph of a `MidiService`: which inputs feed which
+    effects loops, which effects loops feed each other, and which of them feed which outputs.
+    Inputs and outputs are referred to by their device names, and effects loops by the name
+    they were added with:
+
+        patch_bay = PatchBay(midi_service)
+        patch_bay.add_input('Keyboard')
+        patch_bay.add_effect('fifths', EffectsLoop([Harmonizer(voices={7})]))
+        patch_bay.add_output('Synth')
+        patch_bay.connect('Keyboard', 'fifths')
+        patch_bay.connect('Keyboard', 'Synth')
+        patch_bay.connect('fifths', 'Synth')
+        patch_bay.apply()
+
+    Changes only take effect on `apply`, which compiles the graph into one routing table per
+    input, and swaps them all in at once while messages keep flowing. When the same message
+    reaches an output along more than one path, it is only sent once. Outputs receive their
+    messages through `MidiOut.on_messages`, so they track held notes and apply their clock
+    policy just as when they are connected directly.
+
+    Messages that an effect sends on its own, later on (e.g. the echoes of a `Delay`, sent from
+    the `Scheduler`), are routed through the graph from that effect onwards.
+    """
+
+    def __init__(self, midi_service: MidiService):
+        self.midi_service = midi_service
+        self._inputs: Dict[str, MidiIn] = {}
+        self._outputs: Dict[str, MidiOut] = {}
+        self._effects: Dict[str, EffectsLoop] = {}
+        self._instances: Dict[str, EffectsLoop] = {}
+        self._edges: Dict[str, List[str]] = {}
+        self._tables: Dict[str, tuple] = {}
+
+    def add_input(self, name: str, compact: bool = False) -> MidiIn:
+        """Add an input device, opening it if the `MidiService` hasn't already."""
+        self._check_name(name, self._effects)
+        midi_in = self.midi_service._find_input(name) or \
+            self.midi_service.open_input(name, compact=compact)
+        if midi_in is None:
+            raise OSError(f'Unable to open input {name}')
+        self._inputs[name] = midi_in
+        return midi_in
+
+    def add_output(self, name: str, **options) -> MidiOut:
+        """
+        Add an output device, opening it if the `MidiService` hasn't already.
+        `options` are passed along to `MidiService.open_output`.
+        """
+        self._check_name(name, self._effects)
+        midi_out = self.midi_service._find_output(name) or \
+            self.midi_service.open_output(name, **options)
+        if midi_out is None:
+            raise OSError(f'Unable to open output {name}')
+        self._outputs[name] = midi_out
+        return midi_out
+
+    def add_effect(self, name: str, fx_loop: EffectsLoop, instanced: bool = False):
+        """
+        Add an effects loop. It is used as a template, so the same `EffectsLoop` can be added
+        under several names, and each of them keeps its own state. With `instanced=True`,
+        the loop is used as it is instead, which saves copying a loop built just for this.
+        """
+        self._check_name(name, {**self._inputs, **self._outputs, **self._effects})
+        self._effects[name] = fx_loop
+        if instanced:
+            self._instances[name] = fx_loop
+        else:
+            # Don't pick up the state of an effect that was removed under the same name
+            self._instances.pop(name, None)
+
+    def remove(self, name: str):
+        """Remove a node, and every connection to and from it."""
+        for nodes in (self._inputs, self._outputs, self._effects):
+            nodes.pop(name, None)
+        self._edges.pop(name, None)
+        for destinations in self._edges.values():
+            if name in destinations:
+                destinations.remove(name)
+
+    def connect(self, source: str, destination: str):
+        """
+        Send everything that comes out of `source` (an input or effect) to `destination`
+        (an effect or output). Raises `ValueError` if this would make a cycle.
+        """
+        if source not in self._inputs and source not in self._effects:
+            raise KeyError(f'{source} is not an input or effect in this patch bay')
+        if destination not in self._effects and destination not in self._outputs:
+            raise KeyError(f'{destination} is not an effect or output in this patch bay')
+        destinations = self._edges.setdefault(source, [])
+        if destination in destinations:
+            return
+        destinations.append(destination)
+        try:
+            self._sorted_effects()
+        except ValueError:
+            destinations.remove(destination)
+            raise
+
+    def disconnect(self, source: str, destination: str):
+        """Stop sending the output of `source` to `destination`."""
+        destinations = self._edges.get(source, [])
+        if destination in destinations:
+            destinations.remove(destination)
+
+    def apply(self):
+        """
+        Compile the graph and start routing messages through it. Effects that were already
+        running keep their state (e.g. which notes they are holding).
+        """
+        order = self._sorted_effects()
+        instances = {name: self._instances.get(name) or self._effects[name].instance()
+                     for name in order}
+        tables = {source: self._compile(source, order, instances)
+                  for source in [*self._inputs, *order]}
+        # Each of these assignments is atomic, so a message is always routed by either
+        # the old graph or the new one
+        self._instances = instances
+        self._tables = tables
+        for source, midi_in in self._inputs.items():
+            self._route_from(midi_in, source)
+        for name, instance in instances.items():
+            if instance.boxes:
+                self._route_from(instance.boxes[-1], name)
+
+    def panic(self):
+        """
+        Release every note held in the graph, sending a `note_off` for each note that an
+        output is actually holding, in a single batch per port.
+        """
+        for midi_in in self._inputs.values():
+            midi_in.release_notes()
+        for instance in self._instances.values():
+            instance.release_notes()
+        for midi_out in self._outputs.values():
+            midi_out.panic()
+
+    def route(self, source: str, messages: List[mido.Message]):
+        """Send a batch of messages from the input or effect named `source` through the graph."""
+        table = self._tables.get(source)
+        if table is None or not messages:
+            return
+        steps, sends = table
+        buffers = [messages]
+        for process, inputs in steps:
+            if len(inputs) == 1:
+                incoming = buffers[inputs[0]]
+            else:
+                incoming = [message for i in inputs for message in buffers[i]]
+            buffers.append(process(incoming) if incoming else [])
+        for send, inputs in sends:
+            if len(inputs) == 1:
+                outgoing = buffers[inputs[0]]
+            else:
+                outgoing = _merge([buffers[i] for i in inputs])
+            if outgoing:
+                send(outgoing)
+
+    def _route_from(self, box: MidiBox, source: str):
+        """Send the output of `box` through the graph, as the output of the node `source`."""
+        router = box.outputs[0] if len(box.outputs) == 1 else None
+        if not (isinstance(router, _Router) and router.patch_bay is self
+                and router.source == source):
+            box.set_outputs([_Router(self, source)])
+
+    def _check_name(self, name: str, taken: dict):
+        if name in taken:
+            raise ValueError(f'{name} is already used in this patch bay')
+
+    def _sorted_effects(self) -> List[str]:
+        """Return the effects in an order where each one comes after everything feeding it."""
+        order, visiting, done = [], [], set()
+
+        def visit(name: str):
+            if name in done:
+                return
+            if name in visiting:
+                cycle = visiting[visiting.index(name):] + [name]
+                raise ValueError(f'Patch bay has a cycle: {" -> ".join(cycle)}')
+            visiting.append(name)
+            for destination in reversed(self._edges.get(name, ())):
+                if destination in self._effects:
+                    visit(destination)
+            visiting.pop()
+            done.add(name)
+            order.append(name)
+
+        # Visited backwards, so that effects which don't depend on each other stay in the
+        # order they were added
+        for name in reversed(self._effects):
+            visit(name)
+        return order[::-1]
+
+    def _compile(self, source: str, order: List[str],
+                 instances: Dict[str, EffectsLoop]) -> Tuple[tuple, tuple]:
+        """
+        Compile the routing table for one input or effect: a `(process, inputs)` step for
+        each effect it reaches, in order, and a `(send, inputs)` entry for each output it
+        reaches, where `inputs` are indexes into the list of message buffers (the input's own
+        messages, followed by the output of each step).
+        """
+        buffers = {source: 0}
+        steps = []
+        for name in order:
+            inputs = tuple(buffers[node] for node in buffers
+                           if name in self._edges.get(node, ()))
+            if inputs:
+                buffers[name] = len(steps) + 1
+                steps.append((instances[name].process, inputs))
+        sends = []
+        for name, midi_out in self._outputs.items():
+            inputs = tuple(buffers[node] for node in buffers
+                           if name in self._edges.get(node, ()))
+            if inputs:
+                sends.append((midi_out.on_messages, inputs))
+        return tuple(steps), tuple(sends)
+
+
+def _merge(batches: List[List[mido.Message]]) -> List[mido.Message]:
+    """
+    Merge batches of messages bound for the same output, sending a message that arrives
+    along several paths only once. A message repeated within one batch is kept repeated.
+    """
+    merged, sent = [], {}
+    for batch in batches:
+        seen = {}
+        for message in batch:
+            key = tuple(message.bytes())
+            count = seen[key] = seen.get(key, 0) + 1
+            if count > sent.get(key, 0):
+                sent[key] = count
+                merged.append(message)
+    return merged
@@ -0,0 +1,209 @@
+"""
+patterns.py
+
+A compact binary format for `Sequencer` patterns, and conversion to and from Standard MIDI Files.
+
+A pattern file holds any number of named patterns:
+
+    header:   b'MORP', version (uint8), pattern count (uint32)
+    index:    per pattern: name length (uint16), UTF-8 name, record offset (uint32),
+              record count (uint32)
+    records:  per message: tick (uint32), status, data 1, data 2 (uint8 each)
+
+All integers are little-endian. Only the index is read when a file is opened,
+and each pattern's records are decoded the first time the pattern is needed.
+"""
+import mmap
+import struct
+from typing import Dict, Iterator, List, Union
+import mido
+from .events import CHANNEL_STATUS, STATUS, Event
+
+MAGIC = b'MORP'
+VERSION = 1
+HEADER = struct.Struct('<4sBI')
+NAME = struct.Struct('<H')
+ENTRY = struct.Struct('<II')
+RECORD = struct.Struct('<IBBB')
+
+# Channel messages with a single data byte
+SHORT_STATUS = {CHANNEL_STATUS['program_change'], CHANNEL_STATUS['aftertouch']}
+
+
+def _length(status: int) -> int:
+    """Return how many bytes a message with this status byte has."""
+    if status >= 0xF0:
+        return 1
+    if status & 0xF0 in SHORT_STATUS:
+        return 2
+    return 3
+
+
+def encode(pattern: Dict[int, List[mido.Message]]) -> bytes:
+    """
+    Pack a pattern (clock tick: messages) into records, ordered by tick. Only channel and
+    real-time messages can be stored; anything else raises a `ValueError`.
+    Messages before the first tick (e.g. recorded during the count-in) are never played,
+    so they aren't stored.
+    """
+    records = bytearray()
+    for tick in sorted(tick for tick in pattern if tick >= 0):
+        for message in pattern[tick]:
+            # Only the messages that `Event` can represent can be decoded again
+            if message.type not in STATUS:
+                raise ValueError(f'{message.type} messages can not be stored in a pattern')
+            data = message.bytes()
+            records += RECORD.pack(tick, *data, *(0,) * (3 - len(data)))
+    return bytes(records)
+
+
+def decode(records: Union[bytes, memoryview]) -> Dict[int, List[Event]]:
+    """Unpack records back into a pattern of `Events`."""
+    pattern = {}
+    for tick, status, data_1, data_2 in RECORD.iter_unpack(records):
+        event = Event.from_bytes((status, data_1, data_2)[:_length(status)])
+        messages = pattern.get(tick)
+        if messages is None:
+            pattern[tick] = [event]
+        else:
+            messages.append(event)
+    return pattern
+
+
+def save_patterns(path: str, patterns: Dict[str, Dict[int, List[mido.Message]]]):
+    """Write named patterns to a pattern file."""
+    names = [name.encode('utf-8') for name in patterns]
+    encoded = [encode(pattern) for pattern in patterns.values()]
+    offset = HEADER.size + sum(NAME.size + len(name) + ENTRY.size for name in names)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(names)))
+        for name, records in zip(names, encoded):
+            file.write(NAME.pack(len(name)) + name)
+            file.write(ENTRY.pack(offset, len(records) // RECORD.size))
+            offset += len(records)
+        for records in encoded:
+            file.write(records)
+
+
+class Pattern:
+    """
+    A `Pattern` is one pattern in a `PatternLibrary`,
+    which isn't decoded until `decode` is first called.
+    """
+
+    def __init__(self, library: 'PatternLibrary', name: str, offset: int, count: int):
+        self.library = library
+        self.name = name
+        self._offset = offset
+        self._count = count
+        self._decoded = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def decode(self) -> Dict[int, List[Event]]:
+        """Return the messages of this pattern, keyed by clock tick."""
+        if self._decoded is None:
+            end = self._offset + self._count * RECORD.size
+            self._decoded = decode(self.library.buffer[self._offset:end])
+        return self._decoded
+
+    def __repr__(self) -> str:
+        return f'Pattern({self.name!r}, messages={self._count})'
+
+
+class PatternLibrary:
+    """
+    A `PatternLibrary` is a pattern file mapped into memory. Opening one only reads its
+    index, so patterns can be looked up by name, and handed to `Sequencer.load`, without
+    decoding any of their messages.
+    """
+
+    def __init__(self, path: str):
+        """
+        Arguments:
+            - `path`: the pattern file, as written by `save_patterns` or `Sequencer.save`
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a version {VERSION} pattern file')
+
+        self._patterns = {}
+        position = HEADER.size
+        for _ in range(count):
+            (length,) = NAME.unpack_from(self._mmap, position)
+            position += NAME.size
+            name = self._mmap[position:position + length].decode('utf-8')
+            position += length
+            self._patterns[name] = Pattern(self, name, *ENTRY.unpack_from(self._mmap, position))
+            position += ENTRY.size
+
+    @property
+    def buffer(self) -> mmap.mmap:
+        """Get the memory mapped contents of the pattern file"""
+        if self._mmap.closed:
+            raise ValueError(f'{self.path} has been closed')
+        return self._mmap
+
+    def __getitem__(self, name: str) -> Pattern:
+        return self._patterns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._patterns
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._patterns)
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def close(self):
+        """Unmap the pattern file. Patterns that were already decoded can still be played."""
+        self._mmap.close()
+
+    def __enter__(self) -> 'PatternLibrary':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def to_midi_file(pattern: Dict[int, List[mido.Message]],
+                 ticks_per_beat: int = 24) -> mido.MidiFile:
+    """Convert a pattern into a single-track Standard MIDI File."""
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+    previous = 0
+    for tick in sorted(tick for tick in pattern if tick >= 0):
+        time = tick * ticks_per_beat // 24
+        for message in pattern[tick]:
+            if not isinstance(message, mido.Message):
+                message = message.to_message()
+            track.append(message.copy(time=time - previous))
+            previous = time
+    track.append(mido.MetaMessage('end_of_track', time=0))
+    return midi_file
+
+
+def from_midi_file(midi_file: mido.MidiFile) -> Dict[int, List[mido.Message]]:
+    """
+    Convert the channel messages of a Standard MIDI File into a pattern,
+    rescaling its ticks to the 24 clocks per quarter note that `Sequencer` counts.
+    """
+    pattern = {}
+    for track in midi_file.tracks:
+        time = 0
+        for message in track:
+            time += message.time
+            if message.type not in CHANNEL_STATUS:
+                continue
+            # Round to the nearest clock, with ties going to the earlier one
+            tick = (time * 24 * 2 + midi_file.ticks_per_beat - 1) // \
+                (midi_file.ticks_per_beat * 2)
+            pattern.setdefault(tick, []).append(message.copy(time=0))
+    return pattern
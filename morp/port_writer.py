@@ -0,0 +1,128 @@
+"""
+port_writer.py
+"""
+from collections import deque
+import threading
+from typing import Callable, Dict, List
+import mido
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+
+def _coalesce_key(message: mido.Message):
+    """Return what identifies the value a message sets, or `None` if it can't be coalesced."""
+    if message.type == 'control_change':
+        return ('control_change', message.channel, message.control)
+    if message.type == 'pitchwheel':
+        return ('pitchwheel', message.channel)
+    return None
+
+
+class PortWriter:
+    """
+    A `PortWriter` writes messages to a MIDI device from a dedicated thread, through a
+    bounded queue, so that a slow device can't hold up the thread that produces messages.
+
+    When the queue is full, the `overflow` policy decides what happens to a new message:
+        - `block`: wait until the writer thread has made room for it
+        - `drop_oldest`: discard the oldest queued message
+        - `coalesce`: replace a queued control change or pitchwheel message for the same
+                      controller with the new value, or otherwise discard the oldest one
+    """
+
+    def __init__(self, write: Callable[[List[mido.Message]], None],
+                 max_size: int = 1024, overflow: str = BLOCK, name: str = None):
+        """
+        Arguments:
+            - `write`: a function that writes a batch of messages to the device
+            - `max_size`: the maximum number of messages waiting to be written
+            - `overflow`: one of `block`, `drop_oldest` or `coalesce`
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of {", ".join(OVERFLOW_POLICIES)}')
+        self._write = write
+        self._max_size = max_size
+        self._overflow = overflow
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._sent = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._errors = 0
+        self._max_depth = 0
+        self._thread = threading.Thread(
+            target=self._run, name=f'morp writer: {name}', daemon=True)
+        self._thread.start()
+
+    def put(self, messages: List[mido.Message]):
+        """Queue messages to be written, applying the overflow policy when the queue is full."""
+        queue = self._queue
+        with self._lock:
+            for message in messages:
+                if len(queue) >= self._max_size and not self._make_room(message):
+                    continue
+                queue.append(message)
+            self._max_depth = max(self._max_depth, len(queue))
+            self._not_empty.notify()
+
+    def _make_room(self, message: mido.Message) -> bool:
+        """Apply the overflow policy. Return whether `message` still needs to be queued."""
+        queue = self._queue
+        if self._overflow == BLOCK:
+            while len(queue) >= self._max_size and not self._closed:
+                self._not_empty.notify()
+                self._not_full.wait()
+            return True
+        if self._overflow == COALESCE:
+            key = _coalesce_key(message)
+            if key is not None:
+                for i in range(len(queue) - 1, -1, -1):
+                    if _coalesce_key(queue[i]) == key:
+                        queue[i] = message
+                        self._coalesced += 1
+                        return False
+        queue.popleft()
+        self._dropped += 1
+        return True
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            with self._lock:
+                while not queue and not self._closed:
+                    self._not_empty.wait()
+                if not queue:
+                    return
+                batch = list(queue)
+                queue.clear()
+                self._not_full.notify_all()
+            try:
+                self._write(batch)
+                self._sent += len(batch)
+            except Exception:  # pylint: disable=broad-except
+                self._errors += 1
+
+    def close(self, timeout: float = None):
+        """Write the messages that are already queued, then stop the writer thread."""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify()
+            self._not_full.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the current queue depth, and counters for written and discarded messages."""
+        return {
+            'depth': len(self._queue),
+            'max_depth': self._max_depth,
+            'sent': self._sent,
+            'dropped': self._dropped,
+            'coalesced': self._coalesced,
+            'errors': self._errors,
+        }
@@ -0,0 +1,88 @@
+"""
+quantize.py
+
+Quantization of clock tick times, e.g. of a `Sequencer` recording. Every tick time is handled
+in a single pass over an array, using NumPy when it is installed (`pip install morp[numpy]`),
+or plain Python otherwise. Both give exactly the same results.
+"""
+from typing import Dict, List, Sequence
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Quantizer:
+    """
+    A `Quantizer` moves tick times towards a grid of `grid` clocks
+    (6 = sixteenth note, 12 = eighth note, 24 = quarter note).
+
+    Arguments:
+        - `grid`: the spacing of the grid, in clocks. Ticks exactly halfway between two grid
+          lines are moved to the earlier one.
+        - `strength`: how far to move each tick towards its grid line, from 0 (not at all)
+          to 1 (all the way)
+        - `swing`: how far to delay every second grid line, as a fraction of `grid`
+        - `groove`: a template of offsets (in clocks) for consecutive grid lines, which repeats,
+          e.g. `(0, 1, 0, -1)` to push the second sixteenth and pull the fourth
+    """
+
+    def __init__(self, grid: int = 6, strength: float = 1.0, swing: float = 0.0,
+                 groove: Sequence[float] = None):
+        self.grid = grid
+        self.strength = strength
+        self.swing = swing
+        self.groove = tuple(groove) if groove else ()
+
+    def quantize(self, ticks: Sequence[int], offset: int = 0) -> List[int]:
+        """
+        Return the quantized time of each tick, less `offset`
+        (e.g. the length of a count-in), rounded to whole clocks.
+        """
+        if numpy is not None:
+            return self._quantize_numpy(ticks, offset)
+        return self._quantize_python(ticks, offset)
+
+    def _quantize_numpy(self, ticks: Sequence[int], offset: int) -> List[int]:
+        grid = self.grid
+        ticks = numpy.asarray(ticks, dtype=numpy.int64)
+        steps = ticks // grid + (ticks % grid > grid // 2)
+        targets = (steps * grid).astype(numpy.float64)
+        if self.swing:
+            targets += (steps % 2 == 1) * (self.swing * grid)
+        if self.groove:
+            targets += numpy.asarray(self.groove, dtype=numpy.float64)[steps % len(self.groove)]
+        if self.strength != 1:
+            targets = ticks + (targets - ticks) * self.strength
+        return (numpy.rint(targets).astype(numpy.int64) - offset).tolist()
+
+    def _quantize_python(self, ticks: Sequence[int], offset: int) -> List[int]:
+        grid, half, strength = self.grid, self.grid // 2, self.strength
+        swing, groove = self.swing * self.grid, self.groove
+        quantized = []
+        for tick in ticks:
+            step = tick // grid + (tick % grid > half)
+            target = step * grid
+            if swing and step % 2 == 1:
+                target += swing
+            if groove:
+                target += groove[step % len(groove)]
+            if strength != 1:
+                target = tick + (target - tick) * strength
+            quantized.append(round(target) - offset)
+        return quantized
+
+    def apply(self, pattern: Dict[int, list], offset: int = 0) -> Dict[int, list]:
+        """
+        Return a new pattern (clock tick: messages) with every tick quantized. Messages that
+        end up on the same tick are kept together, in the order of the original pattern.
+        """
+        ticks = list(pattern)
+        quantized = {}
+        for tick, new_tick in zip(ticks, self.quantize(ticks, offset)):
+            messages = quantized.get(new_tick)
+            if messages is None:
+                quantized[new_tick] = list(pattern[tick])
+            else:
+                messages.extend(pattern[tick])
+        return quantized
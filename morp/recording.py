@@ -0,0 +1,116 @@
+"""
+recording.py
+"""
+from array import array
+from typing import Dict, List
+import mido
+from .events import Event
+
+NOTE_STATUS = {'note_off': 0x80, 'note_on': 0x90}
+# Channel messages with a single data byte
+SHORT_STATUS = frozenset((0xC0, 0xD0))
+
+
+class RecordingLog:
+    """
+    A `RecordingLog` stores recorded messages as four parallel columns (clock tick, status byte
+    and two data bytes), preallocated for `capacity` messages and doubled in size whenever it
+    fills up, so that recording a message is just four index assignments.
+
+    The log is made up of takes. Each take is layered over the ones before it (overdubbing),
+    and `undo` drops the latest one.
+    """
+    __slots__ = ('ticks', 'status', 'data1', 'data2', '_length', '_takes')
+
+    def __init__(self, capacity: int = 4096):
+        self.ticks = array('I', bytes(4 * capacity))
+        self.status = bytearray(capacity)
+        self.data1 = bytearray(capacity)
+        self.data2 = bytearray(capacity)
+        self._length = 0
+        self._takes = []
+
+    @property
+    def capacity(self) -> int:
+        """Get how many messages fit in the log before it has to grow"""
+        return len(self.status)
+
+    @property
+    def takes(self) -> int:
+        """Get the number of takes in the log"""
+        return len(self._takes)
+
+    def new_take(self):
+        """Start a new take, layered over the ones already recorded."""
+        self._takes.append(self._length)
+
+    def undo(self) -> bool:
+        """Drop the latest take, and return whether there was one to drop."""
+        if not self._takes:
+            return False
+        self._length = self._takes.pop()
+        return True
+
+    def clear(self):
+        """Drop every take, keeping the memory allocated for them."""
+        self._length = 0
+        self._takes.clear()
+
+    def append(self, tick: int, message: mido.Message):
+        """Record `message` at clock tick `tick`, in the current take."""
+        index = self._length
+        if index == len(self.status):
+            self._grow()
+        if not self._takes:
+            self._takes.append(0)
+        status = NOTE_STATUS.get(message.type)
+        if status is not None:
+            self.status[index] = status | message.channel
+            self.data1[index] = message.note
+            self.data2[index] = message.velocity
+        else:
+            data = message.bytes()
+            self.status[index] = data[0]
+            self.data1[index] = data[1] if len(data) > 1 else 0
+            self.data2[index] = data[2] if len(data) > 2 else 0
+        self.ticks[index] = tick
+        self._length = index + 1
+
+    def reserve(self, capacity: int):
+        """Make room for at least `capacity` messages ahead of time."""
+        if capacity > len(self.status):
+            self._grow(capacity - len(self.status))
+
+    def _grow(self, count: int = None):
+        count = count or len(self.status) or 1
+        self.ticks.frombytes(bytes(4 * count))
+        for column in (self.status, self.data1, self.data2):
+            column.extend(bytes(count))
+
+    def to_pattern(self) -> Dict[int, List[Event]]:
+        """
+        Return every take as a single pattern (clock tick: messages), as `Events`. Messages on the
+        same tick are kept in the order they were recorded, earlier takes first.
+        """
+        ticks, status, data1, data2 = self.ticks, self.status, self.data1, self.data2
+        pattern = {}
+        for index in range(self._length):
+            if status[index] & 0xF0 in SHORT_STATUS:
+                event = Event.from_bytes((status[index], data1[index]))
+            else:
+                event = Event.from_bytes((status[index], data1[index], data2[index]))
+            messages = pattern.get(ticks[index])
+            if messages is None:
+                pattern[ticks[index]] = [event]
+            else:
+                messages.append(event)
+        return pattern
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __repr__(self) -> str:
+        return f'RecordingLog({self._length} messages, {len(self._takes)} takes)'
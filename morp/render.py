@@ -0,0 +1,329 @@
+"""
+render.py
+
+Offline rendering of MIDI files through an `EffectsLoop`, as fast as the effects can run:
+
+    loop = EffectsLoop([Autotune(scale={0, 3, 7, 10}), Harmonizer(voices={-12})])
+    render('take 1.mid', 'take 1 (rendered).mid', loop)
+    render_directory('takes', 'rendered', loop)
+
+Events are streamed from the tracks of the source file, which is memory mapped, through the
+loop, and straight into the destination file, so rendering a file of any size takes the same
+amount of memory. Effects that send messages in real time from the `Scheduler` (e.g. `Delay`)
+can't be rendered, since the file is played much faster than real time.
+"""
+import heapq
+import mmap
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Tuple, Union
+import mido
+from mido.midifiles.meta import build_meta_message
+from .events import SYSTEM_STATUS, to_event
+from .midi_box import EffectsLoop, MidiBox
+from .sequencer import Sequencer
+
+CLOCK = mido.Message('clock')
+
+
+def _varlen(value: int) -> bytes:
+    """Encode a MIDI file variable-length quantity."""
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def _read_varlen(data: mmap.mmap, position: int) -> Tuple[int, int]:
+    """Decode the MIDI file variable-length quantity at `position`, and return it and its end."""
+    value = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, position
+
+
+class _Track:
+    """One track of a `MidiFileReader`, whose messages are decoded each time it is iterated."""
+    __slots__ = ('_data', '_start', '_end')
+
+    def __init__(self, data: mmap.mmap, start: int, end: int):
+        self._data = data
+        self._start = start
+        self._end = end
+
+    def __iter__(self) -> Iterator[Union[mido.Message, mido.MetaMessage]]:
+        data, position, end = self._data, self._start, self._end
+        running_status = None
+        while position < end:
+            delta, position = _read_varlen(data, position)
+            status = data[position]
+            if status < 0x80:
+                if running_status is None:
+                    raise OSError('running status without a previous status byte')
+                status = running_status
+            else:
+                position += 1
+            if status == 0xFF:
+                meta_type = data[position]
+                length, position = _read_varlen(data, position + 1)
+                yield build_meta_message(meta_type, list(data[position:position + length]),
+                                         delta)
+                position += length
+                continue
+            if status in (0xF0, 0xF7):
+                length, position = _read_varlen(data, position)
+                sysex = data[position:position + length]
+                position += length
+                # mido keeps the data without the bytes that start and end the message
+                if sysex[:1] == b'\xF0':
+                    sysex = sysex[1:]
+                if sysex[-1:] == b'\xF7':
+                    sysex = sysex[:-1]
+                yield mido.Message('sysex', data=sysex, time=delta)
+                continue
+            # Meta and system exclusive messages don't set the running status
+            running_status = status
+            length = 2 if 0xC0 <= status < 0xE0 else 3
+            yield mido.Message.from_bytes([status, *data[position:position + length - 1]],
+                                          time=delta)
+            position += length - 1
+
+
+class MidiFileReader:
+    """
+    A `MidiFileReader` reads a Standard MIDI File without loading it: the file is memory mapped,
+    and the messages of each of its `tracks` are only decoded as they are iterated. It can be
+    used in place of a `mido.MidiFile` by `merge_tracks` and `stream`.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')  # pylint: disable=consider-using-with
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            chunk, length = struct.unpack_from('>4sL', self._data)
+            if chunk != b'MThd':
+                raise OSError(f'{path} is not a MIDI file')
+            self.type, count, self.ticks_per_beat = struct.unpack_from('>HHH', self._data, 8)
+            self.tracks = []
+            position = 8 + length
+            while len(self.tracks) < count and position < len(self._data):
+                chunk, length = struct.unpack_from('>4sL', self._data, position)
+                position += 8
+                if chunk == b'MTrk':
+                    self.tracks.append(_Track(self._data, position, position + length))
+                position += length
+        except (ValueError, struct.error) as error:
+            self._file.close()
+            raise OSError(f'{path} is not a valid MIDI file') from error
+        except OSError:
+            self._file.close()
+            raise
+
+    def close(self):
+        """Unmap and close the file."""
+        self._data.close()
+        self._file.close()
+
+    def __enter__(self) -> 'MidiFileReader':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def merge_tracks(midi_file: Union[mido.MidiFile, MidiFileReader]
+                 ) -> Iterator[Tuple[int, mido.Message]]:
+    """
+    Yield `(tick, message)` for every message in every track of `midi_file`, in order,
+    where `tick` is counted from the start of the file. Messages at the same tick keep
+    the order of their tracks.
+    """
+    def absolute(track_number: int, track: mido.MidiTrack):
+        tick = 0
+        for message in track:
+            tick += message.time
+            yield tick, track_number, message
+
+    for tick, _, message in heapq.merge(
+            *(absolute(number, track) for number, track in enumerate(midi_file.tracks)),
+            key=lambda item: item[:2]):
+        yield tick, message
+
+
+class MidiFileWriter:
+    """
+    A `MidiFileWriter` writes a single-track Standard MIDI File one message at a time,
+    and fills in the length of the track when it is closed.
+    """
+
+    def __init__(self, file: Union[str, BinaryIO], ticks_per_beat: int = 480):
+        """
+        Arguments:
+            - `file`: a path, or a seekable binary file
+            - `ticks_per_beat`: the resolution of the ticks passed to `write`
+        """
+        self._owned = isinstance(file, str)
+        self._file = open(file, 'wb') if self._owned else file  # pylint: disable=consider-using-with
+        self._file.write(b'MThd' + struct.pack('>LHHH', 6, 0, 1, ticks_per_beat))
+        self._file.write(b'MTrk\0\0\0\0')
+        self._start = self._file.tell()
+        self._tick = 0
+        self._running_status = None
+
+    def write(self, tick: int, message: mido.Message):
+        """Append `message` at `tick`, which must not be earlier than the previous one."""
+        data = bytearray(_varlen(tick - self._tick))
+        self._tick = tick
+        if isinstance(message, mido.MetaMessage):
+            data += bytes(message.bytes())
+            self._running_status = None
+        elif message.type == 'sysex':
+            data.append(0xF0)
+            data += _varlen(len(message.data) + 1)
+            data += bytes(message.data)
+            data.append(0xF7)
+            self._running_status = None
+        else:
+            message_bytes = message.bytes()
+            if message_bytes[0] == self._running_status:
+                data += bytes(message_bytes[1:])
+            else:
+                data += bytes(message_bytes)
+                self._running_status = message_bytes[0]
+        self._file.write(data)
+
+    def close(self):
+        """Write the end of the track, and patch its length into the chunk header."""
+        self._file.write(b'\0\xFF\x2F\0')
+        end = self._file.tell()
+        self._file.seek(self._start - 4)
+        self._file.write(struct.pack('>L', end - self._start))
+        self._file.seek(end)
+        if self._owned:
+            self._file.close()
+
+    def __enter__(self) -> 'MidiFileWriter':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class _Collector(MidiBox):
+    """The end of the render graph, which keeps whatever reaches it until it is drained."""
+    __slots__ = ('collected',)
+
+    def _init_state(self):
+        super()._init_state()
+        self.collected = []
+
+    def on_message(self, message: mido.Message):
+        self.collected.append(message)
+
+    def on_messages(self, messages: List[mido.Message]):
+        self.collected.extend(messages)
+
+
+def stream(midi_file: Union[mido.MidiFile, MidiFileReader], fx_loop: EffectsLoop,
+           compiled: bool = True, clock: bool = False,
+           compact: bool = True) -> Iterator[Tuple[int, mido.Message]]:
+    """
+    Yield `(tick, message)` for everything that comes out of `fx_loop` while the messages of
+    `midi_file` are played through it. Meta messages (tempo, etc.) are passed along as-is,
+    and `note_on` messages with a velocity of 0 are played as `note_off` messages.
+
+    Arguments:
+        - `midi_file`: the source file
+        - `fx_loop`: the effects to render with, which is instanced and left untouched. Raises
+        `ValueError` if any of them are `realtime`.
+        - `compiled`: whether to run the instance of the loop as a compiled pipeline
+        - `clock`: whether to also send 24 clock messages per quarter note through the loop,
+        and start its `Sequencers` playing, so that they play along with the file
+        - `compact`: whether to convert notes into `Events` on the way into the loop,
+        which makes effects that copy notes several times faster
+    """
+    _check_offline(fx_loop)
+    source, collector = MidiBox(), _Collector()
+    source.set_outputs([collector])
+    source.assign_fx_loop(fx_loop, compiled=compiled)
+    if clock:
+        for box in source._fx_loop.boxes:  # pylint: disable=protected-access
+            if isinstance(box, Sequencer):
+                box.play()
+    collected = collector.collected
+    ticks_per_clock = midi_file.ticks_per_beat / 24
+    clocks = 0
+
+    for tick, message in merge_tracks(midi_file):
+        if clock:
+            while clocks * ticks_per_clock <= tick:
+                clock_tick = round(clocks * ticks_per_clock)
+                source.on_message(CLOCK)
+                clocks += 1
+                yield from _drain(collected, clock_tick)
+        if message.is_meta:
+            if message.type != 'end_of_track':
+                yield tick, message
+            continue
+        if message.type == 'note_on' and message.velocity == 0:
+            # Files usually end notes this way, but effects would take it for a note_on
+            message = mido.Message('note_off', channel=message.channel, note=message.note,
+                                   velocity=0, time=message.time)
+        source.on_message(to_event(message) if compact else message)
+        yield from _drain(collected, tick)
+
+
+def _check_offline(fx_loop: EffectsLoop):
+    """Raise `ValueError` if any box in `fx_loop` (or its nested loops) is `realtime`."""
+    for box in fx_loop.boxes:
+        if box.realtime:
+            raise ValueError(f'{type(box).__name__} sends messages from the Scheduler in real '
+                             'time, so it can\'t be used to render files')
+        if box._fx_loop_template:  # pylint: disable=protected-access
+            _check_offline(box._fx_loop_template)  # pylint: disable=protected-access
+
+
+def _drain(collected: list, tick: int) -> Iterator[Tuple[int, mido.Message]]:
+    for message in collected:
+        # Real-time messages (like the clock) can't be stored in a MIDI file
+        if message.type not in SYSTEM_STATUS:
+            yield tick, message
+    collected.clear()
+
+
+def render(source: str, destination: str, fx_loop: EffectsLoop, **options) -> str:
+    """
+    Render the MIDI file at `source` through `fx_loop` into a new MIDI file at `destination`,
+    and return `destination`. Accepts the same `options` as `stream`.
+    """
+    with MidiFileReader(source) as midi_file, \
+            MidiFileWriter(destination, midi_file.ticks_per_beat) as writer:
+        for tick, message in stream(midi_file, fx_loop, **options):
+            writer.write(tick, message)
+    return destination
+
+
+def _render(arguments: tuple) -> str:
+    source, destination, fx_loop, options = arguments
+    return render(source, destination, fx_loop, **options)
+
+
+def render_directory(source: str, destination: str, fx_loop: EffectsLoop,
+                     processes: int = None, **options) -> List[str]:
+    """
+    Render every MIDI file in the `source` directory into the `destination` directory,
+    spread over `processes` worker processes (one per CPU by default).
+    Return the paths of the rendered files.
+    """
+    os.makedirs(destination, exist_ok=True)
+    jobs = [(os.path.join(source, name), os.path.join(destination, name), fx_loop, options)
+            for name in sorted(os.listdir(source))
+            if name.lower().endswith(('.mid', '.midi'))]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_render, jobs))
@@ -0,0 +1,264 @@
+"""
+scheduler.py
+"""
+import threading
+from math import ceil
+from time import perf_counter
+from typing import Any, Callable, List, Union
+
+# Each level of the wheel has 256 slots, and each slot of a level spans a whole turn of the
+# level below it, so four levels cover 2^32 ticks (about 50 days at 1 ms per tick)
+BITS = 8
+SLOTS = 1 << BITS
+MASK = SLOTS - 1
+LEVELS = 4
+# The slot of a timer that is due, but hasn't been called yet
+_DUE = object()
+
+
+class Timer:
+    """A callback scheduled on a `Scheduler`, which can be passed to `Scheduler.cancel`."""
+    __slots__ = ('deadline', 'callback', 'args', 'slot')
+
+    def __init__(self, deadline: int, callback: Callable, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+    @property
+    def pending(self) -> bool:
+        """Get whether the callback is still waiting to be called"""
+        return self.slot is not None
+
+
+class Scheduler:
+    """
+    A `Scheduler` calls callbacks after a delay, for any number of `MidiBoxes`, from a single
+    thread. Callbacks are kept in a hierarchical timer wheel, so scheduling and cancelling
+    each take constant time, however many callbacks are pending.
+
+    Time is counted in ticks of `resolution` seconds. Each tick has a slot in the first level
+    of the wheel, and callbacks due further in the future wait in the slots of the higher
+    levels, which are moved down a level each time the level below them comes round. The
+    thread sleeps until the next of those things happens, however far away it is.
+
+    Arguments:
+        - `resolution`: the length of a tick, in seconds
+        - `clock`: the time source, in seconds
+        - `run_on`: a function that due callbacks are handed to, to call them on another
+          thread (e.g. `Dispatcher.call`), instead of calling them right away
+    """
+
+    def __init__(self, resolution: float = 0.001, clock: Callable[[], float] = perf_counter,
+                 run_on: Callable[[Callable[[], None]], None] = None):
+        self.resolution = resolution
+        self.clock = clock
+        self.run_on = run_on
+        self._start = clock()
+        self._tick = 0
+        self._count = 0
+        self._wheel = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # The tick that the scheduler's thread is sleeping until (None while it's awake)
+        self._sleep_until = None
+        self._running = False
+        self._thread = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def running(self) -> bool:
+        """Get whether the scheduler's own thread is calling callbacks"""
+        return self._running
+
+    def schedule(self, delay: float, callback: Callable, *args: Any) -> Timer:
+        """Call `callback(*args)` after `delay` seconds, and return its `Timer`."""
+        ticks = (self.clock() + delay - self._start) / self.resolution
+        with self._lock:
+            timer = Timer(max(ceil(ticks), self._tick), callback, args)
+            self._add(timer)
+            self._count += 1
+            # Wake the thread up if it would otherwise sleep through this timer
+            if self._sleep_until is not None and timer.deadline < self._sleep_until:
+                self._sleep_until = None
+                self._wake.set()
+        return timer
+
+    def cancel(self, timer: Timer):
+        """Stop `timer` from being called, if it hasn't been already."""
+        with self._lock:
+            slot = timer.slot
+            if slot is _DUE:
+                # Already taken off the wheel, but not called yet
+                timer.slot = None
+            elif slot is not None:
+                del slot[timer]
+                timer.slot = None
+                self._count -= 1
+
+    def _add(self, timer: Timer):
+        deadline = timer.deadline
+        ahead = deadline - self._tick
+        for level in range(LEVELS):
+            if ahead < 1 << (BITS * (level + 1)) or level == LEVELS - 1:
+                if ahead >= 1 << (BITS * LEVELS):
+                    # Beyond the wheel: wait in the furthest slot, and be placed again later
+                    deadline = self._tick + (1 << (BITS * LEVELS)) - 1
+                slot = self._wheel[level][(deadline >> (BITS * level)) & MASK]
+                break
+        slot[timer] = None
+        timer.slot = slot
+
+    def _cascade(self, level: int) -> int:
+        """Move the timers of the current slot of `level` down, and return its index."""
+        index = (self._tick >> (BITS * level)) & MASK
+        slot = self._wheel[level][index]
+        if slot:
+            self._wheel[level][index] = {}
+            for timer in slot:
+                self._add(timer)
+        return index
+
+    def advance(self, now: float = None) -> int:
+        """
+        Call every callback that is due by `now` (the current time by default), in the order
+        they are due, and return how many were called. The scheduler's own thread calls
+        this, but it can also be called directly, e.g. in tests.
+        """
+        target = int(((self.clock() if now is None else now) - self._start) / self.resolution)
+        due: List[Timer] = []
+        with self._lock:
+            while self._tick <= target:
+                # Skip straight to the next tick that has anything to move down or call
+                next_tick = self._next_tick()
+                if next_tick is None or next_tick > target:
+                    self._tick = target + 1
+                    break
+                self._tick = next_tick
+                index = next_tick & MASK
+                if index == 0:
+                    # The first level has come round: move the next slot of each level down
+                    level = 1
+                    while level < LEVELS and self._cascade(level) == 0:
+                        level += 1
+                slot = self._wheel[0][index]
+                if slot:
+                    self._wheel[0][index] = {}
+                    self._count -= len(slot)
+                    for timer in slot:
+                        timer.slot = _DUE
+                    due.extend(slot)
+                self._tick += 1
+        if due:
+            if self.run_on:
+                self.run_on(lambda: self._call(due))
+            else:
+                self._call(due)
+        return len(due)
+
+    def _call(self, timers: List[Timer]):
+        lock = self._lock
+        for timer in timers:
+            # A timer may have been cancelled since it was taken off the wheel
+            with lock:
+                if timer.slot is not _DUE:
+                    continue
+                timer.slot = None
+            try:
+                timer.callback(*timer.args)
+            except Exception as error:  # pylint: disable=broad-except
+                print(error)
+
+    def _next_tick(self) -> Union[int, None]:
+        """
+        Return the next tick that something happens on: a timer is due, or a slot of a higher
+        level is moved down. Must be called holding `_lock`.
+        """
+        if not self._count:
+            return None
+        tick = self._tick
+        index = tick & MASK
+        if index == 0:
+            return tick
+        wheel = self._wheel[0]
+        for next_index in range(index, SLOTS):
+            if wheel[next_index]:
+                return tick - index + next_index
+        # Nothing is due before the first level comes round again
+        turn = tick - index + SLOTS
+        next_tick = None
+        for next_index in range(index):
+            if wheel[next_index]:
+                next_tick = turn + next_index
+                break
+        for level in range(1, LEVELS):
+            shift = BITS * level
+            wheel = self._wheel[level]
+            current = (tick >> shift) & MASK
+            for distance in range(1, SLOTS + 1):
+                if wheel[(current + distance) & MASK]:
+                    cascade = ((tick >> shift) + distance) << shift
+                    if next_tick is None or cascade < next_tick:
+                        next_tick = cascade
+                    break
+        return next_tick
+
+    def start(self):
+        """Start calling callbacks from the scheduler's own thread."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='morp scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the scheduler's thread. Pending callbacks stay scheduled."""
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            self._wake.clear()
+            self.advance()
+            with self._lock:
+                next_tick = self._next_tick()
+                # Sleep until the next thing that happens, rather than waking on every tick
+                self._sleep_until = next_tick if next_tick is not None else float('inf')
+            if next_tick is None:
+                self._wake.wait()
+            else:
+                remaining = self._start + next_tick * self.resolution - self.clock()
+                if remaining > 0:
+                    self._wake.wait(remaining)
+            with self._lock:
+                self._sleep_until = None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler() -> Scheduler:
+    """Return the `Scheduler` shared by every `MidiBox`, starting it the first time."""
+    global _default  # pylint: disable=global-statement
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                scheduler = Scheduler()
+                scheduler.start()
+                _default = scheduler
+    return _default
+
+
+def set_default_scheduler(scheduler: Scheduler) -> Scheduler:
+    """Replace the shared `Scheduler` (e.g. with one driven by `advance` in tests)."""
+    global _default  # pylint: disable=global-statement
+    _default = scheduler
+    return scheduler
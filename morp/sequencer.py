@@ -1,42 +1,94 @@
 """
 sequencer.py
 """
+from copy import copy
 from typing import Union
-from mido import Message
-from .midi_box import MidiBox, MidiIn
+import mido
+from .clock import TRANSPORT_TYPES, Clock
+from .events import Event
+from .midi_box import NOTE_TYPES, MidiBox, MidiIn
+from .patterns import Pattern, PatternLibrary, from_midi_file, save_patterns, to_midi_file
+from .quantize import Quantizer
+from .recording import RecordingLog
+
+METRONOME_ON = Event('note_on', note=100, velocity=100)
+METRONOME_OFF = Event('note_off', note=100, velocity=100)
+# How many recorded messages fit before the recording log has to grow
+RECORDING_CAPACITY = 4096
 
 
 class Sequencer(MidiBox):
     """
     Sequencer
+
+    The pattern is compiled into one slot per clock tick (`measures * clocks_per_measure` of
+    them), so playback is a single index per tick, and stored messages are emitted as-is.
+
+    Instances of a `Sequencer` in several `EffectsLoops` follow the same clock source, and
+    share a loaded `Pattern` until it is decoded, but each has its own `quantizer` and pattern.
     """
+    __slots__ = ('_clock_source', '_count', '_subdivision', '_clocks_per_measure', '_measures',
+                 '_count_in', '_pattern', '_encoded', '_slots', 'quantizer', '_playing',
+                 '_recording', '_clock_count', '_measure', '_recording_log', '_previous_pattern',
+                 '_base_pattern')
+    handles = NOTE_TYPES | {'clock'} | TRANSPORT_TYPES
+    _shares_config = True
 
     def __init__(self):
         self._clock_source = None
-        self._playing = False
-        self._recording = False
         # Default to 4/4 time signature
         self._count = 4
         self._subdivision = 4
         self._clocks_per_measure = 24 * self._count
-        self._clock_count = 0
-        self._measure = 0
         self._measures = 1
         self._count_in = 2
         self._pattern = None
-        self._recording_pattern = {}
+        self._encoded = None
+        self._slots = ()
         # 6 clocks per 16th note
-        self._quantize_resolution = 6
+        self.quantizer = Quantizer(grid=6)
         super().__init__()
 
+    def _init_state(self):
+        super()._init_state()
+        self._playing = False
+        self._recording = False
+        self._clock_count = 0
+        self._measure = 0
+        # Only allocated once recording starts, since most instances never record
+        self._recording_log = RecordingLog(capacity=0)
+        self._previous_pattern = None
+        # The pattern that overdubbed takes are layered over, if they aren't the whole pattern
+        self._base_pattern = None
+        if isinstance(self._clock_source, Clock):
+            # Instances of this sequencer follow the same clock
+            self._clock_source.add_target(self)
+
+    def clone(self) -> 'Sequencer':
+        # The clock source is shared, but the quantizer and pattern can be changed in place
+        box = super().clone()
+        box.quantizer = copy(self.quantizer)
+        if self._pattern is not None:
+            box._pattern = {**self._pattern, 'notes': {
+                tick: list(messages) for tick, messages in self._pattern['notes'].items()}}
+            box._compile()
+        return box
+
     @property
-    def clock_source(self) -> Union[MidiIn, None]:
-        """ clock_source getter """
+    def clock_source(self) -> Union[MidiIn, Clock, None]:
+        """
+        Get where clock messages come from: either a `MidiIn` that is routed to this
+        sequencer, or an internal `Clock` that sends them to this sequencer directly.
+        """
         return self._clock_source
 
     @clock_source.setter
-    def clock_source(self, clock_source: MidiIn):
+    def clock_source(self, clock_source: Union[MidiIn, Clock, None]):
+        if isinstance(self._clock_source, Clock):
+            self._clock_source.remove_target(self)
         self._clock_source = clock_source
+        if isinstance(clock_source, Clock):
+            clock_source.add_target(self)
 
     @property
     def count(self) -> int:
@@ -47,6 +99,7 @@ class Sequencer(MidiBox):
     def count(self, count: int):
         self._count = count
         self._clocks_per_measure = 24 * self._count
+        self._compile()
 
     @property
     def measures(self) -> int:
@@ -56,6 +109,7 @@ class Sequencer(MidiBox):
     @measures.setter
     def measures(self, measures: int) -> None:
         self._measures = measures
+        self._compile()
 
     @property
     def subdivision(self) -> int:
@@ -69,15 +123,29 @@ class Sequencer(MidiBox):
     @property
     def pattern(self) -> Union[dict, None]:
         """Get the messages currently recorded for playback"""
+        self._decode()
         return self._pattern
 
     @pattern.setter
     def pattern(self, new_pattern: dict):
-        last_message = max(new_pattern.keys())
+        self._encoded = None
+        last_message = max(new_pattern.keys(), default=0)
         self._pattern = {
             'notes': new_pattern,
             'measure_count': (last_message // self._clocks_per_measure) + 1
         }
+        self._compile()
+
+    def _compile(self):
+        """Lay the pattern out into one tuple of messages per clock tick."""
+        if not self._pattern:
+            self._slots = ()
+            return
+        slots = [()] * (self._measures * self._clocks_per_measure)
+        for tick, messages in self._pattern['notes'].items():
+            if 0 <= tick < len(slots) and messages:
+                slots[tick] = (*slots[tick], *messages)
+        self._slots = slots
 
     @property
     def playing(self) -> bool:
@@ -99,49 +167,117 @@ class Sequencer(MidiBox):
         self._playing = not recording
         self._recording = recording
 
-    def load(self, data: dict):
-        """Load messages previously stored as JSON"""
+    def load(self, source: Union[dict, Pattern, str], name: str = None):
+        """
+        Load a pattern for playback.
+
+        Arguments:
+            - `source`: a pattern (clock tick: messages), a `Pattern` from a `PatternLibrary`,
+            or the path of a pattern file or Standard MIDI File (`.mid`)
+            - `name`: which pattern to load from a pattern file, defaulting to the first one
+        """
+        if isinstance(source, str):
+            if source.lower().endswith(('.mid', '.midi')):
+                self.pattern = from_midi_file(mido.MidiFile(source))
+                return
+            with PatternLibrary(source) as library:
+                pattern = library[name if name is not None else next(iter(library))]
+                self.pattern = pattern.decode()
+        elif isinstance(source, Pattern):
+            # Decoded the first time the pattern is needed, i.e. usually on `play`
+            self._pattern = None
+            self._slots = ()
+            self._encoded = source
+        else:
+            self.pattern = source
+
+    def _decode(self):
+        if self._encoded is not None:
+            self.pattern = self._encoded.decode()
+
+    def save(self, path: str, name: str = 'pattern'):
+        """
+        Save the current pattern as a pattern file,
+        or as a Standard MIDI File if `path` ends with `.mid`.
+        """
+        notes = self.pattern['notes'] if self.pattern else {}
+        if path.lower().endswith(('.mid', '.midi')):
+            to_midi_file(notes).save(path)
+        else:
+            save_patterns(path, {name: notes})
 
     def on_note(self, message):
+        if message.type in TRANSPORT_TYPES:
+            if message.type == 'start':
+                self.reset()
+            # Boxes after this one (e.g. a `ClockDivider`) keep their phase from transport too
+            self.route_message(message)
+            return
         super().on_note(message)
         if self.recording and not self.fx_return:
-            notes = self._recording_pattern.get(self._clock_count, [])
-            notes.append(message.copy())
-            self._recording_pattern[self._clock_count] = notes
+            self._recording_log.append(self._clock_count, message)
 
     def _metronome(self, message):
         super().route_message(message, through=True)
 
     def on_clock(self, _):
-        if self.playing:
-            messages = self.pattern.get('notes').get(self._clock_count)
-            for message in messages or []:
-                super().on_message(message.copy())
+        if self._playing and self._clock_count < len(self._slots):
+            for message in self._slots[self._clock_count]:
+                super().on_note(message)
         if self.recording:
             position = self._clock_count % 24
             if position == 0:
-                self._metronome(Message('note_on', note=100, velocity=100))
+                self._metronome(METRONOME_ON)
             if position == 6:
-                self._metronome(Message('note_off', note=100, velocity=100))
+                self._metronome(METRONOME_OFF)
 
         self._clock_count += 1
         if self.playing:
             self._clock_count %= self.measures * self._clocks_per_measure
 
-    def record(self):
-        """record"""
+    def record(self, overdub: bool = False):
+        """
+        Start recording a new take, which replaces the pattern on `stop`. With `overdub=True`,
+        the take is layered over the takes recorded since the last one without it, or over the
+        current pattern when there are none (e.g. one that was loaded).
+        """
+        if not overdub or not self._recording_log:
+            self._recording_log.clear()
+            self._previous_pattern = self.pattern['notes'] if self.pattern else None
+            self._base_pattern = self._previous_pattern if overdub else None
+        self._recording_log.reserve(RECORDING_CAPACITY)
+        self._recording_log.new_take()
         self.recording = True
 
+    def undo(self):
+        """
+        Drop the latest take (when not recording), going back to the pattern recorded before
+        it, or to the pattern from before recording when no takes are left.
+        """
+        if self.recording or not self._recording_log.undo():
+            return
+        if self._recording_log:
+            self.pattern = self._recorded()
+        elif self._previous_pattern is not None:
+            self.pattern = self._previous_pattern
+        else:
+            self._pattern = None
+            self._compile()
+
     def play(self):
         """play"""
+        self._decode()
         self.reset()
         self.playing = True
 
     def stop(self):
         """stop"""
-        if self.recording:
-            self.pattern = self._quantize(self._recording_pattern)
-        self.playing = False
+        # An empty recording keeps the pattern that was already there
+        if self.recording and self._recording_log:
+            self.pattern = self._recorded()
+        # Neither playing nor recording (the `playing` setter would turn recording on)
+        self._playing = False
+        self._recording = False
         self.reset()
 
     def reset(self):
@@ -149,25 +285,28 @@ class Sequencer(MidiBox):
         self._clock_count = 0
         self._measure = 0
 
-    # After recording a pattern, quantize it by the specified resolution
-    # 6 = sixteenth note
-    # 12 = 8th note
-    # 24 = quarter note
+    # After recording a pattern, quantize it with `self.quantizer`, and drop the count-in
     def _quantize(self, pattern: dict):
         """_quantize"""
-        quantized = {}
-        for clock_time in pattern:
-            position = clock_time % self._quantize_resolution
-            nearest_neighbor = \
-                (clock_time - position if position <= self._quantize_resolution // 2
-                 else clock_time + (self._quantize_resolution - position)) \
-                - (self._count_in * self._clocks_per_measure)
-
-            # Don't clobber anything that's already in the nearest_neighbor slot
-            notes = quantized.get(nearest_neighbor, [])
-            quantized[nearest_neighbor] = [*notes, *pattern[clock_time]]
-
-        return quantized
+        return self.quantizer.apply(pattern, offset=self._count_in * self._clocks_per_measure)
+
+    def _recorded(self) -> dict:
+        """Return the recorded takes as a pattern, layered over `_base_pattern`."""
+        recorded = self._quantize(self._recording_log.to_pattern())
+        if not self._base_pattern:
+            return recorded
+        pattern = {tick: list(messages) for tick, messages in self._base_pattern.items()}
+        for tick, messages in recorded.items():
+            pattern.setdefault(tick, []).extend(messages)
+        return pattern
+
+    def requantize(self, quantizer: Quantizer = None):
+        """
+        Quantize the current pattern again, e.g. with a different grid or groove,
+        using `quantizer` (or `self.quantizer` when it isn't provided).
+        """
+        if self.pattern:
+            self.pattern = (quantizer or self.quantizer).apply(self.pattern['notes'])
 
     # The re-imagining of the oldschool MORP thing where you enter notes one-by-one
     # This would allow the user to configure the resolution as they go
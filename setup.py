@@ -11,6 +11,9 @@ setup(
         'mido>=1.2.10',
         'python-rtmidi>=1.4.9'
     ],
+    extras_require={
+        'numpy': ['numpy']
+    },
     packages=['morp', 'morp.effects'],
     package_dir={'morp': 'morp', 'morp.effects': 'morp/effects'}
 )
@@ -7,23 +7,31 @@ class MockOutput:
     def send(self, message):
         pass
 
+    def close(self):
+        pass
+
 
 class MockInput:
     def callback(self, message):
         pass
 
+    def close(self):
+        pass
+
 
 class MockMidiMessage:
-    def __init__(self, message_type: str, note: int, velocity: int):
+    def __init__(self, message_type: str, note: int, velocity: int, channel: int = 0):
         self.type = message_type
         self.note = note
         self.velocity = velocity
+        self.channel = channel
 
     def copy(self, message_type=None, note=None, velocity=None):
         return MockMidiMessage(
             message_type=message_type or self.type,
             note=note or self.note,
-            velocity=velocity or self.velocity)
+            velocity=velocity or self.velocity,
+            channel=self.channel)
 
 
 def mido_get_input_names():
@@ -0,0 +1,115 @@
+# pylint: disable-all
+import asyncio
+import threading
+import unittest
+import mido
+from morp import MidiBox, MidiService
+from morp.aio import Bridge
+from mocks import MockInput
+
+
+class Recorder(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.received.append(message)
+
+
+def send_from_thread(midi_in, notes):
+    def run():
+        for note in notes:
+            midi_in.input.callback(mido.Message('note_on', note=note, velocity=64))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        self.midi_service = MidiService()
+
+    def test_bridge_batches(self):
+        async def run():
+            bridge = Bridge()
+            threads = [threading.Thread(target=lambda start=start: [
+                bridge.push(start + i) for i in range(1000)]) for start in (0, 10000)]
+            for thread in threads:
+                thread.start()
+            received, batches = [], 0
+            while len(received) < 2000:
+                received.extend(await bridge.get_batch())
+                batches += 1
+            for thread in threads:
+                thread.join()
+            return received, batches
+
+        received, batches = asyncio.run(asyncio.wait_for(run(), 5))
+        # Every item arrives once, in the order each thread pushed it
+        self.assertEqual([item for item in received if item < 10000], list(range(1000)))
+        self.assertEqual(len(received), 2000)
+        self.assertLessEqual(batches, 2000)
+
+    def test_stream(self):
+        midi_in = self.midi_service.open_input('device 1')
+
+        async def consume():
+            received = []
+            async for message in self.midi_service.stream('device 1'):
+                received.append(message.note)
+                if len(received) == 100:
+                    break
+            return received
+
+        async def run():
+            task = asyncio.ensure_future(consume())
+            # Start sending once the stream is listening
+            await asyncio.sleep(0.01)
+            thread = send_from_thread(midi_in, range(100))
+            received = await task
+            thread.join()
+            return received
+
+        received = asyncio.run(asyncio.wait_for(run(), 5))
+        self.assertEqual(received, list(range(100)))
+        self.assertEqual(midi_in.input.callback, midi_in.on_message)
+
+    def test_run(self):
+        recorder = Recorder()
+        midi_ins = []
+        for name in ('device 1', 'device 2'):
+            midi_in = self.midi_service.open_input(name)
+            midi_in._input = MockInput()
+            midi_in.set_outputs([recorder])
+            midi_ins.append(midi_in)
+
+        async def run():
+            task = asyncio.ensure_future(self.midi_service.run())
+            await asyncio.sleep(0.01)
+            threads = [send_from_thread(midi_ins[0], range(0, 50)),
+                       send_from_thread(midi_ins[1], range(50, 100))]
+            while len(recorder.received) < 100:
+                await asyncio.sleep(0.001)
+            task.cancel()
+            for thread in threads:
+                thread.join()
+
+        asyncio.run(asyncio.wait_for(run(), 5))
+        notes = [message.note for message in recorder.received]
+        self.assertEqual([note for note in notes if note < 50], list(range(0, 50)))
+        self.assertEqual([note for note in notes if note >= 50], list(range(50, 100)))
+        self.assertEqual(midi_ins[0].input.callback, midi_ins[0].on_message)
+
+    def test_send(self):
+        midi_out = self.midi_service.open_output('device 2')
+        midi_out.output.send = unittest.mock.Mock(name='midi_out_send')
+        message = mido.Message('note_on', note=60, velocity=64)
+        asyncio.run(self.midi_service.send('device 2', message))
+        midi_out.output.send.assert_called_once_with(message)
+        with self.assertRaises(KeyError):
+            asyncio.run(self.midi_service.send('device 3', message))
+
+
+if __name__ == '__main__':
+    unittest.main()
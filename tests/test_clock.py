@@ -0,0 +1,219 @@
+# pylint: disable-all
+import unittest
+import unittest.mock
+from time import sleep
+import mido
+import mocks
+from morp import Clock, ClockDivider, ClockMultiplier, EffectsLoop, MidiBox, MidiOut, Sequencer
+from morp.midi_box import CLOCK_BLOCK, CLOCK_DIVIDE
+
+
+class Recorder(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.received.append(message)
+
+
+class TestClock(unittest.TestCase):
+    def test_drives_sequencers(self):
+        clock = Clock(bpm=120)
+        recorders, sequencers = [], []
+        for _ in range(3):
+            recorder, sequencer = Recorder(), Sequencer()
+            sequencer.set_outputs([recorder])
+            sequencer.pattern = {0: [mido.Message('note_on', note=60, velocity=100)],
+                                 12: [mido.Message('note_off', note=60)]}
+            sequencer.clock_source = clock
+            sequencer.play()
+            recorders.append(recorder)
+            sequencers.append(sequencer)
+
+        for _ in range(96):
+            clock.tick()
+        for recorder in recorders:
+            self.assertEqual([message.type for message in recorder.received],
+                             ['note_on', 'note_off'])
+
+        # Only the most recent clock source sends clocks to a sequencer
+        sequencer.clock_source = None
+        clock.tick()
+        self.assertEqual(len(clock._targets), 2)
+
+    def test_sequencer_instances_follow_clock(self):
+        clock = Clock()
+        sequencer = Sequencer()
+        sequencer.clock_source = clock
+        instance = sequencer.clone()
+        self.assertIn(instance, clock._targets)
+        del instance
+        self.assertEqual(len(clock._targets), 1)
+
+    def test_clock_master(self):
+        clock = Clock(bpm=6000)
+        midi_out = MidiOut('output')
+        midi_out.output.send = unittest.mock.Mock(name='midi_out_send')
+        clock.add_target(midi_out)
+        clock.start()
+        sleep(0.1)
+        clock.stop()
+        sent = [call.args[0].type for call in midi_out.output.send.call_args_list]
+        self.assertEqual(sent[0], 'start')
+        self.assertEqual(sent[-1], 'stop')
+        self.assertEqual(len(sent) - 2, clock.stats()['ticks'])
+
+    def test_absolute_deadlines(self):
+        # 2400 ticks per second
+        clock = Clock(bpm=6000)
+        recorder = Recorder()
+        clock.add_target(recorder)
+        clock.start()
+        sleep(0.25)
+        clock.bpm = 3000
+        sleep(0.25)
+        clock.stop()
+        stats = clock.stats()
+        # Ticks that run late don't push the following ones back
+        self.assertAlmostEqual(stats['ticks'], 600 + 300, delta=120)
+        self.assertGreaterEqual(stats['jitter_max_us'], stats['jitter_mean_us'])
+        self.assertEqual([message.type for message in recorder.received[:2]], ['start', 'clock'])
+        self.assertEqual(recorder.received[-1].type, 'stop')
+
+    def test_stop_from_clock_thread(self):
+        clock = Clock(bpm=6000)
+
+        class Stopper(MidiBox):
+            def on_clock(self, message):
+                clock.stop()
+
+        stopper = Stopper()
+        clock.add_target(stopper)
+        clock.start()
+        sleep(0.05)
+        self.assertFalse(clock.running)
+        self.assertEqual(clock.stats()['ticks'], 1)
+
+
+class TestClockHandling(unittest.TestCase):
+    def send(self, box, types):
+        for message_type in types:
+            box.on_message(mido.Message(message_type))
+
+    def test_divider(self):
+        recorder, divider = Recorder(), ClockDivider(division=3)
+        divider.set_outputs([recorder])
+        self.send(divider, ['start'] + ['clock'] * 4 + ['stop', 'continue'] + ['clock'] * 3)
+        self.assertEqual([message.type for message in recorder.received],
+                         ['start', 'clock', 'clock', 'stop', 'continue', 'clock'])
+
+        # A new start, or a song position, puts the next clock on the beat
+        recorder.received.clear()
+        self.send(divider, ['clock', 'start', 'clock'])
+        divider.on_message(mido.Message('songpos', pos=1))
+        self.send(divider, ['clock'])
+        self.assertEqual([message.type for message in recorder.received],
+                         ['start', 'clock', 'songpos', 'clock'])
+
+    def test_multiplier(self):
+        recorder, multiplier = Recorder(), ClockMultiplier(factor=3)
+        multiplier.set_outputs([recorder])
+        self.send(multiplier, ['start'])
+        for i in range(4):
+            if i:
+                sleep(0.01)
+            self.send(multiplier, ['clock'])
+        self.send(multiplier, ['stop'])
+        sleep(0.02)
+        types = [message.type for message in recorder.received]
+        # 4 clocks, and 2 more after each of the 2 clocks in the middle
+        self.assertEqual(types, ['start'] + ['clock'] * 8 + ['stop'])
+
+    def test_multiplier_routes_unlocked(self):
+        locked = []
+
+        class Checker(MidiBox):
+            def route_message(self, message, through=False):
+                locked.append(multiplier._lock.locked())
+
+        multiplier = ClockMultiplier(factor=2)
+        multiplier.set_outputs([Checker()])
+        self.send(multiplier, ['clock'])
+        sleep(0.005)
+        self.send(multiplier, ['clock', 'clock'])
+        sleep(0.02)
+        self.assertEqual(len(locked), 5)
+        self.assertFalse(any(locked))
+
+    def test_multiplier_instances_lock_separately(self):
+        multiplier = ClockMultiplier(factor=4)
+        instance = EffectsLoop([multiplier]).instance().boxes[0]
+        self.assertEqual(instance.factor, 4)
+        self.assertIsNot(instance._lock, multiplier._lock)
+
+    def test_sequencer_passes_transport(self):
+        recorder, sequencer, divider = Recorder(), Sequencer(), ClockDivider(division=4)
+        sequencer.set_outputs([divider])
+        divider.set_outputs([recorder])
+        self.send(sequencer, ['start'])
+        self.send(divider, ['clock', 'clock'])
+        self.assertEqual(divider._count, 2)
+        # A start that reaches the sequencer puts the divider back on the beat as well
+        self.send(sequencer, ['start'])
+        self.assertEqual(divider._count, 0)
+        self.assertEqual([message.type for message in recorder.received],
+                         ['start', 'clock', 'start'])
+
+    def test_output_policy(self):
+        midi_out = MidiOut('output', clock_policy=CLOCK_DIVIDE, clock_division=24)
+        midi_out._output = unittest.mock.Mock()
+        midi_out.on_messages([mido.Message('start')] + [mido.Message('clock')] * 48)
+        for _ in range(24):
+            midi_out.on_message(mido.Message('clock'))
+        self.assertEqual([call.args[0].type for call in midi_out._output.send.call_args_list],
+                         ['start', 'clock', 'clock', 'clock'])
+
+        # Single messages are counted the same way, without being wrapped in a batch
+        midi_out._output.reset_mock()
+        midi_out.on_message(mido.Message('songpos', pos=3))
+        self.send(midi_out, ['clock'] * 7 + ['start', 'clock'])
+        self.assertEqual([call.args[0].type for call in midi_out._output.send.call_args_list],
+                         ['songpos', 'clock', 'start', 'clock'])
+
+        midi_out._output.reset_mock()
+        midi_out.clock_policy = CLOCK_BLOCK
+        self.send(midi_out, ['clock', 'stop'])
+        self.assertEqual([call.args[0].type for call in midi_out._output.send.call_args_list],
+                         ['stop'])
+        with self.assertRaises(ValueError):
+            midi_out.clock_policy = 'sometimes'
+
+    def test_loop_passthrough(self):
+        calls = []
+
+        class Counted(MidiBox):
+            def modifier(self, message):
+                calls.append(message.type)
+                return message
+
+        for compiled in (False, True):
+            calls.clear()
+            box, recorder = MidiBox(), Recorder()
+            box.set_outputs([recorder])
+            box.assign_fx_loop(EffectsLoop([Counted(), Counted(), Counted()]), compiled=compiled)
+            self.send(box, ['clock', 'note_on'])
+            self.assertEqual(calls, ['note_on'] * 3)
+            self.assertEqual([message.type for message in recorder.received],
+                             ['clock', 'note_on'])
+
+            # A box that consumes the clock stops it from skipping the loop
+            box.assign_fx_loop(EffectsLoop([Counted(), ClockDivider(division=2)]),
+                               compiled=compiled)
+            recorder.received.clear()
+            self.send(box, ['clock', 'clock'])
+            self.assertEqual(len(recorder.received), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
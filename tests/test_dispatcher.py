@@ -0,0 +1,121 @@
+# pylint: disable-all
+import threading
+import unittest
+from unittest.mock import Mock, patch
+import mido
+from mocks import MockInput
+from morp import Clock, MidiBox, MidiService
+from morp.dispatcher import Dispatcher
+from morp.scheduler import default_scheduler
+
+
+class Recorder(MidiBox):
+    def __init__(self):
+        self.received = []
+        self.threads = set()
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.threads.add(threading.get_ident())
+        self.received.append(message)
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(mido, 'open_input', Mock(side_effect=lambda _: MockInput()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.midi_service = MidiService()
+        self.addCleanup(self.midi_service.stop_dispatcher)
+        self.recorder = Recorder()
+
+    def open(self, name):
+        midi_in = self.midi_service.open_input(name)
+        midi_in.set_outputs([self.recorder])
+        return midi_in
+
+    def test_concurrent_inputs(self):
+        first = self.open('device 1')
+        dispatcher = self.midi_service.start_dispatcher()
+        # Inputs opened while dispatching are dispatched as well
+        second = self.open('device 2')
+
+        def play(midi_in, channel):
+            for note in range(128):
+                midi_in.input.callback(mido.Message('note_on', channel=channel, note=note))
+                midi_in.input.callback(mido.Message('note_off', channel=channel, note=note))
+
+        threads = [threading.Thread(target=play, args=(midi_in, channel))
+                   for channel, midi_in in enumerate((first, second))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.midi_service.stop_dispatcher()
+
+        # Everything ran on the dispatcher thread, in order for each input
+        self.assertEqual(len(self.recorder.threads), 1)
+        self.assertNotIn(threading.get_ident(), self.recorder.threads)
+        for channel in (0, 1):
+            notes = [(message.type, message.note) for message in self.recorder.received
+                     if message.channel == channel]
+            self.assertEqual(notes, [(message_type, note) for note in range(128)
+                                     for message_type in ('note_on', 'note_off')])
+        stats = dispatcher.stats()
+        self.assertEqual(stats['messages'], 512)
+        self.assertLessEqual(stats['batches'], 512)
+        self.assertGreaterEqual(stats['wait_max_us'], stats['wait_mean_us'])
+
+        # Inputs go back to running the graph themselves
+        self.assertIsNone(self.midi_service.dispatcher)
+        first.input.callback(mido.Message('note_on', note=1))
+        self.assertIn(threading.get_ident(), self.recorder.threads)
+
+    def test_panic_in_order(self):
+        midi_in = self.open('device 1')
+        self.midi_service.start_dispatcher()
+        midi_in.input.callback(mido.Message('note_on', note=60))
+        self.midi_service.panic()
+        self.midi_service.stop_dispatcher()
+        self.assertFalse(midi_in._notes_on)
+        self.assertEqual([message.type for message in self.recorder.received], ['note_on'])
+
+    def test_clock_ticks(self):
+        clock = Clock()
+        clock.add_target(self.recorder)
+        self.midi_service.start_dispatcher()
+        ticker = threading.Thread(target=lambda: [clock.tick() for _ in range(24)])
+        ticker.start()
+        ticker.join()
+        self.midi_service.stop_dispatcher()
+        self.assertEqual(len(self.recorder.received), 24)
+        self.assertEqual(len(self.recorder.threads), 1)
+        self.assertNotIn(ticker.ident, self.recorder.threads)
+        self.assertNotIn(threading.get_ident(), self.recorder.threads)
+
+    def test_one_dispatcher(self):
+        dispatcher = self.midi_service.start_dispatcher()
+        other = MidiService()
+        with self.assertRaises(RuntimeError):
+            other.start_dispatcher()
+        other.stop_dispatcher()
+        self.assertEqual(default_scheduler().run_on, dispatcher.call)
+        self.midi_service.stop_dispatcher()
+        self.assertIsNone(default_scheduler().run_on)
+        other.start_dispatcher()
+        other.stop_dispatcher()
+
+    def test_wakes_up(self):
+        dispatcher = Dispatcher()
+        dispatcher.start()
+        called = threading.Event()
+        for _ in range(50):
+            called.clear()
+            dispatcher.call(called.set)
+            self.assertTrue(called.wait(1))
+        dispatcher.stop()
+        self.assertFalse(dispatcher.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# pylint: disable-all
+import time
+import unittest
+from morp import Event, MidiIn, EffectsLoop
+from morp.effects import Autotune, Harmonizer, Shadow
+from mocks import MockMidiMessage
+
+
+class TestEffects(unittest.TestCase):
+    def test_autotune_table(self):
+        autotune = Autotune(scale={0, 3, 7, 10})
+        self.assertEqual(autotune._corrections[60], 60)
+        self.assertEqual(autotune._corrections[61], 60)
+        self.assertEqual(autotune._corrections[62], 63)
+        self.assertEqual(autotune._corrections[69], 70)
+
+        # Corrections never leave the MIDI note range
+        autotune.scale = {8}
+        self.assertEqual(autotune._corrections[126], 116)
+
+        autotune.autocorrect = False
+        self.assertIsNone(autotune._corrections[61])
+        self.assertEqual(autotune._corrections[68], 68)
+
+    def test_harmonizer_table(self):
+        harmonizer = Harmonizer(voices=[0, 12, 24, 12, -7])
+        self.assertEqual(harmonizer._chords[60], (72, 84, 53))
+        self.assertEqual(harmonizer._chords[110], (122, 103))
+        self.assertEqual(harmonizer._chords[3], (15, 27))
+
+        harmonizer.voices = {7}
+        messages = harmonizer.modifier(MockMidiMessage('note_on', 60, 60))
+        self.assertEqual([message.note for message in messages], [60, 67])
+
+    def test_tables_are_shared(self):
+        autotune = Autotune(scale={0, 4, 7})
+        harmonizer = Harmonizer(voices=[4, 7])
+        loop = EffectsLoop([autotune, harmonizer])
+        midi_in_1 = MidiIn('device 1')
+        midi_in_2 = MidiIn('device 2')
+        midi_in_1.assign_fx_loop(loop)
+        midi_in_2.assign_fx_loop(loop)
+        for midi_in in (midi_in_1, midi_in_2):
+            copied_autotune, copied_harmonizer = midi_in._fx_loop.boxes
+            self.assertIsNot(copied_autotune, autotune)
+            self.assertIs(copied_autotune._corrections, autotune._corrections)
+            self.assertIs(copied_harmonizer._chords, harmonizer._chords)
+
+    def test_shadow_echoes(self):
+        shadow = Shadow(period=2, decay=0.5, repeat=2)
+        sent = [Event('note_on', note=note, velocity=100) for note in range(60, 66)]
+        outputs = [shadow.modifier(message) for message in sent]
+        self.assertEqual([len(output) for output in outputs], [1, 1, 2, 2, 3, 3])
+        self.assertEqual([(echo.note, echo.velocity) for echo in outputs[4]],
+                         [(64, 100), (62, 50), (60, 25)])
+        # Messages that were already sent are never modified
+        self.assertTrue(all(message.velocity == 100 for message in sent))
+
+        # Resizing keeps the most recent history
+        shadow.period = 1
+        self.assertEqual([(echo.note, echo.velocity) for echo in
+                          shadow.modifier(Event('note_on', note=70, velocity=100))],
+                         [(70, 100), (65, 50), (64, 25)])
+
+    def test_shadow_stress(self):
+        def per_message(shadow, count):
+            messages = [Event('note_on' if i % 2 else 'note_off', note=i % 128, velocity=100)
+                        for i in range(count)]
+            for message in messages[:shadow._length]:
+                shadow.modifier(message)
+            start = time.perf_counter()
+            for message in messages:
+                echoes = shadow.modifier(message)
+            elapsed = (time.perf_counter() - start) / count
+            self.assertEqual(len(echoes), shadow.repeat + 1)
+            return elapsed
+
+        # The same number of echoes from a 2048 message history costs no more per message
+        # than from a 32 message history
+        short = min(per_message(Shadow(period=1, repeat=32), 5000) for _ in range(3))
+        long = min(per_message(Shadow(period=64, repeat=32), 5000) for _ in range(3))
+        self.assertLess(long, short * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# pylint: disable-all
+import unittest
+import mido
+from morp import Event, MidiBox, MidiIn, MidiOut, EffectsLoop
+from morp.effects import Autotune, Harmonizer, Shadow, Freeze
+from morp.events import to_event, to_message
+import mocks
+
+
+class Recorder(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.received.append(message)
+
+
+class TestEvents(unittest.TestCase):
+    def test_round_trip(self):
+        messages = [
+            mido.Message('note_on', channel=3, note=60, velocity=100),
+            mido.Message('note_off', channel=15, note=127, velocity=0),
+            mido.Message('polytouch', note=64, value=12),
+            mido.Message('control_change', channel=1, control=74, value=99),
+            mido.Message('program_change', program=42),
+            mido.Message('aftertouch', value=77),
+            mido.Message('pitchwheel', pitch=-8192),
+            mido.Message('pitchwheel', pitch=1234),
+            mido.Message('clock'),
+            mido.Message('start'),
+        ]
+        for message in messages:
+            event = Event.from_message(message)
+            self.assertIsInstance(event, Event)
+            self.assertEqual(event.bytes(), message.bytes())
+            self.assertEqual(event.to_message(), message)
+            self.assertEqual(vars(event.to_message()), vars(message))
+
+        # Only notes are converted at the inputs
+        for message in messages:
+            if message.type in ('note_on', 'note_off'):
+                self.assertEqual(to_event(message), Event.from_message(message))
+            else:
+                self.assertIs(to_event(message), message)
+
+        sysex = mido.Message('sysex', data=[1, 2, 3])
+        self.assertIs(to_event(sysex), sysex)
+        self.assertIs(to_message(sysex), sysex)
+
+    def test_aliases(self):
+        event = Event.from_message(mido.Message('control_change', control=7, value=100))
+        self.assertEqual((event.control, event.value), (7, 100))
+        event = Event.from_message(mido.Message('pitchwheel', pitch=-100))
+        self.assertEqual(event.pitch, -100)
+        self.assertEqual(event.copy(pitch=100).to_message().pitch, 100)
+
+    def test_effects_keep_events(self):
+        midi_in = MidiIn('device 1', compact=True)
+        recorder = Recorder()
+        midi_in.set_outputs([recorder])
+        midi_in.assign_fx_loop(EffectsLoop(
+            [Autotune(scale={0, 4, 7}), Harmonizer(voices=[12]), Shadow(period=1), Freeze()]))
+
+        # The backend callback converts the incoming mido message at the edge
+        midi_in.input.callback(mido.Message('note_on', note=61, velocity=90))
+        midi_in.input.callback(mido.Message('note_off', note=61))
+        midi_in.input.callback(mido.Message('note_on', note=67, velocity=90))
+        self.assertTrue(recorder.received)
+        self.assertTrue(all(type(message) is Event for message in recorder.received))
+
+    def test_midi_out_converts(self):
+        midi_out = MidiOut('device 2')
+        midi_out.output.send = unittest.mock.Mock(name='midi_out_send')
+        midi_out.on_message(Event('note_on', note=60, velocity=100))
+        midi_out.output.send.assert_called_once_with(
+            mido.Message('note_on', note=60, velocity=100))
+
+
+if __name__ == '__main__':
+    unittest.main()
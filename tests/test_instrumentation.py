@@ -0,0 +1,54 @@
+# pylint: disable-all
+import unittest
+import mido
+from morp import MidiService, EffectsLoop
+from morp.effects import Harmonizer
+from morp.midi_box import MidiIn, MidiOut
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.midi_service = MidiService()
+        self.midi_in = self.midi_service.open_input('device 1')
+        self.midi_out = self.midi_service.open_output('device 2')
+        self.midi_out._output = unittest.mock.Mock(name='output')
+        self.midi_in.set_outputs([self.midi_out])
+
+    def send(self, *notes):
+        for note in notes:
+            self.midi_in.input.callback(mido.Message('note_on', note=note, velocity=64))
+            self.midi_in.input.callback(mido.Message('note_off', note=note))
+
+    def test_disabled(self):
+        self.assertIsNone(self.midi_service.snapshot())
+        self.send(60)
+        self.assertIs(type(self.midi_in), MidiIn)
+        self.assertIs(type(self.midi_out), MidiOut)
+
+    def test_snapshot(self):
+        for compiled in (False, True):
+            self.midi_in.assign_fx_loop(EffectsLoop([Harmonizer(voices=[7, 12])]),
+                                        compiled=compiled)
+            self.midi_service.enable_instrumentation()
+            self.send(60, 62)
+            snapshot = self.midi_service.snapshot()
+            boxes = snapshot['boxes']
+            self.assertEqual(boxes['device 1']['messages'], 4)
+            self.assertEqual(boxes['device 1.fx']['messages'], 4)
+            self.assertEqual(boxes['device 1.fx[0] Harmonizer']['messages'], 4)
+            self.assertEqual(boxes['device 2']['messages'], 12)
+            self.assertEqual(snapshot['latency']['count'], 12)
+            self.assertGreater(snapshot['latency']['p99_us'], 0)
+            self.assertEqual(self.midi_out.output.send.call_count, 12)
+
+            # Disabling restores the original classes and callbacks
+            self.midi_service.disable_instrumentation()
+            self.assertIsNone(self.midi_service.snapshot())
+            self.assertIs(type(self.midi_in), MidiIn)
+            self.assertIs(type(self.midi_in._fx_loop), EffectsLoop)
+            self.assertEqual(self.midi_in.input.callback, self.midi_in.on_message)
+            self.midi_out.output.send.reset_mock()
+
+
+if __name__ == '__main__':
+    unittest.main()
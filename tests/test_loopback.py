@@ -0,0 +1,32 @@
+# pylint: disable-all
+import unittest
+import mido
+
+
+class TestLoopback(unittest.TestCase):
+    def setUp(self):
+        self.backend = mido.Backend('morp.loopback', load=True)
+
+    def test_devices(self):
+        self.assertEqual(self.backend.get_input_names(), ['loopback 1', 'loopback 2'])
+        self.assertEqual(self.backend.get_output_names(), ['loopback 1', 'loopback 2'])
+
+    def test_loopback(self):
+        received = []
+        with self.backend.open_input('loop', callback=received.append) as with_callback, \
+                self.backend.open_input('loop') as polled, \
+                self.backend.open_output('loop') as output:
+            message = mido.Message('note_on', note=60)
+            output.send(message)
+            self.assertEqual(received, [message])
+            self.assertEqual(polled.poll(), message)
+            self.assertIsNone(polled.poll())
+
+        # Closed inputs no longer receive anything
+        with self.backend.open_output('loop') as output:
+            output.send(mido.Message('clock'))
+        self.assertEqual(len(received), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,19 @@
 # pylint: disable-all
+import pickle
 import unittest
-from morp import MidiIn, MidiOut, EffectsLoop
-from morp.effects import Harmonizer, Shadow, Freeze
+import weakref
+from copy import deepcopy
+from morp import MidiBox, MidiIn, MidiOut, EffectsLoop, Sequencer
+from morp.effects import Autotune, Harmonizer, Shadow, Freeze
 from mocks import MockMidiMessage
 
 
+class Custom(Harmonizer):
+    def __init__(self):
+        self.extra = 'state'
+        super().__init__(voices={7})
+
+
 class TestMidiBox(unittest.TestCase):
     def setUp(self):
         self.midi_in = MidiIn('device 1')
@@ -102,6 +111,219 @@ class TestMidiBox(unittest.TestCase):
         self.assertEqual(self.midi_out.output.send.call_count, 3)
         self.assertEqual(len(self.midi_out._notes_on), 1)
 
+    def test_compiled_loop(self):
+        self.connect_output()
+        message = MockMidiMessage('note_on', 60, 60)
+
+        # Send the same messages through the recursive and compiled paths, and compare
+        self.midi_in.assign_fx_loop(EffectsLoop(
+            [Harmonizer(voices=[7, 12]), Shadow(period=1), Harmonizer(voices=[24])]))
+        for note in (60, 62, 64):
+            self.midi_in.on_message(message.copy(note=note))
+            self.midi_in.on_message(message.copy(message_type='note_off', note=note))
+        recursive_calls = self.midi_out.output.send.call_args_list
+
+        self.midi_out.output.send = unittest.mock.Mock(name='self.midi_out_send')
+        self.midi_out._notes_on.clear()
+        self.midi_in.assign_fx_loop(EffectsLoop(
+            [Harmonizer(voices=[7, 12]), Shadow(period=1), Harmonizer(voices=[24])]),
+            compiled=True)
+        self.assertTrue(self.midi_in._fx_loop.compiled)
+        # Single messages are pushed through the boxes, without collecting a batch per stage
+        with unittest.mock.patch.object(EffectsLoop, '_run', side_effect=AssertionError):
+            for note in (60, 62, 64):
+                self.midi_in.on_message(message.copy(note=note))
+                self.midi_in.on_message(message.copy(message_type='note_off', note=note))
+        compiled_calls = self.midi_out.output.send.call_args_list
+
+        def summarize(calls):
+            return [(call.args[0].type, call.args[0].note) for call in calls]
+        self.assertEqual(len(compiled_calls), 66)
+        self.assertEqual(summarize(recursive_calls), summarize(compiled_calls))
+
+    def test_compiled_loop_rebuilds_on_topology_change(self):
+        harmonizer = Harmonizer(voices=[12])
+        self.midi_in.assign_fx_loop(EffectsLoop([harmonizer]), compiled=True)
+        self.midi_in.on_message(MockMidiMessage('note_on', 60, 60))
+        self.midi_out.output.send.assert_not_called()
+
+        # Connecting an output must reach the already-compiled loop instance
+        self.connect_output()
+        self.midi_in.on_message(MockMidiMessage('note_on', 62, 60))
+        self.assertEqual(self.midi_out.output.send.call_count, 2)
+
+    def test_on_messages(self):
+        self.connect_output()
+        messages = []
+        for note in (60, 61, 63, 60, 66):
+            messages.append(MockMidiMessage('note_on', note, 60))
+            messages.append(MockMidiMessage('note_off', note, 60))
+
+        def sent_with(fx, batch, compiled=False):
+            self.midi_out.output.send = unittest.mock.Mock(name='self.midi_out_send')
+            self.midi_out._notes_on.clear()
+            self.midi_in.assign_fx_loop(EffectsLoop(fx()), compiled=compiled)
+            if batch:
+                self.midi_in.on_messages(messages)
+            else:
+                for message in messages:
+                    self.midi_in.on_message(message)
+            return [(call.args[0].type, call.args[0].note)
+                    for call in self.midi_out.output.send.call_args_list]
+
+        for fx in (lambda: [Autotune(scale={0, 3, 7})],
+                   lambda: [Harmonizer(voices=[7, 12])],
+                   lambda: [Shadow(period=2)],
+                   lambda: [Freeze()],
+                   lambda: [MidiBox(), Shadow(period=2), MidiBox()],
+                   lambda: [Autotune(scale={0, 3, 7}), Harmonizer(voices=[-12]), Freeze()]):
+            expected = sent_with(fx, batch=False)
+            self.assertTrue(expected)
+            self.assertEqual(sent_with(fx, batch=True), expected)
+            self.assertEqual(sent_with(fx, batch=True, compiled=True), expected)
+            self.assertEqual(sent_with(fx, batch=False, compiled=True), expected)
+
+    def test_midi_out_flush(self):
+        port = unittest.mock.MagicMock(closed=False)
+        self.midi_out._output = port
+        self.midi_out.on_messages([MockMidiMessage('note_on', 60, 60),
+                                   MockMidiMessage('note_on', 60, 60),
+                                   MockMidiMessage('note_off', 60, 60)])
+        # The duplicate note_on is dropped, and the rest go through the port's public `send`
+        self.assertEqual([call.args[0].type for call in port.send.call_args_list],
+                         ['note_on', 'note_off'])
+        port._send.assert_not_called()
+
+    def test_loop_instances(self):
+        shadow = Shadow(period=2, repeat=4)
+        harmonizer = Harmonizer(voices=[12])
+        loop = EffectsLoop([harmonizer, shadow])
+        self.connect_output()
+        self.midi_in.assign_fx_loop(loop)
+        other_in = MidiIn('device 2')
+        other_in.assign_fx_loop(loop)
+
+        instance = self.midi_in._fx_loop
+        copied_harmonizer, copied_shadow = instance.boxes
+        self.assertIsNot(instance, other_in._fx_loop)
+        self.assertIs(copied_harmonizer.outputs[0], copied_shadow)
+        self.assertEqual(copied_shadow.outputs, [self.midi_out])
+        self.assertIs(copied_shadow._velocities, shadow._velocities)
+        self.assertIsNot(copied_shadow._message_cache, shadow._message_cache)
+        self.assertIsNot(copied_harmonizer._notes_on, harmonizer._notes_on)
+
+        # Per-instance state survives reconnecting the outputs
+        self.midi_in.on_message(MockMidiMessage('note_on', 60, 60))
+        self.midi_in.set_outputs([self.midi_out])
+        self.assertIs(self.midi_in._fx_loop, instance)
+        self.assertEqual(copied_shadow._cached, 2)
+        self.assertEqual(other_in._fx_loop.boxes[1]._cached, 0)
+
+    def test_custom_box_instances(self):
+        class Counter(MidiBox):
+            def __init__(self):
+                self.seen = []
+                super().__init__()
+
+            def on_note_on(self, message):
+                self.seen.append(message.note)
+                super().on_note_on(message)
+
+        # A subclass that creates state in `__init__` still gets its own copy of it
+        counter = Counter()
+        loop = EffectsLoop([counter])
+        self.midi_in.assign_fx_loop(loop)
+        self.midi_in.on_message(MockMidiMessage('note_on', 60, 60))
+        self.assertEqual(self.midi_in._fx_loop.boxes[0].seen, [60])
+        self.assertEqual(counter.seen, [])
+
+    def test_mutable_config_is_copied(self):
+        class Histogram(MidiBox):
+            def __init__(self):
+                self.counts = {}
+                super().__init__()
+
+            def _init_state(self):
+                super()._init_state()
+                self.last = None
+
+            def on_note_on(self, message):
+                self.counts[message.note] = self.counts.get(message.note, 0) + 1
+                self.last = message.note
+                super().on_note_on(message)
+
+        class Tally(Harmonizer):
+            # Harmonizer shares its configuration between clones, but that isn't inherited
+            def __init__(self):
+                self.seen = []
+                super().__init__(voices=[12])
+
+            def modifier(self, message):
+                self.seen.append(message.note)
+                return super().modifier(message)
+
+        histogram, tally = Histogram(), Tally()
+        loop = EffectsLoop([histogram, tally])
+        self.midi_in.assign_fx_loop(loop)
+        other_in = MidiIn('device 2')
+        other_in.assign_fx_loop(loop)
+        self.midi_in.on_message(MockMidiMessage('note_on', 60, 60))
+
+        copied_histogram, copied_tally = self.midi_in._fx_loop.boxes
+        self.assertEqual(copied_histogram.counts, {60: 1})
+        self.assertEqual(copied_histogram.last, 60)
+        self.assertEqual(copied_tally.seen, [60])
+        for box in (histogram, *other_in._fx_loop.boxes):
+            self.assertFalse(getattr(box, 'counts', None))
+            self.assertFalse(getattr(box, 'seen', None))
+
+    def test_handled_types(self):
+        class Clocked(MidiBox):
+            def on_clock(self, message):
+                pass
+
+        class Controlled(MidiBox):
+            handles = frozenset({'note_on', 'note_off', 'control_change'})
+
+            def modifier(self, message):
+                if message.type == 'control_change':
+                    return [message.copy(message_type='control_change', velocity=1)]
+                return message
+
+        self.assertEqual(MidiBox.handles, {'note_on', 'note_off'})
+        self.assertEqual(Clocked.handles, {'note_on', 'note_off', 'clock'})
+        self.assertEqual(Shadow.handles, MidiBox.handles)
+
+        # Control changes are no longer dropped, and skip the boxes that don't handle them
+        self.connect_output()
+        loop = EffectsLoop([Autotune(scale={0}), Harmonizer(voices={12}), Clocked()])
+        for compiled in (False, True):
+            self.midi_out.output.send.reset_mock()
+            self.midi_in.assign_fx_loop(loop, compiled=compiled)
+            control = MockMidiMessage('control_change', 7, 100)
+            self.midi_in.on_message(control)
+            self.midi_in.on_message(MockMidiMessage('clock', 0, 0))
+            self.midi_out.output.send.assert_called_once_with(control)
+
+        self.midi_in.assign_fx_loop(EffectsLoop([Controlled()]), compiled=True)
+        self.midi_out.output.send.reset_mock()
+        self.midi_in.on_messages([MockMidiMessage('control_change', 7, 100)])
+        self.assertEqual(self.midi_out.output.send.call_args.args[0].velocity, 1)
+
+    def test_slots(self):
+        for box in (MidiBox(), Autotune(scale={0}), Harmonizer(voices={12}), Shadow(),
+                    Freeze(), Sequencer(), self.midi_in, self.midi_out):
+            self.assertFalse(hasattr(box, '__dict__'), type(box).__name__)
+        self.assertIsNotNone(weakref.ref(Sequencer()))
+
+        # Subclasses without `__slots__` can still keep whatever they like
+        loop = EffectsLoop([Custom(), Shadow(period=2)])
+        for copied in (loop.instance(), pickle.loads(pickle.dumps(loop)), deepcopy(loop)):
+            custom, shadow = copied.boxes
+            self.assertEqual((custom.extra, custom._voices), ('state', {7}))
+            self.assertIs(custom.outputs[0], shadow)
+            self.assertEqual(shadow._length, 2 * 2)
+
 
 if __name__ == '__main__':
     unittest.main()
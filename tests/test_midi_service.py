@@ -0,0 +1,105 @@
+# pylint: disable-all
+import threading
+import unittest
+from unittest.mock import Mock, patch
+import mido
+from mocks import MockInput, MockOutput
+from morp import EffectsLoop, MidiBox, MidiService
+from morp.midi_service import CONNECTED, DISCONNECTED, REOPENED, DeviceEvent
+
+
+class TestHotPlug(unittest.TestCase):
+    def setUp(self):
+        self.midi_service = MidiService()
+        self.events = []
+        self.midi_service.subscribe(self.events.append)
+        self.names = ['device 1', 'device 2']
+        patcher = patch.multiple(mido, get_input_names=Mock(side_effect=lambda: self.names),
+                                 get_output_names=Mock(side_effect=lambda: self.names))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_device_cache(self):
+        self.assertEqual(self.midi_service.get_inputs(), {'device 1', 'device 2'})
+        self.midi_service.watch(interval=60)
+        self.addCleanup(self.midi_service.unwatch)
+        calls = mido.get_input_names.call_count
+        self.midi_service.get_inputs()
+        self.midi_service.get_outputs()
+        self.assertEqual(mido.get_input_names.call_count, calls)
+
+    def test_reopen(self):
+        midi_in = self.midi_service.open_input('device 1')
+        midi_out = self.midi_service.open_output('device 2')
+        midi_in.set_outputs([midi_out])
+        midi_in.assign_fx_loop(EffectsLoop([MidiBox()]))
+        fx_loop = midi_in._fx_loop
+        self.midi_service._poll_once(0)
+
+        self.names = ['device 2']
+        self.assertEqual(self.midi_service._poll_once(1),
+                         [DeviceEvent(DISCONNECTED, 'input', 'device 1'),
+                          DeviceEvent(DISCONNECTED, 'output', 'device 1')])
+
+        self.names = ['device 1', 'device 2']
+        new_input = MockInput()
+        failing = patch.object(mido, 'open_input', side_effect=OSError('not ready'))
+        with failing:
+            self.assertEqual(self.midi_service._poll_once(2),
+                             [DeviceEvent(CONNECTED, 'input', 'device 1'),
+                              DeviceEvent(CONNECTED, 'output', 'device 1')])
+            # Retried after the backoff delay
+            self.assertEqual(self.midi_service._poll_once(2.4), [])
+            self.assertEqual(self.midi_service._poll_once(2.5), [])
+        self.assertEqual(self.midi_service._dropped[midi_in], (2, 3.5))
+
+        with patch.object(mido, 'open_input', return_value=new_input):
+            self.assertEqual(self.midi_service._poll_once(3.5),
+                             [DeviceEvent(REOPENED, 'input', 'device 1')])
+        self.assertIs(midi_in.input, new_input)
+        self.assertEqual(new_input.callback, midi_in.on_message)
+        self.assertEqual(midi_in.outputs, [midi_out])
+        self.assertIs(midi_in._fx_loop, fx_loop)
+        self.assertEqual(self.midi_service._dropped, {})
+
+    def test_error_inputs(self):
+        with patch.object(mido, 'open_input', side_effect=OSError('missing')):
+            self.assertIsNone(self.midi_service.open_input('device 3'))
+        self.midi_service._poll_once(0)
+        self.names = ['device 1', 'device 2', 'device 3']
+        self.assertEqual(self.midi_service._poll_once(1),
+                         [DeviceEvent(CONNECTED, 'input', 'device 3'),
+                          DeviceEvent(CONNECTED, 'output', 'device 3'),
+                          DeviceEvent(REOPENED, 'input', 'device 3')])
+        self.assertEqual(self.midi_service.error_inputs, set())
+        self.assertEqual([midi_in.name for midi_in in self.midi_service.open_inputs],
+                         ['device 3'])
+
+    def test_poll_takes_lock(self):
+        midi_in = self.midi_service.open_input('device 1')
+        self.midi_service._poll_once(0)
+        self.names = ['device 2']
+        with self.midi_service._lock:
+            poller = threading.Thread(target=self.midi_service._poll_once, args=(1,))
+            poller.start()
+            poller.join(0.05)
+            self.assertTrue(poller.is_alive())
+            self.assertEqual(self.midi_service._dropped, {})
+        poller.join(5)
+        self.assertEqual(self.midi_service._dropped, {midi_in: (0, 1)})
+        self.assertEqual(self.midi_service.get_inputs(), {'device 2'})
+
+    def test_watcher(self):
+        published = threading.Event()
+        self.midi_service.subscribe(lambda _: published.set())
+        self.midi_service.watch(interval=60)
+        self.names = ['device 1']
+        self.midi_service.devices_changed()
+        self.assertTrue(published.wait(5))
+        self.midi_service.unwatch()
+        self.assertEqual(self.events, [DeviceEvent(DISCONNECTED, 'input', 'device 2'),
+                                       DeviceEvent(DISCONNECTED, 'output', 'device 2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# pylint: disable-all
+import unittest
+import unittest.mock
+import mido
+import mocks
+from mocks import MockMidiMessage
+from morp import EffectsLoop, MidiBox, MidiIn, MidiOut, MidiService
+from morp.effects import Freeze, Harmonizer
+from morp.notes import NoteState
+
+
+class TestNoteState(unittest.TestCase):
+    def test_note_state(self):
+        notes = NoteState()
+        self.assertFalse(notes)
+        self.assertTrue(notes.add(0, 60))
+        self.assertFalse(notes.add(0, 60))
+        self.assertTrue(notes.add(15, 60))
+        self.assertTrue(notes.add(9, 127))
+        self.assertEqual(len(notes), 3)
+        self.assertEqual(list(notes), [(0, 60), (9, 127), (15, 60)])
+        notes.discard(0, 60)
+        self.assertFalse(notes.is_held(0, 60))
+        self.assertTrue(notes.is_held(15, 60))
+        held = notes.held
+        self.assertEqual(notes.release(), [(9, 127), (15, 60)])
+        self.assertIs(notes.held, held)
+        self.assertEqual(len(notes), 0)
+
+
+class TestPanic(unittest.TestCase):
+    def setUp(self):
+        self.midi_in = MidiIn('device 1')
+        self.midi_out = MidiOut('device 2')
+        self.midi_out._output = unittest.mock.MagicMock(closed=False)
+        self.midi_in.set_outputs([self.midi_out])
+
+    def sent(self):
+        return [(call.args[0].type, call.args[0].channel, call.args[0].note)
+                for call in self.midi_out.output.send.call_args_list]
+
+    def test_channels(self):
+        for compiled in (False, True):
+            self.midi_in.assign_fx_loop(EffectsLoop([MidiBox()]), compiled=compiled)
+            self.midi_out.output.send.reset_mock()
+            # The same note on two channels is two different notes
+            self.midi_in.on_messages([MockMidiMessage('note_on', 60, 100, channel=0),
+                                      MockMidiMessage('note_on', 60, 100, channel=1),
+                                      MockMidiMessage('note_on', 60, 100, channel=1)])
+            self.assertEqual(self.sent(), [('note_on', 0, 60), ('note_on', 1, 60)])
+            self.midi_in.on_messages([MockMidiMessage('note_off', 60, 0, channel=0),
+                                      MockMidiMessage('note_off', 60, 0, channel=1)])
+            self.assertEqual(len(self.midi_out._notes_on), 0)
+
+    def test_box_panic(self):
+        box = MidiBox(outputs=[self.midi_out])
+        box.on_message(mido.Message('note_on', channel=3, note=40, velocity=100))
+        box.on_message(mido.Message('note_on', channel=3, note=41, velocity=100))
+        box.on_message(mido.Message('note_off', channel=3, note=41))
+        self.midi_out.output.send.reset_mock()
+        box.panic()
+        self.assertEqual(self.sent(), [('note_off', 3, 40)])
+        self.assertEqual(len(box._notes_on), 0)
+        self.assertEqual(len(self.midi_out._notes_on), 0)
+
+    def test_loop_panic(self):
+        self.midi_in.assign_fx_loop(EffectsLoop([Harmonizer(voices={12}), Freeze()]))
+        self.midi_in.on_message(mido.Message('note_on', note=60, velocity=100))
+        self.midi_in.on_message(mido.Message('note_off', note=60))
+        self.midi_in.on_message(mido.Message('note_on', note=62, velocity=100))
+        self.midi_out.output.send.reset_mock()
+
+        # Frozen notes are released along with the held ones
+        self.midi_in.panic()
+        self.assertEqual(sorted(self.sent()), [('note_off', 0, 62), ('note_off', 0, 74)])
+        harmonizer, freeze = self.midi_in._fx_loop.boxes
+        self.assertEqual(len(harmonizer._notes_on), 0)
+        self.assertEqual(freeze._frozen_notes, {})
+
+    def test_service_panic(self):
+        midi_service = MidiService()
+        midi_service.open_inputs.add(self.midi_in)
+        midi_service.open_outputs.add(self.midi_out)
+        self.midi_in.assign_fx_loop(EffectsLoop([Harmonizer(voices={7, 12}), Freeze()]))
+        for note in (48, 50):
+            self.midi_in.on_message(mido.Message('note_on', note=note, velocity=100))
+        self.midi_out.output.send.reset_mock()
+
+        with unittest.mock.patch.object(MidiOut, '_write', autospec=True,
+                                        side_effect=MidiOut._write) as write:
+            midi_service.panic()
+        # One batch, with only the notes that the port is holding
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(sorted(note for _, _, note in self.sent()),
+                         [48, 50, 55, 57, 60, 62])
+        self.assertEqual(len(self.midi_in._notes_on), 0)
+        self.assertEqual(len(self.midi_in._fx_loop.boxes[1]._notes_on), 0)
+        self.midi_out.output.send.reset_mock()
+        midi_service.panic()
+        self.assertEqual(self.sent(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# pylint: disable-all
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+import mido
+import mocks
+from morp import MidiService, PatchError, load_patch
+from morp import patch as patch_module
+from morp.effects import Harmonizer
+
+PATCH = {
+    'inputs': ['keys'],
+    'outputs': [{'name': 'synth', 'queue_size': 0, 'clock_policy': 'block'}],
+    'effects': {'fifths': {'compiled': True,
+                           'chain': [{'type': 'Harmonizer', 'voices': [7]}]}},
+    'connections': [['keys', 'fifths'], ['fifths', 'synth']],
+}
+
+TOML_PATCH = '''
+inputs = ["keys"]
+outputs = [{ name = "synth" }]
+connections = [["keys", "fifths"], ["fifths", "synth"]]
+
+[effects.fifths]
+chain = [{ type = "morp.effects.Harmonizer", voices = [7] }]
+'''
+
+
+class TestPatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, contents):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(contents if isinstance(contents, str) else json.dumps(contents))
+        return path
+
+    def play(self, patch_bay):
+        synth = patch_bay._outputs['synth']
+        synth._output = Mock()
+        patch_bay.route('keys', [mido.Message('note_on', note=60, velocity=100),
+                                 mido.Message('clock')])
+        return [message.note if message.type == 'note_on' else message.type
+                for message in (call.args[0] for call in synth._output.send.call_args_list)]
+
+    def test_load(self):
+        # The JSON patch blocks the clock on its output
+        for path, sent in ((self.write('rig.json', PATCH), [60, 67]),
+                           (self.write('rig.toml', TOML_PATCH), [60, 67, 'clock'])):
+            patch_bay = load_patch(path, MidiService())
+            self.assertEqual(self.play(patch_bay), sent)
+            harmonizer = patch_bay._instances['fifths'].boxes[0]
+            self.assertIsInstance(harmonizer, Harmonizer)
+            self.assertEqual(harmonizer._voices, {7})
+
+    def test_cache(self):
+        path = self.write('rig.json', PATCH)
+        load_patch(path, MidiService())
+        self.assertEqual(len(os.listdir(os.path.join(self.directory.name, '.morp_cache'))), 1)
+        with patch.object(patch_module, '_build', side_effect=AssertionError), \
+                patch.object(patch_module, 'validate', side_effect=AssertionError):
+            patch_bay = load_patch(path, MidiService())
+        self.assertEqual(self.play(patch_bay), [60, 67])
+
+        # Any change to the file is a new graph
+        changed = dict(PATCH, effects={'fifths': {'chain': [{'type': 'MidiBox'}]}})
+        self.write('rig.json', changed)
+        self.assertEqual(self.play(load_patch(path, MidiService())), [60])
+
+    def test_cache_effect_module_changed(self):
+        sys.path.insert(0, self.directory.name)
+        self.addCleanup(sys.path.remove, self.directory.name)
+        self.addCleanup(sys.modules.pop, 'rig_effects', None)
+        source = 'from morp import MidiBox\n\nclass Echo(MidiBox):\n    pass\n'
+        module = self.write('rig_effects.py', source)
+        path = self.write('rig.json', dict(PATCH, effects={
+            'fifths': {'chain': [{'type': 'rig_effects.Echo'}]}}))
+        load_patch(path, MidiService())
+        with patch.object(patch_module, '_build', side_effect=AssertionError):
+            load_patch(path, MidiService())
+
+        # The patch file is the same, but the effect it refers to isn't
+        self.write('rig_effects.py', source + '\nVERSION = 2\n')
+        stat = os.stat(module)
+        os.utime(module, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        built = Mock(wraps=patch_module._build)
+        with patch.object(patch_module, '_build', built):
+            load_patch(path, MidiService())
+        self.assertEqual(built.call_count, 1)
+
+    def test_closes_ports_on_failure(self):
+        midi_service = MidiService()
+        with patch.object(mido, 'open_output', side_effect=OSError('no synth')):
+            with self.assertRaises(OSError):
+                load_patch(self.write('rig.json', PATCH), midi_service, cache=False)
+        self.assertEqual(midi_service.open_inputs, set())
+        self.assertEqual(midi_service.open_outputs, set())
+
+    def test_opens_ports_once(self):
+        midi_service = MidiService()
+        keys = midi_service.open_input('keys')
+        load_patch(self.write('rig.json', PATCH), midi_service, cache=False)
+        self.assertEqual(midi_service.open_inputs, {keys})
+        self.assertEqual({midi_out.name for midi_out in midi_service.open_outputs}, {'synth'})
+
+    def test_validation(self):
+        invalid = [
+            (dict(PATCH, inputs='keys'), 'inputs: must be a list'),
+            (dict(PATCH, extra=1), "patch: unknown key 'extra'"),
+            (dict(PATCH, outputs=[{'name': 'synth', 'overflow': 'spill'}]),
+             'outputs[0].overflow'),
+            (dict(PATCH, effects={'fifths': {'chain': [{'type': 'Reverb'}]}}),
+             "effects.fifths.chain[0]: unknown effect type 'Reverb'"),
+            (dict(PATCH, effects={'fifths': {'chain': [{'type': 'Harmonizer', 'wet': 1}]}}),
+             'effects.fifths.chain[0]:'),
+            (dict(PATCH, connections=[['keys', 'drums']]), "'drums' is not an effect or output"),
+            (dict(PATCH, effects={'a': {'chain': []}, 'b': {'chain': []}},
+                  connections=[['a', 'b'], ['b', 'a']]), 'cycle a -> b -> a'),
+        ]
+        for spec, message in invalid:
+            with self.assertRaises(PatchError) as raised:
+                load_patch(self.write('rig.json', spec), MidiService(), cache=False)
+            self.assertIn(message, str(raised.exception))
+        with self.assertRaises(PatchError):
+            load_patch(self.write('broken.json', '{"inputs": ['), MidiService())
+
+    def test_lazy_import(self):
+        loaded = subprocess.run(
+            [sys.executable, '-c', 'import sys, morp; print(sorted(sys.modules))'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        for module in ('morp.sequencer', 'morp.midi_service', 'numpy', 'rtmidi'):
+            self.assertNotIn(f"'{module}'", loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
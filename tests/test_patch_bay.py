@@ -0,0 +1,157 @@
+# pylint: disable-all
+import unittest
+from unittest.mock import Mock
+import mido
+import mocks
+from morp import EffectsLoop, MidiBox, MidiService, PatchBay
+from morp import scheduler as scheduler_module
+from morp.effects import Delay, Harmonizer, Shadow
+from morp.scheduler import Scheduler, set_default_scheduler
+
+
+def note(note, velocity=100):
+    return mido.Message('note_on', note=note, velocity=velocity)
+
+
+class Collector(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def on_messages(self, messages):
+        self.received.extend(messages)
+
+
+class TestPatchBay(unittest.TestCase):
+    def setUp(self):
+        self.midi_service = MidiService()
+        self.patch_bay = PatchBay(self.midi_service)
+        self.keys = self.patch_bay.add_input('keys')
+        self.pads = self.patch_bay.add_input('pads')
+        self.synth = self.patch_bay.add_output('synth')
+        self.drums = self.patch_bay.add_output('drums')
+        for midi_out in (self.synth, self.drums):
+            midi_out._output = Mock()
+        self.patch_bay.add_effect('octave', EffectsLoop([Harmonizer(voices={12})]))
+        self.patch_bay.add_effect('fifth', EffectsLoop([Harmonizer(voices={7})]))
+
+    def sent(self, midi_out):
+        return [call.args[0].note for call in midi_out.output.send.call_args_list]
+
+    def test_routing(self):
+        self.patch_bay.connect('keys', 'octave')
+        self.patch_bay.connect('octave', 'fifth')
+        self.patch_bay.connect('fifth', 'synth')
+        self.patch_bay.connect('pads', 'drums')
+        self.patch_bay.apply()
+
+        self.keys.on_message(note(48))
+        self.assertEqual(self.sent(self.synth), [48, 55, 60, 67])
+        self.assertEqual(self.sent(self.drums), [])
+        self.pads.receive([note(36), note(38)])
+        self.assertEqual(self.sent(self.drums), [36, 38])
+
+    def test_duplicates(self):
+        # Both paths send the original note to the synth, but it should only be sent once
+        self.patch_bay.connect('keys', 'octave')
+        self.patch_bay.connect('keys', 'fifth')
+        self.patch_bay.connect('octave', 'synth')
+        self.patch_bay.connect('fifth', 'synth')
+        self.patch_bay.connect('keys', 'synth')
+        self.patch_bay.apply()
+        self.keys.on_message(note(48))
+        self.assertEqual(self.sent(self.synth), [48, 60, 55])
+
+        # Repeats within one path are kept, though the synth drops a note_on for a held note
+        self.synth.output.send.reset_mock()
+        self.patch_bay.disconnect('keys', 'fifth')
+        self.patch_bay.apply()
+        volume = mido.Message('control_change', control=7, value=100)
+        self.patch_bay.route('keys', [volume, volume, note(50), note(50)])
+        self.assertEqual([call.args[0] for call in self.synth.output.send.call_args_list],
+                         [volume, volume, note(50), note(62)])
+
+    def test_panic(self):
+        self.patch_bay.connect('keys', 'octave')
+        self.patch_bay.connect('octave', 'synth')
+        self.patch_bay.apply()
+        self.keys.on_message(note(48))
+        self.synth.output.send.reset_mock()
+
+        self.patch_bay.panic()
+        self.assertEqual([(call.args[0].type, call.args[0].note)
+                          for call in self.synth.output.send.call_args_list],
+                         [('note_off', 48), ('note_off', 60)])
+        self.assertFalse(self.synth._notes_on)
+        self.assertFalse(self.patch_bay._instances['octave'].boxes[0]._notes_on)
+        self.assertEqual(self.sent(self.drums), [])
+
+    def test_cycles(self):
+        self.patch_bay.connect('octave', 'fifth')
+        with self.assertRaisesRegex(ValueError, 'cycle'):
+            self.patch_bay.connect('fifth', 'octave')
+        self.patch_bay.apply()
+        with self.assertRaises(KeyError):
+            self.patch_bay.connect('synth', 'octave')
+        with self.assertRaises(ValueError):
+            self.patch_bay.add_effect('keys', EffectsLoop([]))
+
+    def test_swap(self):
+        self.patch_bay.connect('keys', 'octave')
+        self.patch_bay.connect('octave', 'synth')
+        self.patch_bay.apply()
+        router = self.keys.outputs[0]
+        octave = self.patch_bay._instances['octave']
+        self.keys.on_message(note(48))
+
+        # Running effects keep their state across a reconfiguration
+        self.patch_bay.connect('keys', 'drums')
+        self.patch_bay.apply()
+        self.assertIs(self.keys.outputs[0], router)
+        self.assertIs(self.patch_bay._instances['octave'], octave)
+        self.keys.on_message(note(50))
+        self.assertEqual(self.sent(self.synth), [48, 60, 50, 62])
+        self.assertEqual(self.sent(self.drums), [50])
+
+        self.patch_bay.remove('octave')
+        self.patch_bay.apply()
+        self.assertNotIn('octave', self.patch_bay._instances)
+
+    def test_late_output(self):
+        now = [0.0]
+        scheduler = Scheduler(clock=lambda: now[0])
+        previous = scheduler_module._default
+        set_default_scheduler(scheduler)
+        self.addCleanup(set_default_scheduler, previous)
+        self.patch_bay.add_effect('echo', EffectsLoop([Delay(time=0.25, repeats=1)]))
+        self.patch_bay.connect('keys', 'echo')
+        self.patch_bay.connect('echo', 'octave')
+        self.patch_bay.connect('octave', 'synth')
+        self.patch_bay.apply()
+
+        self.keys.on_message(note(48))
+        self.keys.on_message(mido.Message('note_off', note=48))
+        self.assertEqual(self.sent(self.synth), [48, 60, 48, 60])
+        # The echoes are sent from the scheduler, and still go through the rest of the graph
+        now[0] = 0.3
+        scheduler.advance()
+        self.assertEqual(self.sent(self.synth), [48, 60, 48, 60, 48, 60, 48, 60])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_effects_loop_process(self):
+        messages = [note(40), note(43), mido.Message('note_off', note=40), note(47)]
+        template = EffectsLoop([Harmonizer(voices={12}), Shadow(period=2, repeat=1)])
+        collector = Collector()
+        expected = collector.received
+        midi_in = self.patch_bay.add_input('expected')
+        midi_in.set_outputs([collector])
+        midi_in.assign_fx_loop(template)
+        midi_in.receive(messages)
+        for compiled in (False, True):
+            loop = template.instance()
+            loop.compiled = compiled
+            self.assertEqual(loop.process(messages), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
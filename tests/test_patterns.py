@@ -0,0 +1,141 @@
+# pylint: disable-all
+import os
+import tempfile
+import unittest
+import mido
+import mocks
+from morp import Event, MidiBox, Sequencer
+from morp.patterns import PatternLibrary, decode, encode, save_patterns
+
+
+class Recorder(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.received.append(message)
+
+
+def make_pattern(root):
+    return {
+        0: [mido.Message('note_on', channel=1, note=root, velocity=100),
+            mido.Message('program_change', program=5)],
+        6: [mido.Message('control_change', control=7, value=90),
+            mido.Message('aftertouch', value=33)],
+        12: [mido.Message('note_off', channel=1, note=root),
+             mido.Message('pitchwheel', pitch=-2000)],
+        -3: [mido.Message('note_on', note=1)],
+    }
+
+
+def as_bytes(pattern):
+    return {tick: [message.bytes() for message in messages]
+            for tick, messages in pattern.items()}
+
+
+class TestPatterns(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_encode(self):
+        pattern = make_pattern(60)
+        records = encode(pattern)
+        self.assertEqual(len(records), 6 * 7)
+        decoded = decode(records)
+        # Messages before the first tick are dropped
+        del pattern[-3]
+        self.assertEqual(as_bytes(decoded), as_bytes(pattern))
+        self.assertIsInstance(decoded[0][0], Event)
+        with self.assertRaises(ValueError):
+            encode({0: [mido.Message('sysex', data=[1, 2, 3])]})
+        for message in (mido.Message('songpos', pos=8), mido.Message('song_select', song=2),
+                        mido.Message('tune_request')):
+            with self.assertRaises(ValueError):
+                encode({0: [message]})
+
+    def test_round_trip(self):
+        messages = [mido.Message('note_on', channel=2, note=60, velocity=90),
+                    mido.Message('polytouch', note=60, value=20),
+                    mido.Message('control_change', control=7, value=100),
+                    mido.Message('program_change', program=5),
+                    mido.Message('aftertouch', value=30),
+                    mido.Message('pitchwheel', pitch=-200),
+                    mido.Message('start'), mido.Message('clock'), mido.Message('stop')]
+        decoded = decode(encode({tick: [message] for tick, message in enumerate(messages)}))
+        self.assertEqual([decoded[tick][0].bytes() for tick in range(len(messages))],
+                         [message.bytes() for message in messages])
+
+    def test_library(self):
+        patterns = {f'pattern {i}': make_pattern(i % 128) for i in range(2000)}
+        save_patterns(self.path('library.morp'), patterns)
+        with PatternLibrary(self.path('library.morp')) as library:
+            self.assertEqual(len(library), 2000)
+            self.assertEqual(list(library), list(patterns))
+            pattern = library['pattern 1234']
+            self.assertEqual(len(pattern), 6)
+            self.assertIsNone(pattern._decoded)
+
+            sequencer, recorder = Sequencer(), Recorder()
+            sequencer.set_outputs([recorder])
+            sequencer.load(pattern)
+            self.assertIsNone(pattern._decoded)
+            sequencer.play()
+            self.assertEqual(pattern._decoded[0][0].note, 1234 % 128)
+        # Decoded patterns outlive the library
+        for _ in range(24):
+            sequencer.on_message(mido.Message('clock'))
+        self.assertEqual([message.type for message in recorder.received],
+                         ['note_on', 'program_change', 'control_change', 'aftertouch',
+                          'note_off', 'pitchwheel'])
+
+        with open(self.path('not a pattern file'), 'wb') as file:
+            file.write(b'MThd' + bytes(16))
+        with self.assertRaises(ValueError):
+            PatternLibrary(self.path('not a pattern file'))
+
+    def test_save_and_load(self):
+        sequencer = Sequencer()
+        sequencer.pattern = make_pattern(60)
+        sequencer.save(self.path('pattern.morp'))
+        loaded = Sequencer()
+        loaded.load(self.path('pattern.morp'))
+        del sequencer.pattern['notes'][-3]
+        self.assertEqual(as_bytes(loaded.pattern['notes']),
+                         as_bytes(sequencer.pattern['notes']))
+
+    def test_midi_files(self):
+        sequencer = Sequencer()
+        sequencer.pattern = make_pattern(60)
+        sequencer.save(self.path('pattern.mid'))
+        self.assertEqual(mido.MidiFile(self.path('pattern.mid')).ticks_per_beat, 24)
+        loaded = Sequencer()
+        loaded.load(self.path('pattern.mid'))
+        del sequencer.pattern['notes'][-3]
+        self.assertEqual(as_bytes(loaded.pattern['notes']),
+                         as_bytes(sequencer.pattern['notes']))
+
+        # Other resolutions are rescaled to 24 clocks per quarter note
+        midi_file = mido.MidiFile(ticks_per_beat=480)
+        midi_file.tracks.append(mido.MidiTrack([
+            mido.Message('note_on', note=60, time=0),
+            mido.MetaMessage('set_tempo', tempo=500000, time=240),
+            mido.Message('note_off', note=60, time=0),
+            mido.Message('note_on', note=62, time=10),
+            mido.Message('note_off', note=62, time=480),
+        ]))
+        midi_file.save(self.path('480.mid'))
+        loaded.load(self.path('480.mid'))
+        self.assertEqual({tick: [message.note for message in messages]
+                          for tick, messages in loaded.pattern['notes'].items()},
+                         {0: [60], 12: [60, 62], 36: [62]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# pylint: disable-all
+import threading
+import time
+import unittest
+import mido
+from morp import MidiOut
+from morp.port_writer import PortWriter
+
+
+class StalledPort:
+    """A port that blocks every write until it is released."""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.sent = []
+
+    def write(self, messages):
+        self.released.wait(5)
+        self.sent.extend(messages)
+
+
+def control(value, control=7):
+    return mido.Message('control_change', control=control, value=value)
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class TestPortWriter(unittest.TestCase):
+    def stall(self, overflow, max_size=4):
+        port = StalledPort()
+        writer = PortWriter(port.write, max_size=max_size, overflow=overflow)
+        # The writer thread takes the first message, then stalls while writing it
+        writer.put([control(0)])
+        wait_until(lambda: writer.stats()['depth'] == 0)
+        return port, writer
+
+    def test_drop_oldest(self):
+        port, writer = self.stall('drop_oldest')
+        writer.put([control(value) for value in range(1, 11)])
+        self.assertEqual(writer.stats()['depth'], 4)
+        self.assertEqual(writer.stats()['dropped'], 6)
+        port.released.set()
+        writer.close()
+        self.assertEqual([message.value for message in port.sent], [0, 7, 8, 9, 10])
+        self.assertEqual(writer.stats()['sent'], 5)
+
+    def test_coalesce(self):
+        port, writer = self.stall('coalesce')
+        note = mido.Message('note_on', note=60)
+        writer.put([control(1), note, control(1, control=10), mido.Message('pitchwheel')])
+        writer.put([control(value) for value in range(2, 10)])
+        writer.put([mido.Message('pitchwheel', pitch=100)])
+        self.assertEqual(writer.stats()['coalesced'], 9)
+        self.assertEqual(writer.stats()['dropped'], 0)
+        port.released.set()
+        writer.close()
+        self.assertEqual(port.sent[1:], [control(9), note, control(1, control=10),
+                                         mido.Message('pitchwheel', pitch=100)])
+
+    def test_block(self):
+        port, writer = self.stall('block', max_size=2)
+        producer = threading.Thread(
+            target=lambda: writer.put([control(value) for value in range(1, 6)]))
+        producer.start()
+        wait_until(lambda: writer.stats()['depth'] == 2)
+        self.assertTrue(producer.is_alive())
+        port.released.set()
+        producer.join(5)
+        writer.close()
+        self.assertEqual([message.value for message in port.sent], list(range(6)))
+        self.assertEqual(writer.stats()['dropped'], 0)
+
+    def test_slow_output_does_not_delay_others(self):
+        slow = MidiOut('device 1', queue_size=16, overflow='drop_oldest')
+        port = StalledPort()
+        slow._writer._write = port.write
+        fast = MidiOut('device 2')
+        fast._output = unittest.mock.Mock(name='fast_output')
+
+        start = time.perf_counter()
+        for note in range(100):
+            for midi_out in (slow, fast):
+                midi_out.on_message(mido.Message('note_on', note=note))
+                midi_out.on_message(mido.Message('note_off', note=note))
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(fast.output.send.call_count, 200)
+        self.assertTrue(slow.queued)
+        self.assertGreater(slow.queue_stats()['dropped'], 0)
+        port.released.set()
+        slow._writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
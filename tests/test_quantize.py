@@ -0,0 +1,79 @@
+# pylint: disable-all
+import random
+import unittest
+from unittest.mock import patch
+import mido
+import mocks
+from morp import Sequencer
+from morp import quantize
+from morp.quantize import Quantizer
+
+
+def original_quantize(pattern, resolution, count_in_clocks):
+    # The algorithm that Sequencer used before the quantize module
+    quantized = {}
+    for clock_time in pattern:
+        position = clock_time % resolution
+        nearest_neighbor = \
+            (clock_time - position if position <= resolution // 2
+             else clock_time + (resolution - position)) - count_in_clocks
+        notes = quantized.get(nearest_neighbor, [])
+        quantized[nearest_neighbor] = [*notes, *pattern[clock_time]]
+    return quantized
+
+
+class TestQuantize(unittest.TestCase):
+    def backends(self):
+        yield
+        with patch.object(quantize, 'numpy', None):
+            yield
+
+    def test_original_rounding(self):
+        randomizer = random.Random(1)
+        pattern = {tick: [tick] for tick in randomizer.sample(range(400), 150)}
+        for grid in (5, 6, 12, 24):
+            expected = original_quantize(pattern, grid, 192)
+            for _ in self.backends():
+                self.assertEqual(Quantizer(grid).apply(pattern, offset=192), expected)
+
+    def test_backends_match(self):
+        if quantize.numpy is None:
+            self.skipTest('numpy is not installed')
+        randomizer = random.Random(2)
+        ticks = [randomizer.randrange(-50, 2000) for _ in range(2000)]
+        for quantizer in (Quantizer(6, strength=0.5), Quantizer(12, swing=0.33),
+                          Quantizer(6, strength=0.75, swing=0.2, groove=(0, 1, 0, -1.5))):
+            with patch.object(quantize, 'numpy', None):
+                expected = quantizer.quantize(ticks, offset=96)
+            self.assertEqual(quantizer.quantize(ticks, offset=96), expected)
+
+    def test_options(self):
+        for _ in self.backends():
+            self.assertEqual(Quantizer(6, strength=0.5).quantize([0, 2, 4, 7]), [0, 1, 5, 6])
+            self.assertEqual(Quantizer(6, swing=0.5).quantize([0, 6, 12, 18]), [0, 9, 12, 21])
+            self.assertEqual(Quantizer(6, groove=(0, 1, 0, -1)).quantize([1, 7, 13, 19, 25]),
+                             [0, 7, 12, 17, 24])
+
+
+class TestSequencerQuantize(unittest.TestCase):
+    def test_record_and_requantize(self):
+        sequencer = Sequencer()
+        count_in = sequencer._count_in * sequencer._clocks_per_measure
+        sequencer.record()
+        for tick in range(count_in + 24):
+            if tick in (count_in + 2, count_in + 4, count_in + 13):
+                sequencer.on_message(mido.Message('note_on', note=tick % 128, velocity=100))
+            sequencer.on_message(mido.Message('clock'))
+        sequencer.stop()
+        self.assertEqual(sorted(sequencer.pattern['notes']), [0, 6, 12])
+
+        sequencer.requantize(Quantizer(grid=12))
+        notes = sequencer.pattern['notes']
+        self.assertEqual(sorted(notes), [0, 12])
+        # Ticks halfway between two grid lines go to the earlier one
+        self.assertEqual([message.note for message in notes[0]],
+                         [(count_in + 2) % 128, (count_in + 4) % 128])
+
+
+if __name__ == '__main__':
+    unittest.main()
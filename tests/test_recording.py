@@ -0,0 +1,120 @@
+# pylint: disable-all
+import unittest
+import mido
+import mocks
+from morp import Sequencer
+from morp.events import Event
+from morp.recording import RecordingLog
+
+
+class TestRecordingLog(unittest.TestCase):
+    def test_grows(self):
+        log = RecordingLog(capacity=2)
+        for tick in range(5):
+            log.append(tick, mido.Message('note_on', channel=3, note=60 + tick, velocity=100))
+        self.assertEqual(len(log), 5)
+        self.assertGreaterEqual(log.capacity, 5)
+        pattern = log.to_pattern()
+        self.assertEqual(sorted(pattern), [0, 1, 2, 3, 4])
+        event = pattern[4][0]
+        self.assertIsInstance(event, Event)
+        self.assertEqual((event.type, event.channel, event.note, event.velocity),
+                         ('note_on', 3, 64, 100))
+
+    def test_reserve(self):
+        log = RecordingLog(capacity=0)
+        log.reserve(100)
+        self.assertEqual(log.capacity, 100)
+        log.reserve(10)
+        self.assertEqual(log.capacity, 100)
+        log.append(0, mido.Message('note_on', note=60))
+        self.assertEqual(len(log.to_pattern()[0]), 1)
+
+    def test_other_types(self):
+        log = RecordingLog()
+        log.append(0, mido.Message('control_change', control=7, value=90))
+        log.append(0, mido.Message('aftertouch', value=30))
+        log.append(0, Event('note_off', note=60, velocity=64))
+        self.assertEqual([event.bytes() for event in log.to_pattern()[0]],
+                         [[0xB0, 7, 90], [0xD0, 30], [0x80, 60, 64]])
+
+    def test_takes(self):
+        log = RecordingLog()
+        log.new_take()
+        log.append(0, mido.Message('note_on', note=60))
+        log.new_take()
+        log.append(0, mido.Message('note_on', note=64))
+        log.append(6, mido.Message('note_on', note=67))
+        self.assertEqual(log.takes, 2)
+        self.assertEqual([event.note for event in log.to_pattern()[0]], [60, 64])
+
+        self.assertTrue(log.undo())
+        self.assertEqual(log.to_pattern(), {0: log.to_pattern()[0]})
+        self.assertEqual(len(log), 1)
+        self.assertTrue(log.undo())
+        self.assertFalse(log.undo())
+        self.assertFalse(log)
+
+
+class TestSequencerRecording(unittest.TestCase):
+    def setUp(self):
+        self.sequencer = Sequencer()
+        self.count_in = self.sequencer._count_in * self.sequencer._clocks_per_measure
+
+    def take(self, note, overdub=False):
+        self.sequencer.record(overdub=overdub)
+        for tick in range(self.count_in + 24):
+            if tick == self.count_in + note % 12:
+                self.sequencer.on_message(mido.Message('note_on', note=note, velocity=100))
+            self.sequencer.on_message(mido.Message('clock'))
+        self.sequencer.stop()
+
+    def notes(self):
+        return sorted(message.note for messages in self.sequencer.pattern['notes'].values()
+                      for message in messages)
+
+    def test_overdub_and_undo(self):
+        self.take(60)
+        self.take(64, overdub=True)
+        self.assertEqual(self.notes(), [60, 64])
+        self.sequencer.undo()
+        self.assertEqual(self.notes(), [60])
+
+        # A new take without overdubbing starts over
+        self.take(67)
+        self.assertEqual(self.notes(), [67])
+        self.sequencer.undo()
+        self.assertEqual(self.notes(), [60])
+
+    def test_overdub_loaded_pattern(self):
+        loaded = {0: [mido.Message('note_on', note=60, velocity=100)],
+                  12: [mido.Message('note_off', note=60)]}
+        self.sequencer.pattern = loaded
+        self.take(64, overdub=True)
+        self.assertEqual(self.notes(), [60, 60, 64])
+        self.assertEqual(loaded[0], self.sequencer.pattern['notes'][0])
+        self.take(67, overdub=True)
+        self.assertEqual(self.notes(), [60, 60, 64, 67])
+        self.sequencer.undo()
+        self.sequencer.undo()
+        self.assertEqual(self.sequencer.pattern['notes'], loaded)
+
+    def test_undo_first_take(self):
+        self.sequencer.undo()
+        self.assertIsNone(self.sequencer.pattern)
+        self.take(60)
+        self.sequencer.undo()
+        self.assertIsNone(self.sequencer.pattern)
+        self.assertEqual(self.sequencer._slots, ())
+
+    def test_empty_recording(self):
+        self.take(60)
+        pattern = self.sequencer.pattern['notes']
+        self.sequencer.record()
+        self.sequencer.on_message(mido.Message('clock'))
+        self.sequencer.stop()
+        self.assertEqual(self.sequencer.pattern['notes'], pattern)
+
+
+if __name__ == '__main__':
+    unittest.main()
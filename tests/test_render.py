@@ -0,0 +1,147 @@
+# pylint: disable-all
+import os
+import tempfile
+import unittest
+import mido
+import mocks
+from morp import EffectsLoop, Sequencer
+from morp import ClockMultiplier, MidiBox
+from morp.effects import Autotune, Delay, Harmonizer, NoteLengthLimit
+from morp.render import (MidiFileReader, MidiFileWriter, merge_tracks, render, render_directory,
+                         stream)
+
+
+def make_file(notes=(60, 62, 64), zero_velocity=False):
+    midi_file = mido.MidiFile(ticks_per_beat=96)
+    melody = mido.MidiTrack([mido.MetaMessage('set_tempo', tempo=400000, time=0)])
+    for note in notes:
+        melody.append(mido.Message('note_on', note=note, velocity=100, time=0))
+        if zero_velocity:
+            melody.append(mido.Message('note_on', note=note, velocity=0, time=48))
+        else:
+            melody.append(mido.Message('note_off', note=note, time=48))
+    bass = mido.MidiTrack([mido.Message('note_on', channel=1, note=36, velocity=90, time=24),
+                           mido.Message('note_off', channel=1, note=36, time=200)])
+    midi_file.tracks.extend([melody, bass])
+    return midi_file
+
+
+def notes(messages):
+    return [(tick, message.type, message.note) for tick, message in messages
+            if message.type in ('note_on', 'note_off')]
+
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.loop = EffectsLoop([Harmonizer(voices={12})])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, *names):
+        return os.path.join(self.directory.name, *names)
+
+    def test_merge_tracks(self):
+        self.assertEqual(notes(merge_tracks(make_file())),
+                         [(0, 'note_on', 60), (24, 'note_on', 36), (48, 'note_off', 60),
+                          (48, 'note_on', 62), (96, 'note_off', 62), (96, 'note_on', 64),
+                          (144, 'note_off', 64), (224, 'note_off', 36)])
+
+    def test_writer(self):
+        messages = [(tick, message) for tick, message in merge_tracks(make_file())
+                    if message.type != 'end_of_track']
+        messages.append((300, mido.Message('sysex', data=[1, 2, 3])))
+        with MidiFileWriter(self.path('written.mid'), 96) as writer:
+            for tick, message in messages:
+                writer.write(tick, message)
+        written = mido.MidiFile(self.path('written.mid'))
+        self.assertEqual(written.ticks_per_beat, 96)
+        self.assertEqual(len(written.tracks), 1)
+        self.assertEqual([(tick, message.copy(time=0)) for tick, message in merge_tracks(written)
+                          if message.type != 'end_of_track'],
+                         [(tick, message.copy(time=0)) for tick, message in messages])
+
+    def test_reader(self):
+        # Written with running status and a sysex, and read back without loading the file
+        messages = [(tick, message) for tick, message in merge_tracks(make_file())
+                    if message.type != 'end_of_track']
+        messages.append((300, mido.Message('sysex', data=[1, 2, 3])))
+        with MidiFileWriter(self.path('written.mid'), 96) as writer:
+            for tick, message in messages:
+                writer.write(tick, message)
+        make_file().save(self.path('saved.mid'))
+        for name in ('written.mid', 'saved.mid'):
+            with MidiFileReader(self.path(name)) as reader:
+                loaded = mido.MidiFile(self.path(name))
+                self.assertEqual(reader.ticks_per_beat, loaded.ticks_per_beat)
+                self.assertEqual([list(track) for track in reader.tracks],
+                                 [list(track) for track in loaded.tracks])
+                self.assertEqual(list(merge_tracks(reader)), list(merge_tracks(loaded)))
+        with open(self.path('broken.mid'), 'wb') as file:
+            file.write(b'MThd')
+        with self.assertRaises(OSError):
+            MidiFileReader(self.path('broken.mid'))
+
+    def test_realtime_effects(self):
+        make_file().save(self.path('take.mid'))
+        nested = MidiBox()
+        nested.assign_fx_loop(EffectsLoop([NoteLengthLimit()]))
+        for box in (Delay(), NoteLengthLimit(), ClockMultiplier(), nested):
+            with self.assertRaisesRegex(ValueError, 'real time'):
+                render(self.path('take.mid'), self.path('rendered.mid'),
+                       EffectsLoop([Autotune(scale={0}), box]))
+
+    def test_render(self):
+        make_file().save(self.path('take.mid'))
+        render(self.path('take.mid'), self.path('rendered.mid'), self.loop)
+        rendered = mido.MidiFile(self.path('rendered.mid'))
+        self.assertEqual(notes(merge_tracks(rendered))[:4],
+                         [(0, 'note_on', 60), (0, 'note_on', 72),
+                          (24, 'note_on', 36), (24, 'note_on', 48)])
+        self.assertEqual(rendered.tracks[0][0].type, 'set_tempo')
+        # The loop that was rendered with is left as it was
+        self.assertIsNone(self.loop.boxes[0]._capture)
+        self.assertEqual(len(self.loop.boxes[0]._notes_on), 0)
+
+    def test_zero_velocity_note_offs(self):
+        make_file((60, 60, 60), zero_velocity=True).save(self.path('take.mid'))
+        render(self.path('take.mid'), self.path('rendered.mid'), self.loop)
+        melody = [note for note in notes(merge_tracks(mido.MidiFile(self.path('rendered.mid'))))
+                  if note[2] in (60, 72)]
+        self.assertEqual(melody, [(tick + offset, message_type, note)
+                                  for tick in (0, 48, 96)
+                                  for offset, message_type in ((0, 'note_on'), (48, 'note_off'))
+                                  for note in (60, 72)])
+
+    def test_compact_and_recursive(self):
+        expected = notes(stream(make_file(), self.loop))
+        self.assertEqual(notes(stream(make_file(), self.loop, compiled=False)), expected)
+        self.assertEqual(notes(stream(make_file(), self.loop, compact=False)), expected)
+
+    def test_clock(self):
+        sequencer = Sequencer()
+        sequencer.pattern = {0: [mido.Message('note_on', note=80, velocity=100)],
+                             12: [mido.Message('note_off', note=80)]}
+        loop = EffectsLoop([sequencer])
+        rendered = notes(stream(make_file(), loop, clock=True))
+        # 4 clocks per tick at 96 ticks per beat
+        self.assertIn((0, 'note_on', 80), rendered)
+        self.assertIn((48, 'note_off', 80), rendered)
+        self.assertNotIn('clock', [message.type for _, message in
+                                   stream(make_file(), loop, clock=True)])
+
+    def test_render_directory(self):
+        os.mkdir(self.path('takes'))
+        for number in range(3):
+            make_file((60 + number,)).save(self.path('takes', f'take {number}.mid'))
+        rendered = render_directory(self.path('takes'), self.path('rendered'), self.loop,
+                                    processes=2)
+        self.assertEqual([os.path.basename(path) for path in rendered],
+                         ['take 0.mid', 'take 1.mid', 'take 2.mid'])
+        self.assertEqual(notes(merge_tracks(mido.MidiFile(rendered[2])))[:2],
+                         [(0, 'note_on', 62), (0, 'note_on', 74)])
+
+
+if __name__ == '__main__':
+    unittest.main()
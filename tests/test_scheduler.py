@@ -0,0 +1,212 @@
+# pylint: disable-all
+import random
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+import mido
+import mocks
+from morp import MidiBox, MidiOut
+from morp import scheduler as scheduler_module
+from morp.effects import Delay, NoteLengthLimit
+from morp.scheduler import Scheduler, set_default_scheduler
+
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Collector(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def on_message(self, message):
+        self.received.append((message.type, message.note, message.velocity))
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = ManualClock()
+        self.scheduler = Scheduler(clock=self.clock)
+        self.called = []
+
+    def test_order_and_cancel(self):
+        for delay in (0.5, 0.001, 70.0, 0.3, 0.3):
+            self.scheduler.schedule(delay, self.called.append, delay)
+        timer = self.scheduler.schedule(0.2, self.called.append, 'cancelled')
+        self.assertTrue(timer.pending)
+        self.scheduler.cancel(timer)
+        self.scheduler.cancel(timer)
+        self.assertFalse(timer.pending)
+        self.assertEqual(len(self.scheduler), 5)
+
+        self.assertEqual(self.scheduler.advance(0.3), 3)
+        self.assertEqual(self.called, [0.001, 0.3, 0.3])
+        self.scheduler.advance(69.999)
+        self.assertEqual(self.called, [0.001, 0.3, 0.3, 0.5])
+        self.scheduler.advance(70.0)
+        self.assertEqual(self.called[-1], 70.0)
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_100k_pending(self):
+        generator = random.Random(5)
+        delays = [generator.uniform(0, 120) for _ in range(100000)]
+        start = time.perf_counter()
+        timers = [self.scheduler.schedule(delay, self.called.append, delay) for delay in delays]
+        self.assertEqual(len(self.scheduler), 100000)
+        for timer in timers[::2]:
+            self.scheduler.cancel(timer)
+        self.assertEqual(len(self.scheduler), 50000)
+        while self.clock.now < 120:
+            self.clock.now += 0.5
+            self.scheduler.advance()
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(sorted(self.called), sorted(delays[1::2]))
+        # Callbacks are called in the order they are due, to the tick
+        ticks = [int(delay * 1000) for delay in self.called]
+        self.assertTrue(all(a <= b + 1 for a, b in zip(ticks, ticks[1:])))
+        self.assertLess(elapsed, 10)
+
+    def test_thread(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        called = threading.Event()
+        for _ in range(5):
+            called.clear()
+            scheduler.schedule(0.002, called.set)
+            self.assertTrue(called.wait(1))
+        scheduler.stop()
+        self.assertFalse(scheduler.running)
+
+    def test_concurrent_schedule(self):
+        scheduler = Scheduler()
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        threads = 8
+        for _ in range(50):
+            barrier = threading.Barrier(threads)
+            called = threading.Semaphore(0)
+
+            def schedule():
+                barrier.wait()
+                scheduler.schedule(0.001, called.release)
+
+            workers = [threading.Thread(target=schedule) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            for _ in range(threads):
+                self.assertTrue(called.acquire(timeout=1))
+
+    def test_sleeps_until_due(self):
+        advances = []
+
+        class Counting(Scheduler):
+            def advance(self, now=None):
+                advances.append(now)
+                return super().advance(now)
+
+        scheduler = Counting()
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        called = threading.Event()
+        scheduler.schedule(0.3, called.set)
+        self.assertTrue(called.wait(1))
+        # Only woken for the levels of the wheel coming round, not on every tick
+        self.assertLess(len(advances), 10)
+
+    def test_cancel_after_due(self):
+        handed_over = []
+        self.scheduler.run_on = handed_over.append
+        timer = self.scheduler.schedule(0.01, self.called.append, 'late')
+        self.scheduler.advance(0.02)
+        self.assertTrue(timer.pending)
+        # e.g. a panic that ran on the dispatcher before the callback did
+        self.scheduler.cancel(timer)
+        handed_over[0]()
+        self.assertEqual(self.called, [])
+        self.assertFalse(timer.pending)
+
+
+class TestTimeBasedEffects(unittest.TestCase):
+    def setUp(self):
+        self.clock = ManualClock()
+        previous = scheduler_module._default
+        set_default_scheduler(Scheduler(clock=self.clock))
+        self.addCleanup(set_default_scheduler, previous)
+        self.collector = Collector()
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        scheduler_module._default.advance()
+
+    def test_delay(self):
+        midi_out = MidiOut('synth')
+        midi_out._output = Mock()
+        delay = Delay(time=0.25, repeats=3, decay=0.5)
+        delay.set_outputs([midi_out])
+
+        def sent():
+            calls = midi_out.output.send.call_args_list
+            midi_out.output.send.reset_mock()
+            return [(call.args[0].type, call.args[0].velocity) for call in calls]
+
+        # Held for longer than `time`, so every echo overlaps the note or the echo before it
+        delay.on_message(mido.Message('note_on', note=60, velocity=100))
+        self.assertEqual(sent(), [('note_on', 100)])
+        self.advance(0.25)
+        self.assertEqual(sent(), [('note_off', 0), ('note_on', 50)])
+        self.advance(0.25)
+        self.assertEqual(sent(), [('note_off', 0), ('note_on', 25)])
+        self.advance(0.1)
+        delay.on_message(mido.Message('note_off', note=60, velocity=0))
+        self.assertEqual(sent(), [])
+        self.advance(0.15)
+        self.assertEqual(sent(), [('note_off', 0), ('note_on', 12)])
+        # Each echo is as long as the note, and only the last one releases the pitch
+        self.advance(0.5)
+        self.assertEqual(sent(), [])
+        self.advance(0.1)
+        self.assertEqual(sent(), [('note_off', 0)])
+        self.assertFalse(midi_out._notes_on)
+        self.assertEqual(len(scheduler_module._default), 0)
+
+    def test_delay_panic(self):
+        delay = Delay(time=0.25, repeats=4)
+        delay.set_outputs([self.collector])
+        delay.on_message(mido.Message('note_on', note=60, velocity=100))
+        self.advance(0.3)
+        delay.panic()
+        self.advance(2)
+        self.assertEqual([message[0] for message in self.collector.received],
+                         ['note_on', 'note_off', 'note_on', 'note_off'])
+        self.assertEqual(len(scheduler_module._default), 0)
+
+    def test_note_length_limit(self):
+        limit = NoteLengthLimit(max_length=1.0)
+        limit.set_outputs([self.collector])
+        limit.on_message(mido.Message('note_on', note=60, velocity=100))
+        limit.on_message(mido.Message('note_on', note=64, velocity=100))
+        self.advance(0.5)
+        limit.on_message(mido.Message('note_off', note=64, velocity=0))
+        self.advance(0.6)
+        self.assertEqual(self.collector.received[2:], [('note_off', 64, 0), ('note_off', 60, 0)])
+        self.assertFalse(limit._notes_on)
+        self.assertEqual(len(scheduler_module._default), 0)
+
+        # The note can be played again once it has been released
+        limit.on_message(mido.Message('note_on', note=60, velocity=90))
+        self.assertEqual(self.collector.received[-1], ('note_on', 60, 90))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# pylint: disable-all
+import unittest
+import mido
+from morp import EffectsLoop, MidiBox, Sequencer
+
+
+class Recorder(MidiBox):
+    def __init__(self):
+        self.received = []
+        super().__init__()
+
+    def route_message(self, message, through=False):
+        self.received.append(message)
+
+
+class TestSequencer(unittest.TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        self.sequencer = Sequencer()
+        self.sequencer.set_outputs([self.recorder])
+        self.clock = mido.Message('clock')
+
+    def tick(self, count):
+        for _ in range(count):
+            self.sequencer.on_message(self.clock)
+
+    def test_playback(self):
+        note_on = mido.Message('note_on', note=60, velocity=100)
+        note_off = mido.Message('note_off', note=60)
+        chord = [mido.Message('note_on', note=64, velocity=100),
+                 mido.Message('note_on', note=67, velocity=100)]
+        self.sequencer.pattern = {0: [note_on], 12: [note_off], 24: chord, 500: [note_on]}
+        self.assertEqual(len(self.sequencer._slots), 96)
+
+        self.sequencer.play()
+        self.tick(96)
+        # Stored messages are emitted without being copied
+        self.assertEqual(len(self.recorder.received), 4)
+        self.assertIs(self.recorder.received[0], note_on)
+        self.assertEqual(self.recorder.received[2:], chord)
+
+        # The pattern loops
+        self.recorder.received.clear()
+        self.sequencer._notes_on.clear()
+        self.tick(1)
+        self.assertEqual(self.recorder.received, [note_on])
+
+    def test_instances_keep_their_own_config(self):
+        note_on = mido.Message('note_on', note=60, velocity=100)
+        self.sequencer.pattern = {0: [note_on]}
+        loop = EffectsLoop([self.sequencer])
+        first, second = (loop.instance().boxes[0] for _ in range(2))
+
+        first.quantizer.grid = 12
+        first.pattern['notes'][0].append(mido.Message('note_on', note=64, velocity=100))
+        first.pattern['notes'][24] = [note_on]
+        self.assertEqual(second.quantizer.grid, 6)
+        self.assertEqual(self.sequencer.quantizer.grid, 6)
+        self.assertEqual(second.pattern['notes'], {0: [note_on]})
+        self.assertEqual(self.sequencer.pattern['notes'], {0: [note_on]})
+
+    def test_measures(self):
+        note_on = mido.Message('note_on', note=60, velocity=100)
+        self.sequencer.pattern = {0: [note_on], 100: [note_on.copy(note=62)]}
+        self.sequencer.measures = 2
+        self.assertEqual(len(self.sequencer._slots), 192)
+        self.sequencer.play()
+        self.tick(192)
+        self.assertEqual([message.note for message in self.recorder.received], [60, 62])
+
+    def test_no_pattern(self):
+        self.sequencer.play()
+        self.tick(10)
+        self.assertEqual(self.recorder.received, [])
+
+
+if __name__ == '__main__':
+    unittest.main()